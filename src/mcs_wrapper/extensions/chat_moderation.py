@@ -0,0 +1,186 @@
+from ..utils.config import KVConfig
+from ..utils.aho_corasick import AhoCorasick
+from ..utils.server_parser import is_server_stopped, player_left
+from .listener import Listener, Message
+from dataclasses import dataclass
+import collections
+import os
+import time
+
+CONFIG_NAME = "chat_moderation.cfg"
+_WORD_LIST_HEADER = """# one word or phrase per line, matched case insensitive as whole words
+# add * at the end to also match longer words (e.g. "noob*" matches "noobs")
+"""
+# the word list is checked for changes at most this often
+_CHECK_INTERVAL = 2.0
+
+
+@dataclass
+class ChatModerationConfig(KVConfig):
+    word_list: str = "banned_words.txt"
+    comment1: str = "# actions: none, warn, mute or kick"
+    word_action: str = "warn"
+    spam_action: str = "mute"
+    comment2: str = "# spam: more than max_messages messages within rate_window seconds"
+    max_messages: int = 5
+    rate_window: float = 10.0
+    comment3: str = "# vanilla servers have no mute command, mute_command needs a plugin (e.g. EssentialsX)"
+    mute_command: str = "mute {player} {seconds}s"
+    mute_seconds: int = 300
+    kick_command: str = "kick {player} {reason}"
+    warn_command: str = "tellraw {player} {{\"text\":\"{reason}\",\"color\":\"red\"}}"
+
+
+def _is_word_char(char: str) -> bool:
+    return char.isalnum() or char == "_"
+
+
+class ChatModeration(Listener):
+    # scans chat for banned words with one Aho-Corasick automaton, so the
+    # time per message doesn't grow with the word list, and mutes or kicks
+    # players that send too many messages
+
+    def __init__(self, wrapper):
+        super().__init__(wrapper)
+        self.config = ChatModerationConfig()
+        root = wrapper.get_current_directory()
+        self.config.set_path(os.path.join(root, CONFIG_NAME))
+        self.config.load_config()
+        self.config.save_config()
+
+        # automaton and words ending with *, replaced together when the word list changes
+        self._words: tuple[AhoCorasick, frozenset[str]] = (AhoCorasick(), frozenset())
+        self._word_list_stat = None
+        self._last_check = 0.0
+        self._messages: dict[str, collections.deque] = {}  # player -> times of recent messages
+        self.actions = collections.Counter()
+        self._load_word_list()
+
+        wrapper.add_wrapper_command("moderation", self.command_moderation, "[test <text>] - banned words and actions taken")
+
+    def _word_list_path(self) -> str:
+        return os.path.join(self.wrapper.get_current_directory(), self.config.word_list)
+
+    def _load_word_list(self):
+        path = self._word_list_path()
+        if not os.path.exists(path):
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(_WORD_LIST_HEADER)
+
+        st = os.stat(path)
+        self._word_list_stat = (st.st_mtime_ns, st.st_size)
+        words = set()
+        prefixes = set()
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                word = line.strip().lower()
+                if not word or word.startswith("#"):
+                    continue
+                if word.endswith("*"):
+                    word = word.rstrip("*").strip()
+                    prefixes.add(word)
+                if word:
+                    words.add(word)
+
+        # only the changed words are built into a new automaton next to the
+        # old one, find_words() keeps using the old one until both are swapped in
+        old = self._words[0]
+        old_words = old.words
+        self._words = (old.with_words(words), frozenset(prefixes))
+        added = words - old_words
+        removed = old_words - words
+        if added or removed:
+            print(f"Chat moderation: {len(words)} words ({len(added)} added, {len(removed)} removed)")
+
+    def _check_word_list(self):
+        now = time.monotonic()
+        if now - self._last_check < _CHECK_INTERVAL:
+            return
+        self._last_check = now
+        try:
+            st = os.stat(self._word_list_path())
+        except OSError:
+            return
+        if (st.st_mtime_ns, st.st_size) != self._word_list_stat:
+            self._load_word_list()
+
+    def config_changed(self, changed: set[str]) -> None:
+        if "word_list" in changed:
+            self._load_word_list()
+
+    def find_words(self, text: str) -> list[str]:
+        # banned words in text, whole words only unless the word ends with *
+        automaton, prefixes = self._words
+        text = text.lower()
+        found = []
+        for start, end, word in automaton.find(text):
+            if start > 0 and _is_word_char(text[start - 1]):
+                continue
+            if word not in prefixes and end < len(text) and _is_word_char(text[end]):
+                continue
+            found.append(word)
+        return found
+
+    def _is_spam(self, player: str, now: float) -> bool:
+        # sliding window of the last messages of the player
+        times = self._messages.get(player)
+        if times is None:
+            times = self._messages[player] = collections.deque()
+        times.append(now)
+        while times and now - times[0] > self.config.rate_window:
+            times.popleft()
+        if len(times) > self.config.max_messages:
+            times.clear()
+            return True
+        return False
+
+    def handle_message(self, message: Message) -> None:
+        if not message.is_user_message():
+            content = message.content
+            if content is None:
+                return
+            if is_server_stopped(content):
+                self._messages.clear()
+                return
+            player = player_left(content)
+            if player is not None:
+                self._messages.pop(player, None)
+            return
+        self._check_word_list()
+
+        player = message.author
+        if self._is_spam(player, time.monotonic()):
+            self.take_action(self.config.spam_action, player, "Please don't spam the chat")
+            return
+
+        words = self.find_words(message.user_message)
+        if words:
+            self.take_action(self.config.word_action, player, "Watch your language")
+
+    def take_action(self, action: str, player: str, reason: str):
+        if action == "none":
+            return
+        if action == "warn":
+            command = self.config.warn_command
+        elif action == "mute":
+            command = self.config.mute_command
+        elif action == "kick":
+            command = self.config.kick_command
+        else:
+            print(f"Unknown chat moderation action {action}")
+            return
+        self.actions[action] += 1
+        print(f"Chat moderation: {action} {player} ({reason})")
+        self.wrapper.send_command(command.format(player=player, reason=reason, seconds=self.config.mute_seconds))
+
+    def command_moderation(self, args: str):
+        if args.startswith("test "):
+            words = self.find_words(args[5:])
+            print(f"Matches: {', '.join(words)}" if words else "No banned words")
+            return
+        print(f"{len(self._words[0])} banned words in {self._word_list_path()}")
+        for action, count in self.actions.most_common():
+            print(f"{action:<8} {count}")
+
+    def close(self) -> None:
+        self.wrapper.remove_wrapper_command("moderation")
@@ -0,0 +1,69 @@
+from ..utils.config import KVConfig
+from ..utils.search_index import SearchIndex
+from ..utils.server_parser import player_joined, player_left, player_death
+from .listener import Listener, Message
+from dataclasses import dataclass
+import os
+import time
+
+CONFIG_NAME = "chat_search.cfg"
+INDEX_DIRECTORY = "search_index"
+
+_UNITS = {"m": 60, "h": 3600, "d": 24 * 3600, "w": 7 * 24 * 3600}
+
+
+@dataclass
+class ChatSearchConfig(KVConfig):
+    index_server_messages: bool = False
+    segment_size: int = 5000
+    max_results: int = 20
+
+
+class ChatSearch(Listener):
+    # indexes chat, joins, leaves and deaths so they can be searched with
+    # "!wrapper search <words> [from:<player>] [since:<n>m|h|d|w]"
+
+    def __init__(self, wrapper):
+        super().__init__(wrapper)
+        self.config = ChatSearchConfig()
+        root = wrapper.get_current_directory()
+        self.config.set_path(os.path.join(root, CONFIG_NAME))
+        self.config.load_config()
+        self.config.save_config()
+
+        self.index = SearchIndex(os.path.join(root, INDEX_DIRECTORY), self.config.segment_size)
+        wrapper.add_wrapper_command("search", self.command_search, "<words> [from:<player>] [since:<n>m|h|d|w] - search chat history")
+
+    def handle_message(self, message: Message) -> None:
+        if message.is_user_message():
+            self.index.add(message.author, message.user_message)
+            return
+
+        content = message.content
+        if content is None:
+            return
+        if self.config.index_server_messages or player_joined(content) or player_left(content) or player_death(content):
+            self.index.add("server", content)
+
+    def search(self, query: str, limit: int | None = None, since: float | None = None):
+        return self.index.search(query, limit or self.config.max_results, since)
+
+    def command_search(self, args: str):
+        since = None
+        words = []
+        for term in args.split():
+            if term.startswith("since:") and term[-1] in _UNITS and term[6:-1].isdigit():
+                since = time.time() - int(term[6:-1]) * _UNITS[term[-1]]
+            else:
+                words.append(term)
+
+        start = time.perf_counter()
+        hits = self.search(" ".join(words), since=since)
+        elapsed = time.perf_counter() - start
+        for hit in reversed(hits):
+            print(hit)
+        print(f"{len(hits)} results in {elapsed * 1000:.1f} ms")
+
+    def close(self) -> None:
+        self.wrapper.remove_wrapper_command("search")
+        self.index.close()
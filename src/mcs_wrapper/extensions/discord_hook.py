@@ -28,7 +28,9 @@ class DiscordHook(Logger):
         self.config.set_path(os.path.join(root, CONFIG_NAME))
         self.config.load_config()
         self.config.save_config()
+        self._apply_config()
 
+    def _apply_config(self):
         self.log_all_messages = self.config.log_all_messages
         self.log_player_messages = self.config.log_player_messages
         self.log_player_joins = self.config.log_player_joins
@@ -42,6 +44,9 @@ class DiscordHook(Logger):
             print("Discord hook is disabled. No webhook URL provided.")
         self.fails = 0
 
+    def config_changed(self, changed: set[str]) -> None:
+        self._apply_config()
+
     def send_server_start(self):
         requests.post(self.config.webhook_url, json={"content": "*Server started*"})
 
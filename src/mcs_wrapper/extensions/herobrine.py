@@ -4,6 +4,9 @@ import requests
 import openai
 import os
 from dataclasses import dataclass
+from collections import OrderedDict, deque
+import re
+import threading
 import time
 import random
 
@@ -19,6 +22,23 @@ class HerobrineConfig(KVConfig):
     hurt_players: bool = True
     break_blocks: bool = True
     reply_chance: float = 0.2
+    comment1: str = "# base_url: OpenAI compatible endpoint, None for the default"
+    base_url: str = "None"
+    model: str = "gpt-3.5-turbo"
+    comment2: str = "# replies are generated in the background, messages within coalesce_window seconds get one reply"
+    max_concurrent_requests: int = 2
+    request_timeout: float = 15.0
+    coalesce_window: float = 2.0
+    cache_size: int = 128
+    cache_ttl: float = 600.0
+    comment3: str = "# max_tokens_per_hour: stop replying when this many tokens were used in the last hour, 0 for no limit"
+    max_tokens_per_hour: int = 20000
+
+_NORMALIZE = re.compile(r"[^a-z0-9]+")
+
+def _normalize(text: str) -> str:
+    # "Herobrine, are you there?!" and "herobrine are you there" are the same prompt
+    return _NORMALIZE.sub(" ", text.lower()).strip()
 
 class Herobrine(Listener):
     
@@ -30,14 +50,32 @@ class Herobrine(Listener):
         self.config.load_config()
         self.config.save_config()
         self.instruction = instruction
-        
+
+        self._lock = threading.Lock()
+        self._pending = False  # a reply is scheduled or waiting for a free slot
+        self._timer = None
+        self._active = 0  # requests in flight
+        self._cache: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._token_usage: deque[tuple[float, int]] = deque()
+        self._budget_warned = False
+        self._create_client()
+
+    def _create_client(self):
         self.enabled = self.config.api_key != "None"
         self.client = None
         if self.enabled:
-            self.client = openai.OpenAI(api_key=self.config.api_key)
+            base_url = None if self.config.base_url == "None" else self.config.base_url
+            # no retries, a late reply is worse than no reply
+            self.client = openai.OpenAI(api_key=self.config.api_key, base_url=base_url,
+                                        timeout=self.config.request_timeout, max_retries=0)
         else:
             print("Herobrine extension is disabled. No API key provided.")
 
+    def config_changed(self, changed: set[str]) -> None:
+        # other values are read from the config when they are used
+        if changed & {"api_key", "base_url", "request_timeout"}:
+            self._create_client()
+
     def handle_message(self, message: Message) -> None:
         if not self.enabled:
             return
@@ -67,9 +105,84 @@ class Herobrine(Listener):
             self.random_action(player)
             return
 
-        response = self.generate_spooky_text(messages)
-        if response:
-            self.send_message(response)
+        self.request_reply()
+
+    # reply pipeline
+    # handle_message runs on the reader thread, so replies are generated in
+    # background threads. All messages within coalesce_window seconds get one
+    # reply, at most max_concurrent_requests are in flight at once.
+
+    def request_reply(self) -> None:
+        with self._lock:
+            if self._pending:
+                return
+            self._pending = True
+            self._timer = threading.Timer(self.config.coalesce_window, self._start_reply)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _start_reply(self) -> None:
+        with self._lock:
+            self._timer = None
+            if self._active >= self.config.max_concurrent_requests:
+                # started again when a request finishes
+                return
+            self._pending = False
+            self._active += 1
+        threading.Thread(target=self._reply, daemon=True, name="herobrine").start()
+
+    def _reply(self) -> None:
+        try:
+            messages = self.wrapper.get_chat_history(5)
+            if len(messages) > 0:
+                response = self.generate_spooky_text(messages)
+                if response:
+                    self.send_message(response)
+        finally:
+            with self._lock:
+                self._active -= 1
+                waiting = self._pending and self._timer is None
+            if waiting:
+                self._start_reply()
+
+    def _cache_key(self, messages: list[Message]) -> str:
+        return _normalize(messages[-1].content)
+
+    def _cached_reply(self, key: str) -> str | None:
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] > self.config.cache_ttl:
+                del self._cache[key]
+                return None
+            self._cache.move_to_end(key)
+            return entry[1]
+
+    def _cache_reply(self, key: str, reply: str) -> None:
+        with self._lock:
+            self._cache[key] = (time.monotonic(), reply)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.config.cache_size:
+                self._cache.popitem(last=False)
+
+    def tokens_used(self) -> int:
+        # tokens used in the last hour
+        with self._lock:
+            cutoff = time.monotonic() - 3600
+            while self._token_usage and self._token_usage[0][0] < cutoff:
+                self._token_usage.popleft()
+            return sum(tokens for _, tokens in self._token_usage)
+
+    def _over_budget(self) -> bool:
+        budget = self.config.max_tokens_per_hour
+        if budget <= 0 or self.tokens_used() < budget:
+            self._budget_warned = False
+            return False
+        if not self._budget_warned:
+            print("Herobrine used all tokens for this hour, not replying")
+            self._budget_warned = True
+        return True
 
     def play_spooky_sound(self, player: str = "@a") -> None:
         sounds = [
@@ -127,9 +240,16 @@ class Herobrine(Listener):
         action(player)
 
     def generate_spooky_text(self, messages: list[Message]) -> str | None:
+        key = self._cache_key(messages)
+        cached = self._cached_reply(key)
+        if cached is not None:
+            return cached
+        if self._over_budget():
+            return None
+
         try:
             completion = self.client.chat.completions.create(
-                model="gpt-3.5-turbo",
+                model=self.config.model,
                 messages=[
                     {"role": "system", "content": self.instruction},
                     *[
@@ -143,11 +263,20 @@ class Herobrine(Listener):
                 max_tokens=64,
                 temperature=1.3
             )
-            if completion.choices[0].message.content.startswith("<Herobrine> "):
-                return completion.choices[0].message.content[12:]
-            return completion.choices[0].message.content
+            # not every compatible endpoint reports usage
+            usage = getattr(completion, "usage", None)
+            if usage is not None:
+                with self._lock:
+                    self._token_usage.append((time.monotonic(), getattr(usage, "total_tokens", 0) or 0))
+            reply = completion.choices[0].message.content
+            if reply is None:
+                return None
+            if reply.startswith("<Herobrine> "):
+                reply = reply[12:]
+            self._cache_reply(key, reply)
+            return reply
         except Exception as e:
-            print("Failed to generate text")
+            print(f"Failed to generate text: {e}")
             return None
 
     def send_message(self, message: str) -> None:
@@ -162,6 +291,14 @@ class Herobrine(Listener):
         
         # add this message to the log[22:58:59] [Server thread/INFO]:
         fake_log = f"[{time.strftime('%H:%M:%S')}] [Server thread/INFO]: <Herobrine> {message}"
-        self.wrapper._handle_line(fake_log)
+        # called from the reply threads, _handle_lines takes the dispatch lock
+        self.wrapper._handle_lines([fake_log])
         
-        self.wrapper.send_command(f"tellraw @a \"<Herobrine> {message}\"")
\ No newline at end of file
+        self.wrapper.send_command(f"tellraw @a \"<Herobrine> {message}\"")
+
+    def close(self) -> None:
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            self._pending = False
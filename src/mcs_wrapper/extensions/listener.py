@@ -25,7 +25,8 @@ class Message:
 class AbstractWrapper(ABC):
 
     @abstractmethod
-    def send_command(self, command:str) -> None:
+    def send_command(self, command:str) -> str|None:
+        # returns the reply of the server if the command was sent over RCON
         pass
 
     @abstractmethod
@@ -40,6 +41,18 @@ class Listener:
     def handle_message(self, message:Message) -> None:
         pass
 
+    def server_stopping(self) -> None:
+        # called right before the wrapper sends "stop", the server still takes commands
+        pass
+
+    def config_changed(self, changed:set[str]) -> None:
+        # called after self.config (a KVConfig) was reloaded because its file changed
+        pass
+
+    def close(self) -> None:
+        # called when the extension is removed or the wrapper shuts down
+        pass
+
 
 class Logger(Listener):
 
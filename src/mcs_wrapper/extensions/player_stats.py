@@ -0,0 +1,287 @@
+from ..utils.config import KVConfig
+from ..utils.server_parser import player_joined, player_left, player_death_details, is_server_ready, is_server_stopped
+from .listener import Listener, Message
+from dataclasses import dataclass
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+CONFIG_NAME = "player_stats.cfg"
+DATABASE_NAME = "player_stats.db"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS players (
+    player TEXT PRIMARY KEY,
+    first_seen REAL,
+    last_seen REAL,
+    sessions INTEGER DEFAULT 0,
+    playtime REAL DEFAULT 0,
+    deaths INTEGER DEFAULT 0,
+    messages INTEGER DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS sessions (player TEXT, joined REAL, left REAL);
+CREATE TABLE IF NOT EXISTS deaths (player TEXT, time REAL, cause TEXT, killer TEXT);
+CREATE TABLE IF NOT EXISTS chat (player TEXT, day TEXT, messages INTEGER, PRIMARY KEY (player, day));
+CREATE TABLE IF NOT EXISTS online (player TEXT PRIMARY KEY, joined REAL, seen REAL);
+CREATE INDEX IF NOT EXISTS sessions_player ON sessions (player);
+CREATE INDEX IF NOT EXISTS deaths_player ON deaths (player);
+"""
+
+
+@dataclass
+class PlayerStatsConfig(KVConfig):
+    flush_interval: float = 5.0
+    batch_size: int = 500
+
+
+class PlayerStats(Listener):
+    # aggregates sessions, playtime, deaths and chat volume per player
+    # events are queued and written by a background thread in one
+    # transaction per batch, so handle_message never touches the disk.
+    # Open sessions are saved in the online table and their time is updated
+    # every flush_interval. Sessions left open by a crash of the wrapper are
+    # closed at that time on the next server start or when the player joins
+    # again, or continued if the player leaves a server that kept running.
+
+    def __init__(self, wrapper):
+        super().__init__(wrapper)
+        self.config = PlayerStatsConfig()
+        root = wrapper.get_current_directory()
+        self.config.set_path(os.path.join(root, CONFIG_NAME))
+        self.config.load_config()
+        self.config.save_config()
+
+        self.path = os.path.join(root, DATABASE_NAME)
+        connection = self._connect()
+        connection.executescript(_SCHEMA)
+        # player -> (join time, last time seen online) of sessions of the last run
+        self._stale: dict[str, tuple[float, float]] = {
+            player: (joined, seen) for player, joined, seen in connection.execute("SELECT player, joined, seen FROM online")}
+        connection.close()
+
+        self.online: dict[str, float] = {}  # player -> join time
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="player_stats")
+        self._thread.start()
+
+        wrapper.add_wrapper_command("players", self.command_players, "[playtime|deaths|chat|<player>] - player statistics")
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=10)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    # events
+
+    def handle_message(self, message: Message) -> None:
+        now = time.time()
+        if message.is_user_message():
+            self._queue.put(("chat", message.author, now))
+            return
+
+        content = message.content
+        if content is None:
+            return
+
+        player = player_joined(content)
+        if player is not None:
+            self._end_stale_session(player)
+            self.online[player] = now
+            self._queue.put(("join", player, now))
+            return
+
+        player = player_left(content)
+        if player is not None:
+            if player not in self.online and player in self._stale:
+                # joined before the wrapper was restarted, the server kept running
+                self.online[player] = self._stale.pop(player)[0]
+            self._end_session(player, now)
+            return
+
+        death = player_death_details(content)
+        if death is not None:
+            self._queue.put(("death", death[0], now, death[1], death[2]))
+            return
+
+        if is_server_stopped(content):
+            for player in list(self.online):
+                self._end_session(player, now)
+            return
+
+        if is_server_ready(content):
+            # a new server process, nobody of the last run is online anymore
+            for player in list(self._stale):
+                self._end_stale_session(player)
+
+    def _end_session(self, player: str, now: float):
+        joined = self.online.pop(player, None)
+        if joined is not None:
+            self._queue.put(("session", player, joined, now))
+
+    def _end_stale_session(self, player: str):
+        # ends when the player was last seen online
+        stale = self._stale.pop(player, None)
+        if stale is not None:
+            self._queue.put(("session", player, stale[0], stale[1]))
+
+    # writer
+
+    def _run(self):
+        connection = self._connect()
+        current = set()  # players with a session of this run in the online table
+        last_touch = time.monotonic()
+        running = True
+        while running:
+            if time.monotonic() - last_touch >= self.config.flush_interval:
+                self._touch(connection, current)
+                last_touch = time.monotonic()
+            try:
+                events = [self._queue.get(timeout=self.config.flush_interval)]
+            except queue.Empty:
+                continue
+            # wait a bit so more events end up in the same transaction
+            deadline = time.monotonic() + 0.5
+            while len(events) < self.config.batch_size and time.monotonic() < deadline:
+                try:
+                    events.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            if None in events:
+                running = False
+                events = [event for event in events if event is not None]
+            try:
+                self._write(connection, events, current)
+            except sqlite3.Error as e:
+                print(f"Failed to save player stats: {e}")
+        connection.close()
+
+    def _touch(self, connection: sqlite3.Connection, current: set[str]):
+        # players of this run are still online, a crash ends their sessions here
+        if not current:
+            return
+        try:
+            with connection:
+                connection.executemany("UPDATE online SET seen = ? WHERE player = ?", [(time.time(), player) for player in current])
+        except sqlite3.Error as e:
+            print(f"Failed to save player stats: {e}")
+
+    def _write(self, connection: sqlite3.Connection, events: list[tuple], current: set[str]):
+        players = []
+        sessions = []
+        deaths = []
+        chat = {}
+        for event in events:
+            kind, player, now = event[0], event[1], event[2]
+            if kind == "join":
+                current.add(player)
+            elif kind == "session":
+                now = event[3]
+                sessions.append((player, event[2], now))
+                current.discard(player)
+            elif kind == "death":
+                deaths.append((player, now, event[3], event[4]))
+            elif kind == "chat":
+                key = (player, time.strftime("%Y-%m-%d", time.localtime(now)))
+                chat[key] = chat.get(key, 0) + 1
+            players.append((player, now, now))
+
+        with connection:
+            connection.executemany(
+                "INSERT INTO players (player, first_seen, last_seen) VALUES (?, ?, ?) "
+                "ON CONFLICT (player) DO UPDATE SET last_seen = MAX(last_seen, excluded.last_seen)", players)
+            connection.executemany("INSERT INTO sessions VALUES (?, ?, ?)", sessions)
+            # in event order, a stale session is ended right before the player joins again
+            for event in events:
+                if event[0] == "session":
+                    connection.execute("DELETE FROM online WHERE player = ?", (event[1],))
+                elif event[0] == "join":
+                    connection.execute("INSERT OR REPLACE INTO online VALUES (?, ?, ?)", (event[1], event[2], event[2]))
+            connection.executemany(
+                "UPDATE players SET sessions = sessions + 1, playtime = playtime + (? - ?) WHERE player = ?",
+                [(left, joined, player) for player, joined, left in sessions])
+            connection.executemany("INSERT INTO deaths VALUES (?, ?, ?, ?)", deaths)
+            connection.executemany("UPDATE players SET deaths = deaths + 1 WHERE player = ?", [(d[0],) for d in deaths])
+            connection.executemany(
+                "INSERT INTO chat VALUES (?, ?, ?) ON CONFLICT (player, day) DO UPDATE SET messages = messages + excluded.messages",
+                [(player, day, count) for (player, day), count in chat.items()])
+            connection.executemany(
+                "UPDATE players SET messages = messages + ? WHERE player = ?",
+                [(count, player) for (player, _), count in chat.items()])
+
+    # queries
+
+    def _query(self, sql: str, args=()) -> list[tuple]:
+        connection = self._connect()
+        try:
+            return connection.execute(sql, args).fetchall()
+        finally:
+            connection.close()
+
+    def top_playtime(self, n: int = 10) -> list[tuple[str, float]]:
+        # includes the current session of online players
+        now = time.time()
+        rows = dict(self._query("SELECT player, playtime FROM players ORDER BY playtime DESC LIMIT ?", (n + len(self.online),)))
+        for player, joined in list(self.online.items()):
+            rows[player] = rows.get(player, 0.0) + now - joined
+        return sorted(rows.items(), key=lambda row: row[1], reverse=True)[:n]
+
+    def top_deaths(self, n: int = 10) -> list[tuple[str, int]]:
+        return self._query("SELECT player, deaths FROM players WHERE deaths > 0 ORDER BY deaths DESC LIMIT ?", (n,))
+
+    def top_chatters(self, n: int = 10, days: int | None = None) -> list[tuple[str, int]]:
+        if days is None:
+            return self._query("SELECT player, messages FROM players WHERE messages > 0 ORDER BY messages DESC LIMIT ?", (n,))
+        since = time.strftime("%Y-%m-%d", time.localtime(time.time() - days * 24 * 3600))
+        return self._query("SELECT player, SUM(messages) AS total FROM chat WHERE day >= ? "
+                           "GROUP BY player ORDER BY total DESC LIMIT ?", (since, n))
+
+    def deaths_by_cause(self, player: str | None = None, n: int = 10) -> list[tuple[str, str | None, int]]:
+        if player is None:
+            return self._query("SELECT cause, killer, COUNT(*) AS total FROM deaths "
+                               "GROUP BY cause, killer ORDER BY total DESC LIMIT ?", (n,))
+        return self._query("SELECT cause, killer, COUNT(*) AS total FROM deaths WHERE player = ? "
+                           "GROUP BY cause, killer ORDER BY total DESC LIMIT ?", (player, n))
+
+    def player_summary(self, player: str) -> dict | None:
+        rows = self._query("SELECT first_seen, last_seen, sessions, playtime, deaths, messages FROM players WHERE player = ?", (player,))
+        if not rows:
+            return None
+        first_seen, last_seen, sessions, playtime, deaths, messages = rows[0]
+        if player in self.online:
+            playtime += time.time() - self.online[player]
+        return {"first_seen": first_seen, "last_seen": last_seen, "sessions": sessions,
+                "playtime": playtime, "deaths": deaths, "messages": messages, "online": player in self.online}
+
+    def command_players(self, args: str):
+        if args in ("", "playtime"):
+            for player, playtime in self.top_playtime():
+                print(f"{player:<16} {playtime / 3600:8.1f} h")
+        elif args == "deaths":
+            for player, deaths in self.top_deaths():
+                print(f"{player:<16} {deaths:8}")
+            for cause, killer, total in self.deaths_by_cause():
+                print(f"{total:8}  {cause.replace('<killer>', killer or '?')}")
+        elif args == "chat":
+            for player, messages in self.top_chatters():
+                print(f"{player:<16} {messages:8}")
+        else:
+            summary = self.player_summary(args)
+            if summary is None:
+                print(f"No stats for {args}")
+                return
+            print(f"{args}: {summary['playtime'] / 3600:.1f} h in {summary['sessions']} sessions, "
+                  f"{summary['deaths']} deaths, {summary['messages']} messages"
+                  f"{' (online)' if summary['online'] else ''}")
+            for cause, killer, total in self.deaths_by_cause(args, 5):
+                print(f"{total:8}  {cause.replace('<killer>', killer or '?')}")
+
+    def close(self) -> None:
+        self.wrapper.remove_wrapper_command("players")
+        now = time.time()
+        for player in list(self.online):
+            self._end_session(player, now)
+        self._queue.put(None)
+        self._thread.join()
@@ -0,0 +1,163 @@
+# Plugin discovery
+# third party packages can provide listeners through entry points, e.g. in pyproject.toml:
+#
+#   [project.entry-points."mcs_wrapper.plugins"]
+#   my_plugin = "my_package.module:MyListener"
+#
+# plugins in the "mcs_wrapper.plugins" group get every message. To only get some
+# events, register in "mcs_wrapper.plugins.<event>" instead, where event is one of
+# EVENT_TYPES. Only the entry point metadata is read at startup, the plugin is
+# imported and created when the first message it is interested in arrives.
+# From then on it is treated like any other listener: its config file is
+# watched and it gets server_stopping() and close().
+
+import time
+from importlib.metadata import entry_points
+from .listener import Listener, Message
+from ..utils.server_parser import is_server_ready, is_server_stopped, player_joined, player_left, player_death
+
+PLUGIN_GROUP = "mcs_wrapper.plugins"
+EVENT_TYPES = ["chat", "join", "leave", "death", "ready", "stopped"]
+
+
+def get_event_type(message: Message) -> str | None:
+    if message.is_user_message():
+        return "chat"
+    content = message.content
+    if content is None:
+        return None
+    if player_joined(content) is not None:
+        return "join"
+    if player_left(content) is not None:
+        return "leave"
+    if is_server_ready(content):
+        return "ready"
+    if is_server_stopped(content):
+        return "stopped"
+    if player_death(content) is not None:
+        return "death"
+    return None
+
+
+class PluginInfo:
+    def __init__(self, name: str, entry_point, distribution: str | None = None):
+        self.name = name
+        self.entry_point = entry_point
+        self.distribution = distribution
+        self.events: set[str] = set()  # empty means all messages
+        self.listener: Listener | None = None
+        self.failed = False
+
+    def load(self, wrapper) -> Listener | None:
+        if self.listener is None and not self.failed:
+            try:
+                listener_class = self.entry_point.load()
+                self.listener = listener_class(wrapper)
+                print(f"Loaded plugin {self.name}")
+            except Exception as e:
+                print(f"Failed to load plugin {self.name}: {e}")
+                self.failed = True
+        return self.listener
+
+
+def discover_plugins(disabled: set[str] = None) -> dict[str, PluginInfo]:
+    # read the entry points of all installed plugins, without importing them
+    disabled = disabled or set()
+    plugins: dict[str, PluginInfo] = {}
+    groups = [(PLUGIN_GROUP, None)] + [(f"{PLUGIN_GROUP}.{event}", event) for event in EVENT_TYPES]
+    for group, event in groups:
+        for entry_point in entry_points(group=group):
+            if entry_point.name in disabled:
+                continue
+            info = plugins.get(entry_point.name)
+            if info is None:
+                distribution = entry_point.dist.name if entry_point.dist else None
+                info = plugins[entry_point.name] = PluginInfo(entry_point.name, entry_point, distribution)
+                if event is not None:
+                    info.events.add(event)
+            elif event is not None and info.events:
+                info.events.add(event)
+            elif event is None:
+                # registered for all messages as well
+                info.events.clear()
+    return plugins
+
+
+class PluginManager(Listener):
+    # dispatches messages to plugins and loads them on demand
+
+    def __init__(self, wrapper, disabled: set[str] = None):
+        super().__init__(wrapper)
+        self.plugins = discover_plugins(disabled)
+        self._all: list[PluginInfo] = []
+        self._by_event: dict[str, list[PluginInfo]] = {}
+        for plugin in self.plugins.values():
+            if not plugin.events:
+                self._all.append(plugin)
+            for event in plugin.events:
+                self._by_event.setdefault(event, []).append(plugin)
+
+    def handle_message(self, message: Message) -> None:
+        for plugin in self._all:
+            self._dispatch(plugin, message)
+
+        if not self._by_event:
+            return
+        event = get_event_type(message)
+        if event is None:
+            return
+        for plugin in self._by_event.get(event, ()):
+            self._dispatch(plugin, message)
+
+    def _dispatch(self, plugin: PluginInfo, message: Message):
+        # with listener stats on, every plugin is recorded under its own
+        # name (including the lazy load) instead of all under PluginManager
+        profiler = self.wrapper.profiler
+        if profiler is None:
+            self._handle(plugin, message)
+            return
+        start = time.perf_counter()
+        self._handle(plugin, message)
+        profiler.record(plugin.name, time.perf_counter() - start, message)
+
+    def _handle(self, plugin: PluginInfo, message: Message):
+        listener = plugin.listener
+        if listener is None:
+            listener = plugin.load(self.wrapper)
+            if listener is None:
+                return
+            self.wrapper._watch_listener_config(listener)
+        try:
+            listener.handle_message(message)
+        except Exception as e:
+            print(f"Plugin {plugin.name} failed to handle message: {e}")
+
+    def _loaded(self) -> list[PluginInfo]:
+        return [plugin for plugin in self.plugins.values() if plugin.listener is not None]
+
+    def server_stopping(self) -> None:
+        for plugin in self._loaded():
+            try:
+                plugin.listener.server_stopping()
+            except Exception as e:
+                print(f"Plugin {plugin.name} failed to prepare for the stop: {e}")
+
+    def close(self) -> None:
+        for plugin in self._loaded():
+            listener = plugin.listener
+            plugin.listener = None
+            self.wrapper._unwatch_listener_config(listener)
+            try:
+                listener.close()
+            except Exception as e:
+                print(f"Plugin {plugin.name} failed to close: {e}")
+
+    def describe(self) -> str:
+        if not self.plugins:
+            return "No plugins installed"
+        lines = []
+        for plugin in self.plugins.values():
+            state = "failed" if plugin.failed else "loaded" if plugin.listener else "not loaded"
+            events = ", ".join(sorted(plugin.events)) or "all"
+            lines.append(f"{plugin.name} ({plugin.distribution or 'unknown'}): {state}, events: {events}")
+        return "\n".join(lines)
@@ -0,0 +1,256 @@
+from ..utils.config import KVConfig
+from ..utils.server_parser import is_server_stopped, player_joined, player_left, player_list, server_lag
+from .listener import Listener, Message
+from dataclasses import dataclass
+import json
+import math
+import os
+import threading
+import time
+
+CONFIG_NAME = "pregen.cfg"
+PROGRESS_NAME = "pregen_progress.json"
+
+
+@dataclass
+class PregenConfig(KVConfig):
+    comment1: str = "# generates the chunks around center_x/center_z (blocks) up to radius chunks, in tiles of tile_size x tile_size chunks"
+    center_x: int = 0
+    center_z: int = 0
+    radius: int = 64
+    tile_size: int = 4
+    dimension: str = "minecraft:overworld"
+    comment2: str = "# seconds a tile stays force loaded, doubled (up to max_interval) when the server can't keep up"
+    interval: float = 5.0
+    max_interval: float = 60.0
+    comment3: str = "# only generate while at most max_players players are online, pause lag_pause seconds after a lag warning"
+    max_players: int = 0
+    lag_pause: float = 60.0
+
+
+def spiral(n: int) -> tuple[int, int]:
+    # n-th position of a square spiral around (0, 0), so generation can
+    # continue at any index without walking the spiral from the start
+    if n == 0:
+        return 0, 0
+    k = (math.isqrt(n) + 1) // 2  # ring
+    side = 2 * k
+    last = (2 * k + 1) ** 2 - 1  # last index of this ring
+    if n > last - side:
+        return k - (last - n), -k
+    last -= side
+    if n > last - side:
+        return -k, -k + (last - n)
+    last -= side
+    if n > last - side:
+        return -k + (last - n), k
+    last -= side
+    return k, k - (last - n)
+
+
+class WorldPregen(Listener):
+    # force loads the world tile by tile in a spiral around the center, so
+    # the server generates the chunks while nobody is playing. The index of
+    # the next tile and the tile that is force loaded are saved, generation
+    # continues after a restart and a tile left loaded by a crash is removed.
+    # Forceload tickets are saved with the world, a tile must never stay loaded
+
+    def __init__(self, wrapper):
+        super().__init__(wrapper)
+        self.config = PregenConfig()
+        root = wrapper.get_current_directory()
+        self.config.set_path(os.path.join(root, CONFIG_NAME))
+        self.config.load_config()
+        self.config.save_config()
+        self.progress_path = os.path.join(root, PROGRESS_NAME)
+
+        # index and _loaded are changed by the pregen thread, commands and config reloads
+        self._lock = threading.RLock()
+        self.online: set[str] = set()
+        self.paused = False
+        self.index = 0
+        self._loaded = None  # [dimension, x1, z1, x2, z2] that is force loaded right now
+        self._lag_until = 0.0
+        self._interval = self.config.interval
+        self._was_ready = False
+        self._load_progress()
+
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="pregen")
+        self._thread.start()
+
+        wrapper.add_wrapper_command("pregen", self.command_pregen, "[pause|resume|reset] - world pre-generation progress")
+
+    # progress
+
+    def _settings(self) -> dict:
+        # progress is only valid for the same area
+        c = self.config
+        return {"center_x": c.center_x, "center_z": c.center_z, "radius": c.radius, "tile_size": c.tile_size, "dimension": c.dimension}
+
+    def _load_progress(self):
+        with self._lock:
+            self.index = 0
+            try:
+                with open(self.progress_path) as f:
+                    progress = json.load(f)
+            except (OSError, ValueError):
+                return
+            if progress.get("settings") == self._settings():
+                self.index = progress.get("index", 0)
+            # the loaded tile has to be removed even if the area changed
+            self._loaded = progress.get("loaded")
+
+    def _save_progress(self):
+        tmp_path = self.progress_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"settings": self._settings(), "index": self.index, "loaded": self._loaded}, f)
+        os.replace(tmp_path, self.progress_path)
+
+    def total_tiles(self) -> int:
+        tiles = math.ceil(self.config.radius / self.config.tile_size)
+        return (2 * tiles + 1) ** 2
+
+    def config_changed(self, changed: set[str]) -> None:
+        with self._lock:
+            if changed & set(self._settings()):
+                self._unload()
+                self._load_progress()
+            if "interval" in changed:
+                self._interval = self.config.interval
+
+    # events
+
+    def handle_message(self, message: Message) -> None:
+        content = message.content
+        if content is None or message.is_user_message():
+            return
+        if is_server_stopped(content):
+            # a tile that is still loaded is removed after the next start
+            self.online.clear()
+            return
+
+        player = player_joined(content)
+        if player is not None:
+            self.online.add(player)
+            return
+        player = player_left(content)
+        if player is not None:
+            self.online.discard(player)
+            return
+        players = player_list(content)
+        if players is not None:
+            self.online = set(players)
+            return
+
+        if server_lag(content) is not None:
+            # back off, the server is busy
+            self._lag_until = time.monotonic() + self.config.lag_pause
+            self._interval = min(self._interval * 2, self.config.max_interval)
+
+    def server_stopping(self) -> None:
+        self._unload()
+
+    # generation
+
+    def can_generate(self) -> bool:
+        return (self.wrapper.is_server_ready() and not self.paused
+                and len(self.online) <= self.config.max_players
+                and time.monotonic() >= self._lag_until
+                and self.index < self.total_tiles())
+
+    def _run(self):
+        while not self._stop_event.wait(self._interval):
+            ready = self.wrapper.is_server_ready()
+            if ready and not self._was_ready:
+                # enabled or attached while players may already be online,
+                # wait for the answer before the first tile
+                self._was_ready = True
+                self._refresh_online()
+                continue
+            self._was_ready = ready
+            if self.can_generate():
+                self._step()
+            else:
+                self._unload()
+
+    def _refresh_online(self):
+        # over RCON the reply comes back here, over stdin it is printed
+        # and handled in handle_message
+        reply = self.wrapper.send_command("list")
+        players = player_list(reply) if reply else None
+        if players is not None:
+            self.online = set(players)
+
+    def _tile_area(self, index: int) -> list:
+        # block coordinates of a tile, for forceload
+        size = self.config.tile_size
+        tx, tz = spiral(index)
+        chunk_x = (self.config.center_x >> 4) + tx * size - size // 2
+        chunk_z = (self.config.center_z >> 4) + tz * size - size // 2
+        return [self.config.dimension, chunk_x * 16, chunk_z * 16, (chunk_x + size) * 16 - 1, (chunk_z + size) * 16 - 1]
+
+    def _forceload(self, action: str, area: list):
+        dimension, x1, z1, x2, z2 = area
+        self.wrapper.send_command(f"execute in {dimension} run forceload {action} {x1} {z1} {x2} {z2}")
+
+    def _unload(self):
+        # only while the server takes commands, otherwise it stays saved for later
+        with self._lock:
+            if self._loaded is None or not self.wrapper.is_server_ready():
+                return
+            self._forceload("remove", self._loaded)
+            self._loaded = None
+            self._save_progress()
+
+    def _step(self):
+        with self._lock:
+            # the previous tile had `interval` seconds to generate
+            self._unload()
+            area = self._tile_area(self.index)
+            self._loaded = area
+            self.index += 1
+            # saved before the command, a crash right after it still knows the tile
+            self._save_progress()
+            self._forceload("add", area)
+        # no lag warning since the last step, speed up again
+        self._interval = max(self.config.interval, self._interval * 0.8)
+
+        if self.index >= self.total_tiles():
+            print("World pre-generation finished")
+        elif self.index % 100 == 0:
+            print(f"World pre-generation: {self.progress():.1f}%")
+
+    def progress(self) -> float:
+        return 100.0 * min(self.index, self.total_tiles()) / self.total_tiles()
+
+    def command_pregen(self, args: str):
+        if args == "pause":
+            self.paused = True
+        elif args == "resume":
+            self.paused = False
+        elif args == "reset":
+            with self._lock:
+                self._unload()
+                self.index = 0
+                self._save_progress()
+
+        if self.index >= self.total_tiles():
+            state = "finished"
+        elif self.paused:
+            state = "paused"
+        elif not self.wrapper.is_server_ready():
+            state = "waiting for the server"
+        elif len(self.online) > self.config.max_players:
+            state = f"waiting, {len(self.online)} players online"
+        elif time.monotonic() < self._lag_until:
+            state = "waiting, the server is lagging"
+        else:
+            state = f"generating, one tile every {self._interval:.1f}s"
+        print(f"World pre-generation: {self.index}/{self.total_tiles()} tiles ({self.progress():.1f}%), {state}")
+
+    def close(self) -> None:
+        self.wrapper.remove_wrapper_command("pregen")
+        self._stop_event.set()
+        self._thread.join()
+        self._unload()
@@ -0,0 +1,268 @@
+# Benchmarks for the wrapper hot path
+# replays synthetic or recorded log streams through Wrapper._handle_line
+# with different listeners attached and reports lines/sec, dispatch latency
+# percentiles and peak memory. The server process is replaced by a fake,
+# the discord webhook by a local http stub and the openai client by a stub.
+#
+# usage: python -m mcs_wrapper.tools.bench [--scenario mixed] [--lines 20000]
+#        python -m mcs_wrapper.tools.bench --save baseline.json
+#        python -m mcs_wrapper.tools.bench --baseline baseline.json
+
+import argparse
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from .log_replay import synthetic_lines, recorded_lines, SCENARIOS
+
+
+class FakeStdin:
+    # stands in for the stdin pipe of the java process and counts commands
+    def __init__(self):
+        self.commands = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.commands += 1
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class _WebhookHandler(BaseHTTPRequestHandler):
+    requests = 0
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        type(self).requests += 1
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@contextlib.contextmanager
+def webhook_stub():
+    # local http server that accepts discord webhook posts
+    handler = type("WebhookHandler", (_WebhookHandler,), {"requests": 0})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}/webhook", handler
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+class StubCompletions:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = 0
+
+    def create(self, **kwargs):
+        self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        message = SimpleNamespace(content="I am always watching you")
+        usage = SimpleNamespace(prompt_tokens=120, completion_tokens=8, total_tokens=128)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage)
+
+
+class StubOpenAI:
+    # mimics the part of openai.OpenAI that herobrine uses
+    def __init__(self, delay=0.0):
+        self.chat = SimpleNamespace(completions=StubCompletions(delay))
+
+
+def _write_config(path, values: dict):
+    with open(path, "w") as f:
+        for key, value in values.items():
+            f.write(f"{key}={value}\n")
+
+
+def make_wrapper(directory: str, target: str, webhook_url: str | None = None):
+    # create a wrapper with a fake process and the listener of the given target
+    from ..wrapper import Wrapper
+    from ..extensions.listener import Logger
+
+    wrapper = Wrapper(directory)
+    wrapper._stdin = FakeStdin()
+    wrapper._server_running = True
+
+    if target == "logger":
+        logger = Logger(wrapper)
+        for flag in ("log_player_messages", "log_player_joins", "log_player_leaves",
+                     "log_server_start", "log_server_stop", "log_death_messages"):
+            setattr(logger, flag, True)
+        wrapper.add_listener(logger)
+    elif target == "discord":
+        from ..extensions.discord_hook import DiscordHook
+        _write_config(os.path.join(wrapper.get_current_directory(), "discord_hook.cfg"), {"webhook_url": webhook_url})
+        wrapper.add_listener(DiscordHook(wrapper))
+    elif target == "herobrine":
+        from ..extensions.herobrine import Herobrine
+        # no coalescing, cache or token budget, so every reply is generated
+        _write_config(os.path.join(wrapper.get_current_directory(), "herobrine.cfg"),
+                      {"reply_chance": 1.0, "coalesce_window": 0.0, "cache_size": 0, "max_tokens_per_hour": 0})
+        herobrine = Herobrine(wrapper)
+        herobrine.enabled = True
+        herobrine.client = StubOpenAI()
+        wrapper.add_listener(herobrine)
+    elif target != "wrapper":
+        raise Exception(f"Unknown target {target}")
+
+    return wrapper
+
+
+def _percentile(sorted_values, p):
+    if not sorted_values:
+        return 0
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * p))
+    return sorted_values[index]
+
+
+def _wait_for_replies(wrapper, timeout: float = 30.0):
+    # herobrine generates replies in background threads, they are part of the work
+    herobrine = next((l for l in wrapper._listeners if type(l).__name__ == "Herobrine"), None)
+    if herobrine is None:
+        return
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with herobrine._lock:
+            if herobrine._active == 0 and not herobrine._pending:
+                return
+        time.sleep(0.0005)
+
+
+def _replies(wrapper) -> int:
+    herobrine = next((l for l in wrapper._listeners if type(l).__name__ == "Herobrine"), None)
+    return herobrine.client.chat.completions.calls if herobrine is not None else 0
+
+
+def run_target(target: str, lines: list[str], data_root: str, webhook_url: str | None = None) -> dict:
+    os.environ["MCSW_DATA_ROOT"] = data_root
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        # throughput and latency
+        wrapper = make_wrapper(f"bench_{target}", target, webhook_url)
+        handle_line = wrapper._handle_line
+        perf_counter_ns = time.perf_counter_ns
+        latencies = [0] * len(lines)
+        start = perf_counter_ns()
+        for i, line in enumerate(lines):
+            t = perf_counter_ns()
+            handle_line(line)
+            latencies[i] = perf_counter_ns() - t
+        _wait_for_replies(wrapper)
+        elapsed = (perf_counter_ns() - start) / 1e9
+        replies = _replies(wrapper)
+
+        # peak memory, measured in a second pass since tracemalloc slows everything down
+        wrapper = make_wrapper(f"bench_{target}", target, webhook_url)
+        tracemalloc.start()
+        for line in lines:
+            wrapper._handle_line(line)
+        _wait_for_replies(wrapper)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        "target": target,
+        "lines": len(lines),
+        "seconds": elapsed,
+        "lines_per_sec": len(lines) / elapsed if elapsed > 0 else 0.0,
+        "p50_us": _percentile(latencies, 0.50) / 1000,
+        "p99_us": _percentile(latencies, 0.99) / 1000,
+        "max_us": latencies[-1] / 1000 if latencies else 0.0,
+        "peak_memory_kb": peak / 1024,
+        "commands": wrapper._stdin.commands,
+        "replies": replies,
+    }
+
+
+def run(targets: list[str], lines: list[str]) -> list[dict]:
+    results = []
+    with tempfile.TemporaryDirectory(prefix="mcsw_bench_") as data_root, webhook_stub() as (url, _):
+        for target in targets:
+            results.append(run_target(target, lines, data_root, url))
+    return results
+
+
+def print_results(results: list[dict]):
+    header = f"{'target':<10} {'lines/s':>12} {'p50 us':>10} {'p99 us':>10} {'max us':>10} {'peak KiB':>10}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(f"{r['target']:<10} {r['lines_per_sec']:>12.0f} {r['p50_us']:>10.1f} {r['p99_us']:>10.1f} {r['max_us']:>10.1f} {r['peak_memory_kb']:>10.1f}")
+
+
+def compare(results: list[dict], baseline: list[dict], tolerance: float) -> list[str]:
+    # returns a list of regressions compared to the baseline
+    regressions = []
+    previous = {r["target"]: r for r in baseline}
+    for r in results:
+        old = previous.get(r["target"])
+        if old is None:
+            continue
+        if r["lines_per_sec"] < old["lines_per_sec"] * (1 - tolerance):
+            regressions.append(f"{r['target']}: lines/s {old['lines_per_sec']:.0f} -> {r['lines_per_sec']:.0f}")
+        if r["p99_us"] > old["p99_us"] * (1 + tolerance):
+            regressions.append(f"{r['target']}: p99 {old['p99_us']:.1f}us -> {r['p99_us']:.1f}us")
+    return regressions
+
+
+TARGETS = ["wrapper", "logger", "discord", "herobrine"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the wrapper hot path")
+    parser.add_argument("--scenario", "-s", default="mixed", choices=list(SCENARIOS), help="Synthetic log scenario")
+    parser.add_argument("--log", help="Replay a recorded log file instead of a synthetic scenario")
+    parser.add_argument("--lines", "-n", type=int, default=20000, help="Number of lines to replay")
+    parser.add_argument("--target", "-t", action="append", choices=TARGETS, help="Targets to benchmark (default: all)")
+    parser.add_argument("--save", help="Save results as json")
+    parser.add_argument("--baseline", help="Compare against saved results and fail on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression (default 0.2)")
+    args = parser.parse_args(argv)
+
+    if args.log:
+        lines = recorded_lines(args.log, args.lines)
+    else:
+        lines = synthetic_lines(args.scenario, args.lines)
+
+    results = run(args.target or TARGETS, lines)
+    print_results(results)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("Regressions:")
+            for regression in regressions:
+                print("  " + regression)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,216 @@
+# Fake minecraft server
+# a small stand-in for the java server that can be used as start_command
+# it prints realistic log lines at a configurable rate, understands a few
+# console commands and can crash on demand
+#
+# usage: python -m mcs_wrapper.tools.fake_server [--rate 50] [--scenario mixed]
+#
+# commands read from stdin:
+#   stop        stop the server (exit code 0)
+#   list        print the online players
+#   say <msg>   broadcast a message
+#   crash       exit immediately with a non zero exit code
+#   hang        stop printing and ignore all commands
+#   rate <n>    change the number of log lines per second
+#   flood <n>   print n lines as fast as possible
+#   echo <text> reply with text
+#   blob <n>    reply with n characters (to test long RCON replies)
+#
+# with --rcon-port the same commands can be sent over RCON, replies are
+# returned to the RCON client instead of being printed, split into packets
+# of 4096 characters like the real server does
+
+import argparse
+import os
+import random
+import socket
+import struct
+import sys
+import threading
+import time
+from .log_replay import SCENARIOS, startup_lines, format_line
+
+
+class FakeServer:
+    def __init__(self, rate: float = 10.0, scenario: str = "mixed", startup: float = 0.5,
+                 crash_after: float = 0.0, crash_after_lines: int = 0, exit_code: int = 1, seed: int | None = None,
+                 rcon_port: int = 0, rcon_password: str = ""):
+        self.rate = rate
+        self.scenario = scenario
+        self.startup = startup
+        self.crash_after = crash_after
+        self.crash_after_lines = crash_after_lines
+        self.exit_code = exit_code
+        self.rcon_port = rcon_port
+        self.rcon_password = rcon_password
+        self.rng = random.Random(seed)
+        self.players = set()
+        self.lines = 0
+        self.running = True
+        self.hanging = False
+        self._out_lock = threading.Lock()
+        self._generators = [g for g, _ in SCENARIOS[scenario]]
+        self._weights = [w for _, w in SCENARIOS[scenario]]
+
+    def write(self, line: str):
+        with self._out_lock:
+            sys.stdout.write(line + "\n")
+            self.lines += 1
+        if self.crash_after_lines and self.lines >= self.crash_after_lines:
+            self.crash()
+
+    def crash(self):
+        with self._out_lock:
+            sys.stdout.write(format_line("Encountered an unexpected exception", level="ERROR") + "\n")
+            sys.stdout.flush()
+        # skip cleanup like a real crash
+        os._exit(self.exit_code)
+
+    def next_line(self) -> str:
+        line = self.rng.choices(self._generators, self._weights)[0](self.rng)
+        # keep track of online players so "list" gives plausible answers
+        content = line[line.find("]: ") + 3:]
+        if content.endswith(" joined the game"):
+            self.players.add(content.split(" ", 1)[0])
+        elif content.endswith(" left the game"):
+            self.players.discard(content.split(" ", 1)[0])
+        return line
+
+    def handle_command(self, command: str, rcon: bool = False) -> str | None:
+        # returns the reply, which is printed unless the command came over RCON
+        if self.hanging:
+            return None
+        reply = ""
+        name, _, args = command.strip().partition(" ")
+        if name == "stop":
+            self.write(format_line("Stopping the server"))
+            self.write(format_line("Stopping server"))
+            self.write(format_line("Saving players"))
+            self.write(format_line("Saving worlds"))
+            self.running = False
+        elif name == "list":
+            players = sorted(self.players)
+            reply = f"There are {len(players)} of a max of 20 players online: {', '.join(players)}"
+        elif name == "say":
+            self.write(format_line(f"[Server] {args}"))
+        elif name == "echo":
+            reply = args
+        elif name == "blob":
+            # a long reply, split into several RCON packets
+            reply = "x" * int(args or 0)
+        elif name == "crash":
+            self.crash()
+        elif name == "hang":
+            self.hanging = True
+        elif name == "rate":
+            self.rate = float(args)
+        elif name == "flood":
+            for _ in range(int(args)):
+                self.write(self.next_line())
+        elif name:
+            reply = "Unknown or incomplete command, see below for error"
+        if reply and not rcon:
+            self.write(format_line(reply))
+        sys.stdout.flush()
+        return reply
+
+    def _serve_rcon(self):
+        server = socket.create_server(("127.0.0.1", self.rcon_port))
+        while True:
+            connection, _ = server.accept()
+            threading.Thread(target=self._rcon_client, args=(connection,), daemon=True).start()
+
+    def _rcon_client(self, connection: socket.socket):
+        def send(id: int, type: int, body: str):
+            data = struct.pack("<ii", id, type) + body.encode("utf-8") + b"\0\0"
+            connection.sendall(struct.pack("<i", len(data)) + data)
+
+        with connection:
+            authenticated = False
+            while True:
+                # like vanilla: one read per packet, a read with less or more
+                # than one packet closes the connection
+                packet = connection.recv(1460)
+                if len(packet) < 10 or struct.unpack("<i", packet[:4])[0] != len(packet) - 4:
+                    return
+                data = packet[4:]
+                id, type = struct.unpack("<ii", data[:8])
+                body = data[8:-2].decode("utf-8")
+                if type == 3:
+                    authenticated = body == self.rcon_password
+                    send(id if authenticated else -1, 2, "")
+                elif not authenticated:
+                    return
+                elif type == 2:
+                    reply = self.handle_command(body, rcon=True)
+                    if reply is None:
+                        continue
+                    for start in range(0, max(len(reply), 1), 4096):
+                        send(id, 0, reply[start:start + 4096])
+                else:
+                    send(id, 0, f"Unknown request {type:x}")
+
+    def _read_stdin(self):
+        for command in sys.stdin:
+            self.handle_command(command)
+            if not self.running:
+                return
+        # stdin closed, the wrapper is gone
+        self.running = False
+
+    def run(self) -> int:
+        stdin_thread = threading.Thread(target=self._read_stdin, daemon=True)
+        stdin_thread.start()
+        if self.rcon_port:
+            threading.Thread(target=self._serve_rcon, daemon=True).start()
+
+        start = time.monotonic()
+        for line in startup_lines():
+            if line.endswith("For help, type \"help\""):
+                time.sleep(self.startup)
+                line = format_line(f"Done ({self.startup:.3f}s)! For help, type \"help\"")
+            self.write(line)
+        sys.stdout.flush()
+
+        # print lines in small batches to reach the requested rate
+        tick = 0.01
+        owed = 0.0
+        while self.running:
+            if self.crash_after and time.monotonic() - start >= self.crash_after:
+                self.crash()
+            time.sleep(tick)
+            if self.hanging or self.rate <= 0:
+                continue
+            owed += self.rate * tick
+            count = int(owed)
+            owed -= count
+            for _ in range(count):
+                self.write(self.next_line())
+            if count:
+                sys.stdout.flush()
+
+        self.write(format_line("ThreadedAnvilChunkStorage: All dimensions are saved"))
+        sys.stdout.flush()
+        return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fake minecraft server for load tests")
+    parser.add_argument("--rate", type=float, default=10.0, help="Log lines per second")
+    parser.add_argument("--scenario", default="mixed", choices=list(SCENARIOS), help="Kind of log lines to print")
+    parser.add_argument("--startup", type=float, default=0.5, help="Seconds until the server is ready")
+    parser.add_argument("--crash-after", type=float, default=0.0, help="Crash after this many seconds (0 to disable)")
+    parser.add_argument("--crash-after-lines", type=int, default=0, help="Crash after this many lines (0 to disable)")
+    parser.add_argument("--exit-code", type=int, default=1, help="Exit code used when crashing")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for deterministic output")
+    parser.add_argument("--rcon-port", type=int, default=0, help="Accept RCON connections on this port (0 to disable)")
+    parser.add_argument("--rcon-password", default="", help="RCON password")
+    args = parser.parse_args(argv)
+
+    server = FakeServer(args.rate, args.scenario, args.startup, args.crash_after,
+                        args.crash_after_lines, args.exit_code, args.seed, args.rcon_port, args.rcon_password)
+    return server.run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
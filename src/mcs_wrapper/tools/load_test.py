@@ -0,0 +1,119 @@
+# Load test of the wrapper against the fake server
+# starts a real Wrapper with start_command pointing at tools/fake_server.py
+# and measures the wrapper cpu time per line and the time per restart
+#
+# restart_delay and flood_threshold default to 0 here, so the restart time
+# isn't the configured delay and repeated lines reach the listeners
+#
+# usage: python -m mcs_wrapper.tools.load_test [--rate 2000] [--restarts 5]
+
+import argparse
+import contextlib
+import os
+import shlex
+import sys
+import tempfile
+import threading
+import time
+from ..extensions.listener import Listener, Message
+from ..utils.server_parser import is_server_ready
+
+
+class _LoadListener(Listener):
+    # counts lines and server starts, stops the wrapper after the last start
+    def __init__(self, wrapper, restarts: int):
+        super().__init__(wrapper)
+        self.restarts = restarts
+        self.lines = 0
+        self.ready_times = []
+        self.done = threading.Event()
+
+    def handle_message(self, message: Message) -> None:
+        self.lines += 1
+        if message.content is not None and is_server_ready(message.content):
+            self.ready_times.append(time.monotonic())
+            if len(self.ready_times) > self.restarts:
+                self.done.set()
+
+
+def fake_server_command(rate: float, scenario: str = "mixed", startup: float = 0.0, crash_after_lines: int = 0) -> str:
+    command = [sys.executable, "-m", "mcs_wrapper.tools.fake_server", "--rate", str(rate),
+               "--scenario", scenario, "--startup", str(startup)]
+    if crash_after_lines:
+        command += ["--crash-after-lines", str(crash_after_lines)]
+    return shlex.join(command)
+
+
+def run(rate: float, lines_per_run: int, restarts: int, scenario: str = "mixed", timeout: float = 300.0,
+        restart_delay: int = 0, flood_threshold: int = 0) -> dict:
+    from ..wrapper import Wrapper
+
+    with tempfile.TemporaryDirectory(prefix="mcsw_load_") as data_root:
+        os.environ["MCSW_DATA_ROOT"] = data_root
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            wrapper = Wrapper("load_test")
+            # the fake server doesn't need a jar, but the updater would download one
+            open(os.path.join(wrapper.get_current_directory(), "server.jar"), "w").close()
+            wrapper.config.start_command = fake_server_command(rate, scenario, crash_after_lines=lines_per_run)
+            wrapper.config.auto_restart = True
+            wrapper.config.restart_delay = restart_delay
+            wrapper.config.restart_attempts = 0  # every run ends with a crash
+            wrapper.config.flood_threshold = flood_threshold
+            wrapper._create_flood_control()
+            listener = _LoadListener(wrapper, restarts)
+            wrapper.add_listener(listener)
+
+            cpu_start = time.process_time()
+            start = time.monotonic()
+            thread = threading.Thread(target=wrapper.run, daemon=True)
+            thread.start()
+            finished = listener.done.wait(timeout)
+            wrapper.stop()
+            thread.join(timeout)
+            elapsed = time.monotonic() - start
+            cpu = time.process_time() - cpu_start
+
+    ready = listener.ready_times
+    restart_times = [b - a for a, b in zip(ready, ready[1:])]
+    return {
+        "finished": finished,
+        "lines": listener.lines,
+        "seconds": elapsed,
+        "lines_per_sec": listener.lines / elapsed if elapsed > 0 else 0.0,
+        "cpu_us_per_line": cpu / listener.lines * 1e6 if listener.lines else 0.0,
+        "restarts": len(restart_times),
+        "avg_restart_seconds": sum(restart_times) / len(restart_times) if restart_times else 0.0,
+        # time a run needs just to print its lines, the rest is restart overhead
+        "run_seconds": lines_per_run / rate if rate > 0 else 0.0,
+        "restart_delay": restart_delay,
+        "flood_threshold": flood_threshold,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the wrapper with a fake server")
+    parser.add_argument("--rate", type=float, default=2000.0, help="Log lines per second of the fake server")
+    parser.add_argument("--lines", type=int, default=5000, help="Lines until the fake server crashes")
+    parser.add_argument("--restarts", type=int, default=3, help="Number of restarts to measure")
+    parser.add_argument("--scenario", default="mixed", help="Kind of log lines to print")
+    parser.add_argument("--restart-delay", type=int, default=0, help="restart_delay of the wrapper in seconds")
+    parser.add_argument("--flood-threshold", type=int, default=0, help="flood_threshold of the wrapper (0 to disable)")
+    args = parser.parse_args(argv)
+
+    result = run(args.rate, args.lines, args.restarts, args.scenario,
+                 restart_delay=args.restart_delay, flood_threshold=args.flood_threshold)
+    if not result["finished"]:
+        print("Load test timed out")
+    print(f"restart_delay:    {result['restart_delay']} s")
+    print(f"flood_threshold:  {result['flood_threshold']}")
+    print(f"lines:            {result['lines']}")
+    print(f"lines/s:          {result['lines_per_sec']:.0f}")
+    print(f"wrapper cpu/line: {result['cpu_us_per_line']:.1f} us")
+    print(f"restarts:         {result['restarts']}")
+    print(f"time per restart: {result['avg_restart_seconds'] * 1000:.0f} ms")
+    print(f"restart overhead: {(result['avg_restart_seconds'] - result['run_seconds']) * 1000:.0f} ms (without time to print {args.lines} lines)")
+    return 0 if result["finished"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+# Synthetic and recorded minecraft log streams
+# used by the benchmarks and the fake server to produce realistic output
+
+import random
+import time
+
+PLAYERS = ["Steve", "Alex", "Notch", "jeb_", "Dinnerbone", "Grumm", "xX_Slayer_Xx", "builder42"]
+
+CHAT = [
+    "hello",
+    "anyone want to go mining?",
+    "ping",
+    "lol",
+    "where is the nether portal",
+    "brb",
+    "who took my diamonds",
+    "gg",
+    "can someone tp me to spawn",
+    "this server is so laggy today",
+]
+
+DEATHS = [
+    "{player} was slain by Zombie",
+    "{player} was shot by Skeleton",
+    "{player} drowned",
+    "{player} fell from a high place",
+    "{player} hit the ground too hard",
+    "{player} tried to swim in lava",
+    "{player} was blown up by Creeper",
+    "{player} was killed by magic",
+    "{player} was pricked to death",
+]
+
+MOD_DEBUG = [
+    "[net.minecraft.world.level.chunk/]: Loading chunk at [{x}, {z}]",
+    "[com.example.mod.Tickables/]: Ticked {n} block entities in {ms}ms",
+    "[mixin/]: Mixing FooMixin from examplemod.mixins.json into net.minecraft.class_{n}",
+    "[net.minecraftforge.registries.ForgeRegistry/]: Registry Block: Found a missing id from the world examplemod:block_{n}",
+]
+
+STARTUP = [
+    "Starting minecraft server version 1.20.4",
+    "Loading properties",
+    "Default game type: SURVIVAL",
+    "Preparing level \"world\"",
+    "Preparing start region for dimension minecraft:overworld",
+    "Time elapsed: 3512 ms",
+    "Done (4.123s)! For help, type \"help\"",
+]
+
+
+def format_line(content: str, thread: str = "Server thread", level: str = "INFO", timestamp: float | None = None) -> str:
+    # format a line the way the vanilla server does
+    # eg. [22:58:59] [Server thread/INFO]: Steve joined the game
+    if timestamp is None:
+        timestamp = time.time()
+    return f"[{time.strftime('%H:%M:%S', time.localtime(timestamp))}] [{thread}/{level}]: {content}"
+
+
+def startup_lines():
+    for content in STARTUP:
+        yield format_line(content)
+
+
+def join_lines(rng: random.Random):
+    player = rng.choice(PLAYERS)
+    if rng.random() < 0.5:
+        return format_line(f"{player} joined the game")
+    return format_line(f"{player} left the game")
+
+
+def chat_lines(rng: random.Random):
+    player = rng.choice(PLAYERS)
+    return format_line(f"<{player}> {rng.choice(CHAT)}", thread="Async Chat Thread - #0")
+
+
+def death_lines(rng: random.Random):
+    return format_line(rng.choice(DEATHS).format(player=rng.choice(PLAYERS)))
+
+
+def debug_lines(rng: random.Random):
+    template = rng.choice(MOD_DEBUG)
+    content = template.format(x=rng.randint(-100, 100), z=rng.randint(-100, 100), n=rng.randint(1, 5000), ms=rng.randint(1, 50))
+    return f"[{time.strftime('%H:%M:%S')}] [Worker-Main-{rng.randint(1, 8)}/DEBUG] {content}"
+
+
+# name -> (generator, weight) for each line type per scenario
+SCENARIOS = {
+    "joins": [(join_lines, 1)],
+    "chat": [(chat_lines, 1)],
+    "deaths": [(death_lines, 1)],
+    "modded": [(debug_lines, 1)],
+    "mixed": [(join_lines, 1), (chat_lines, 4), (death_lines, 1), (debug_lines, 6)],
+}
+
+
+def synthetic_lines(scenario: str = "mixed", count: int = 10000, seed: int = 0) -> list[str]:
+    # returns count lines of the given scenario
+    # the lines are generated up front so generation cost is not measured
+    if scenario not in SCENARIOS:
+        raise Exception(f"Unknown scenario {scenario}, available: {', '.join(SCENARIOS)}")
+
+    rng = random.Random(seed)
+    generators = [g for g, _ in SCENARIOS[scenario]]
+    weights = [w for _, w in SCENARIOS[scenario]]
+    return [rng.choices(generators, weights)[0](rng) for _ in range(count)]
+
+
+def recorded_lines(path: str, count: int | None = None) -> list[str]:
+    # lines of a recorded log file (e.g. logs/latest.log)
+    # the file is repeated if count is larger than the file
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        lines = [line.rstrip("\r\n") for line in f if line.strip()]
+    if not lines:
+        raise Exception(f"Log file {path} is empty")
+    if count is None:
+        return lines
+    return [lines[i % len(lines)] for i in range(count)]
@@ -0,0 +1,97 @@
+# Benchmark of the server output readers
+# floods a pipe from a child process with log lines and measures the whole
+# path from the pipe to the listeners: the old text mode readline() loop
+# that called Wrapper._handle_line per line, against the chunked reader of
+# utils/line_reader.py dispatching batches through Wrapper._handle_lines
+# (once without and once with flood control, which only batches can use).
+#
+# usage: python -m mcs_wrapper.tools.reader_bench [--lines 500000] [--target logger] [--repeat 3]
+
+import argparse
+import contextlib
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from .bench import make_wrapper
+from .log_replay import synthetic_lines
+from ..utils.line_reader import read_lines
+
+_CAT = "import shutil, sys; shutil.copyfileobj(open(sys.argv[1], 'rb'), sys.stdout.buffer, 1 << 20)"
+TARGETS = ["wrapper", "logger"]
+
+
+def _start(path: str, text: bool) -> subprocess.Popen:
+    if text:
+        return subprocess.Popen([sys.executable, "-c", _CAT, path], stdout=subprocess.PIPE, text=True, bufsize=1)
+    return subprocess.Popen([sys.executable, "-c", _CAT, path], stdout=subprocess.PIPE, bufsize=0)
+
+
+def readline_reader(path: str, wrapper) -> None:
+    # the reader the wrapper used before: text pipe, readline() and strip()
+    # and _handle_line per line
+    process = _start(path, text=True)
+    handle_line = wrapper._handle_line
+    while True:
+        line = process.stdout.readline()
+        if not line:
+            break
+        handle_line(line.strip())
+    process.wait()
+
+
+def chunked_reader(path: str, wrapper) -> None:
+    process = _start(path, text=False)
+    read_lines(process.stdout.fileno(), wrapper._handle_lines)
+    process.wait()
+
+
+def run(path: str, lines: int, target: str, repeat: int = 3) -> dict:
+    # lines per second of every reader, the best of `repeat` runs with a new wrapper each
+    readers = [("readline", readline_reader, 0), ("chunked", chunked_reader, 0), ("chunked+flood", chunked_reader, None)]
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="mcsw_reader_bench_") as data_root:
+        os.environ["MCSW_DATA_ROOT"] = data_root
+        for _ in range(repeat):
+            for name, reader, flood_threshold in readers:
+                with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                    wrapper = make_wrapper(f"reader_bench_{name}", target)
+                    if flood_threshold is not None:
+                        wrapper.config.flood_threshold = flood_threshold
+                        wrapper._create_flood_control()
+                    start = time.perf_counter()
+                    reader(path, wrapper)
+                    elapsed = time.perf_counter() - start
+                if name not in results or elapsed < results[name]["seconds"]:
+                    results[name] = {"seconds": elapsed, "lines_per_sec": lines / elapsed}
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the server output readers, including dispatch")
+    parser.add_argument("--lines", "-n", type=int, default=500000, help="Number of lines in the flood")
+    parser.add_argument("--scenario", "-s", default="modded", help="Synthetic log scenario")
+    parser.add_argument("--target", "-t", default="wrapper", choices=TARGETS, help="Listeners attached to the wrapper")
+    parser.add_argument("--repeat", "-r", type=int, default=3, help="Runs per reader, the fastest is reported")
+    args = parser.parse_args(argv)
+
+    with tempfile.NamedTemporaryFile("w", suffix=".log", delete=False) as f:
+        f.write("\n".join(synthetic_lines(args.scenario, args.lines)) + "\n")
+        path = f.name
+
+    try:
+        results = run(path, args.lines, args.target, args.repeat)
+    finally:
+        os.remove(path)
+
+    for name, result in results.items():
+        print(f"{name:<14} {args.lines} lines in {result['seconds']:.2f}s, {result['lines_per_sec']:,.0f} lines/s")
+    base = results["readline"]["lines_per_sec"]
+    print(f"speedup:       {results['chunked']['lines_per_sec'] / base:.2f}x, "
+          f"{results['chunked+flood']['lines_per_sec'] / base:.2f}x with flood control")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+# Aho-Corasick automaton
+# finds all words of a (large) word list in a text in one pass over the text,
+# no matter how many words there are. Words are stored in a trie, every node
+# has a fail link to the longest suffix that is also in the trie, and an
+# output link to the nearest node on the fail chain that ends a word.
+# An automaton never changes after it is built, so find() can run in other
+# threads while the word list changes: with_words() returns a new automaton
+# that shares the big base trie and only builds a small trie of the added
+# words, removed words are skipped when they are found. The base is built
+# again once added and removed words make up more than 1/8 of the words.
+
+import collections
+
+
+class _Node:
+    __slots__ = ("children", "fail", "output", "word")
+
+    def __init__(self):
+        self.children: dict[str, _Node] = {}
+        self.fail: _Node | None = None
+        self.output: _Node | None = None  # next node on the fail chain that ends a word
+        self.word: str | None = None  # word ending here
+
+
+def _build(words) -> _Node:
+    root = _Node()
+    for word in words:
+        node = root
+        for char in word:
+            child = node.children.get(char)
+            if child is None:
+                child = node.children[char] = _Node()
+            node = child
+        node.word = word
+
+    # breadth first, so the fail link of the parent is always done
+    queue = collections.deque()
+    for child in root.children.values():
+        child.fail = root
+        queue.append(child)
+    while queue:
+        node = queue.popleft()
+        for char, child in node.children.items():
+            fail = node.fail
+            while fail is not None and char not in fail.children:
+                fail = fail.fail
+            child.fail = fail.children[char] if fail is not None else root
+            child.output = child.fail if child.fail.word is not None else child.fail.output
+            queue.append(child)
+    return root
+
+
+# the base trie is rebuilt when more words than this (or 1/8 of all words)
+# are in the added trie or removed from the base
+_MIN_REBUILD = 64
+
+
+class AhoCorasick:
+
+    def __init__(self, words=(), _base=None):
+        self.words: frozenset[str] = frozenset(word for word in words if word)
+        if _base is None:
+            _base = (_build(self.words), self.words)
+        self._base, self._base_words = _base
+        # words that are not in the base trie
+        self._added_words = self.words - self._base_words
+        self._added = _build(self._added_words) if self._added_words else None
+
+    def with_words(self, words) -> "AhoCorasick":
+        # a new automaton that matches exactly these words
+        words = frozenset(word for word in words if word)
+        changed = len(words - self._base_words) + len(self._base_words - words)
+        if changed > max(_MIN_REBUILD, len(words) // 8):
+            return AhoCorasick(words)
+        return AhoCorasick(words, _base=(self._base, self._base_words))
+
+    def find(self, text: str):
+        # yields (start, end, word) for every occurrence, text[start:end] == word
+        # ordered by end in the base trie, then in the trie of added words
+        words = self.words
+        for root in (self._base, self._added):
+            if root is None:
+                continue
+            node = root
+            for i, char in enumerate(text):
+                while node is not root and char not in node.children:
+                    node = node.fail
+                node = node.children.get(char, root)
+                match = node if node.word is not None else node.output
+                while match is not None:
+                    # removed from the list, but still in the base trie
+                    if match.word in words:
+                        yield i + 1 - len(match.word), i + 1, match.word
+                    match = match.output
+
+    def __len__(self) -> int:
+        return len(self.words)
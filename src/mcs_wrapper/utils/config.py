@@ -1,13 +1,75 @@
 import os
+import dataclasses
+import threading
 
 # get data root directory
+# can be overridden with the MCSW_DATA_ROOT environment variable
 def get_data_root():
+    if os.getenv("MCSW_DATA_ROOT"):
+        return os.getenv("MCSW_DATA_ROOT")
     if os.name == "nt":
         return os.path.join(os.getenv("APPDATA"), "mcs_wrapper")
     else:
         return os.path.join(os.getenv("HOME"), ".mcs_wrapper")
 
 
+# parsed config files, shared by all KVConfig instances
+# path -> _CachedFile, so every file is only read and parsed once
+# as long as its modification time and size don't change
+_file_cache = {}
+_file_cache_lock = threading.Lock()
+
+# class -> {key: type}, derived from the dataclass fields
+_schemas = {}
+
+
+class _CachedFile:
+    def __init__(self, stat, values, comments):
+        self.stat = stat
+        self.values: dict[str, str] = values  # raw, unconverted values
+        self.comments: set[str] = comments
+
+
+def _file_stat(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _read_file(path) -> _CachedFile | None:
+    # returns the raw key/value pairs of a config file, using the cache if possible
+    stat = _file_stat(path)
+    if stat is None:
+        return None
+
+    with _file_cache_lock:
+        cached = _file_cache.get(path)
+        if cached is not None and cached.stat == stat:
+            return cached
+
+    values = {}
+    comments = set()
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if line == "":
+                continue
+            if line.startswith("#"):
+                comments.add(line)
+                continue
+            if "=" not in line:
+                raise Exception("Invalid line: " + line)
+            key, value = line.split("=", 1)
+            values[key.strip()] = value.strip()
+
+    cached = _CachedFile(stat, values, comments)
+    with _file_cache_lock:
+        _file_cache[path] = cached
+    return cached
+
+
 class KVConfig:
 
     def set_path(self, path):
@@ -16,7 +78,25 @@ class KVConfig:
     def get_path(self):
         return self._path
 
+    @classmethod
+    def _schema(cls) -> dict:
+        # key -> type of all dataclass fields that hold a value (no comments or callables)
+        schema = _schemas.get(cls)
+        if schema is None:
+            schema = {}
+            if dataclasses.is_dataclass(cls):
+                for field in dataclasses.fields(cls):
+                    if field.type in (bool, int, float, str) and not field.name.startswith("comment"):
+                        schema[field.name] = field.type
+            _schemas[cls] = schema
+        return schema
+
     def _get_value_type(self, key, value):
+        # use the type of the dataclass field if there is one
+        t = self._schema().get(key)
+        if t is not None:
+            return t
+
         # check if key is already defined in this class
         if hasattr(self, key):
             t = type(getattr(self, key))
@@ -45,68 +125,96 @@ class KVConfig:
         # default to string
         return str
 
-    def _parse_line(self, line):
-        # raise Exception if line starts with # or has no = sign
-        # comment should be sorted out before this function is called
-        if line.startswith("#") or "=" not in line:
-            raise Exception("Invalid line: " + line)
-        
-        key, value = line.split("=", 1)
-        key = key.strip()
-        value = value.strip()
+    def _convert(self, key, value):
         value_type = self._get_value_type(key, value)
 
         # try to convert value to value_type
         try:
             # special case for bool
             if value_type == bool:
-                value = (value.lower() == "true" or value == "1")
-            else:
-                value = value_type(value)
+                return value.lower() == "true" or value == "1"
+            return value_type(value)
         except ValueError:
             raise Exception(f"Failed to convert {value} to {value_type}")
+
+    def _parse_line(self, line):
+        # raise Exception if line starts with # or has no = sign
+        # comment should be sorted out before this function is called
+        if line.startswith("#") or "=" not in line:
+            raise Exception("Invalid line: " + line)
         
-        return key, value
+        key, value = line.split("=", 1)
+        key = key.strip()
+        value = value.strip()
+        return key, self._convert(key, value)
     
     def _parse_file(self, path):
-        # read file and parse lines
-        with open(self._path, "r") as f:
-            lines = f.readlines()
-        
-        # remove comments and empty lines
-        lines = [line for line in lines if not line.startswith("#") and line.strip() != ""]
-        
-        # parse lines
-        config = {}
-        for line in lines:
-            key, value = self._parse_line(line)
-            config[key] = value
-
-        return config
-    
-    def save_config(self, config=None, path=None):
+        cached = _read_file(path)
+        if cached is None:
+            return {}
+        return {key: self._convert(key, value) for key, value in cached.values.items()}
+
+    def _render(self, config) -> tuple[list[str], dict[str, str], set[str]]:
+        # returns the lines to write, the values and the comments that don't change on every save
+        lines = []
+        values = {}
+        comments = set()
+        for key, value in config.items():
+            # skip keys that start with underscore
+            if key.startswith("_"):
+                continue
+
+            # if value is callable, call it
+            # (the result, e.g. a timestamp, is not used to detect changes)
+            dynamic = callable(value)
+            if dynamic:
+                value = value()
+
+            # if value starts with #, treat it as a comment
+            if str(value).startswith("#"):
+                lines.append(f"{value}\n")
+                if not dynamic:
+                    comments.add(str(value).strip())
+                continue
+
+            lines.append(f"{key}={value}\n")
+            values[key] = str(value).strip()
+        return lines, values, comments
+
+    def save_config(self, config=None, path=None, force=False):
+        # only writes the file if a value or comment changed
+        # the file is written to a temporary file first and then replaced,
+        # so a crash while saving never leaves a half written config
         if config is None:
             config = self.__dict__
 
         if path is None:
             path = self._path
 
-        with open(path, "w") as f:
-            for key, value in config.items():
-                # skip keys that start with underscore
-                if key.startswith("_"):
-                    continue
-                
-                # if value is callable, call it
-                if callable(value):
-                    value = value()
+        lines, values, comments = self._render(config)
 
-                # if value starts with #, treat it as a comment
-                if str(value).startswith("#"):
-                    f.write(f"{value}\n")
-                    continue
+        if not force:
+            cached = _read_file(path)
+            if cached is not None and cached.values == values and comments <= cached.comments:
+                return False
 
-                f.write(f"{key}={value}\n")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write("".join(lines))
+        os.replace(tmp_path, path)
+
+        with _file_cache_lock:
+            _file_cache[path] = _CachedFile(_file_stat(path), values, comments)
+        return True
+
+    def _read_values(self, path) -> dict | None:
+        # converted values of all known keys in the file, None if it doesn't exist
+        # raises before anything is applied if a line or value is invalid
+        cached = _read_file(path)
+        if cached is None:
+            return None
+        # unknown keys are ignored, so don't bother converting them
+        return {key: self._convert(key, value) for key, value in cached.values.items() if hasattr(self, key)}
 
     def load_config(self, path=None):
 
@@ -114,11 +222,24 @@ class KVConfig:
             path = self._path
 
         # check if file exists
-        if not os.path.exists(path):
+        values = self._read_values(path)
+        if values is None:
             print(f"Config file {path} does not exist. Using default values.")
             return
 
-        config = self._parse_file(path)
-        for key, value in config.items():
-            if hasattr(self, key):
-                setattr(self, key, value)
\ No newline at end of file
+        # all values at once, other threads never see half of a file applied
+        self.__dict__.update(values)
+
+    def reload(self) -> set[str]:
+        # read the file again and return the keys whose values changed
+        # an invalid file keeps all old values
+        try:
+            values = self._read_values(self._path)
+        except Exception as e:
+            print(f"Invalid config {self._path}, keeping the old values: {e}")
+            return set()
+        if values is None:
+            return set()
+        changed = {key for key, value in values.items() if getattr(self, key) != value}
+        self.__dict__.update({key: values[key] for key in changed})
+        return changed
@@ -0,0 +1,147 @@
+# Watches config files for changes
+# uses inotify on linux (through ctypes, no extra dependency) and falls back
+# to polling the modification time on other systems. inotify events only
+# trigger a check, a callback is only called when mtime or size changed,
+# so the many events of one editor save result in one callback.
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import threading
+
+_IN_MODIFY = 0x00000002
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+class _Inotify:
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._libc = libc
+        self.fd = libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._watches = {}  # directory -> watch descriptor
+
+    def add_directory(self, directory: str):
+        if directory in self._watches:
+            return
+        # watch the directory, config files are replaced on save so the inode changes
+        mask = _IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {directory}")
+        self._watches[directory] = wd
+
+    def wait(self, timeout: float) -> bool:
+        # returns True if there were events
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return False
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return False
+        return len(data) >= _EVENT_HEADER.size
+
+    def close(self):
+        os.close(self.fd)
+
+
+class ConfigWatcher:
+
+    def __init__(self, poll_interval: float = 2.0, debounce: float = 0.2):
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self._files = {}  # path -> [last stat, callbacks]
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._inotify = None
+
+    def watch(self, path: str, callback):
+        # callback() is called from the watcher thread when the file changed
+        path = os.path.abspath(path)
+        with self._lock:
+            entry = self._files.get(path)
+            if entry is None:
+                entry = self._files[path] = [_stat(path), []]
+            entry[1].append(callback)
+        if self._inotify is not None:
+            self._inotify.add_directory(os.path.dirname(path))
+
+    def unwatch(self, path: str, callback=None):
+        path = os.path.abspath(path)
+        with self._lock:
+            entry = self._files.get(path)
+            if entry is None:
+                return
+            if callback is not None and callback in entry[1]:
+                entry[1].remove(callback)
+            if callback is None or not entry[1]:
+                del self._files[path]
+
+    def start(self):
+        try:
+            self._inotify = _Inotify()
+            with self._lock:
+                directories = {os.path.dirname(path) for path in self._files}
+            for directory in directories:
+                self._inotify.add_directory(directory)
+        except (OSError, AttributeError):
+            # no inotify on this system, poll instead
+            self._inotify = None
+
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="config_watcher")
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            if self._inotify is not None:
+                # wake up at least every few seconds to check the stop event
+                if not self._inotify.wait(1.0):
+                    continue
+                # give the editor time to finish writing
+                self._stop_event.wait(self.debounce)
+            else:
+                self._stop_event.wait(self.poll_interval)
+            self.check()
+
+    def check(self):
+        # call the callbacks of all files that changed since the last check
+        changed = []
+        with self._lock:
+            for path, entry in self._files.items():
+                stat = _stat(path)
+                if stat != entry[0]:
+                    entry[0] = stat
+                    if stat is not None:
+                        changed.extend(entry[1])
+
+        for callback in changed:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Failed to apply config change: {e}")
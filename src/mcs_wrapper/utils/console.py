@@ -0,0 +1,176 @@
+# Console socket
+# every managed server gets a Unix socket (<server directory>/console.sock)
+# any number of clients can connect to, e.g. with "mcsw attach". Clients get
+# the last lines of output, then the live output, and every line they send is
+# handled like a command typed into the wrapper terminal. The protocol is
+# plain utf-8 lines in both directions, so "nc -U console.sock" works too.
+
+import collections
+import os
+import queue
+import socket
+import sys
+import threading
+
+SOCKET_NAME = "console.sock"
+# a client that falls this many batches behind is disconnected
+_MAX_PENDING = 1000
+
+
+class _Client:
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.queue = queue.Queue(_MAX_PENDING)
+        self.closed = False
+
+
+class ConsoleServer:
+
+    def __init__(self, directory: str, on_command, history: int = 100):
+        # on_command(line) returns a reply for this client or None
+        self.path = os.path.join(directory, SOCKET_NAME)
+        self.on_command = on_command
+        self._history = collections.deque(maxlen=history)
+        self._lock = threading.Lock()
+        self._clients: list[_Client] = []
+        self._server = None
+
+    def start(self) -> bool:
+        if os.path.exists(self.path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+                probe.close()
+                print(f"Console socket {self.path} is used by another wrapper")
+                return False
+            except OSError:
+                # left over from a wrapper that was killed
+                probe.close()
+                os.remove(self.path)
+
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(self.path)
+        os.chmod(self.path, 0o600)
+        self._server.listen()
+        threading.Thread(target=self._accept, daemon=True, name="console_accept").start()
+        return True
+
+    def stop(self):
+        if self._server is None:
+            return
+        self._server.close()
+        self._server = None
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            clients = self._clients
+            self._clients = []
+        for client in clients:
+            self._close(client)
+
+    def clients(self) -> int:
+        return len(self._clients)
+
+    def broadcast(self, lines: list[str]):
+        # called from the reader threads, never blocks
+        with self._lock:
+            self._history.extend(lines)
+            for client in self._clients:
+                try:
+                    client.queue.put_nowait(lines)
+                except queue.Full:
+                    self._close(client)
+            if any(client.closed for client in self._clients):
+                self._clients = [client for client in self._clients if not client.closed]
+
+    def _accept(self):
+        while True:
+            server = self._server
+            if server is None:
+                return
+            try:
+                sock, _ = server.accept()
+            except OSError:
+                return
+            client = _Client(sock)
+            with self._lock:
+                # the history is queued first, so no line is missed or sent twice
+                client.queue.put_nowait(list(self._history))
+                self._clients.append(client)
+            threading.Thread(target=self._write, args=(client,), daemon=True, name="console_writer").start()
+            threading.Thread(target=self._read, args=(client,), daemon=True, name="console_reader").start()
+
+    def _write(self, client: _Client):
+        while not client.closed:
+            lines = client.queue.get()
+            if lines is None:
+                break
+            try:
+                client.sock.sendall(("\n".join(lines) + "\n").encode("utf-8") if lines else b"")
+            except OSError:
+                break
+        self._close(client)
+
+    def _read(self, client: _Client):
+        with client.sock.makefile("r", encoding="utf-8", errors="replace") as f:
+            try:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    reply = self.on_command(line)
+                    if reply:
+                        try:
+                            client.queue.put_nowait([reply])
+                        except queue.Full:
+                            break
+            except OSError:
+                pass
+        self._close(client)
+
+    def _close(self, client: _Client):
+        if client.closed:
+            return
+        client.closed = True
+        try:
+            client.queue.put_nowait(None)
+        except queue.Full:
+            pass
+        try:
+            client.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        client.sock.close()
+
+
+def attach(directory: str) -> int:
+    # console client, used by "mcsw attach"
+    path = os.path.join(directory, SOCKET_NAME)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError as e:
+        print(f"Could not connect to {path}: {e}")
+        print("Is the wrapper running with console_socket = True?")
+        return 1
+
+    def read_output():
+        with sock.makefile("rb") as f:
+            for line in f:
+                sys.stdout.write(line.decode("utf-8", "replace"))
+                sys.stdout.flush()
+        print("Connection closed")
+        os._exit(0)
+
+    threading.Thread(target=read_output, daemon=True, name="console_output").start()
+    print("Attached, press Ctrl+D to detach")
+    try:
+        while True:
+            line = input()
+            sock.sendall((line + "\n").encode("utf-8"))
+    except (EOFError, KeyboardInterrupt):
+        pass
+    sock.close()
+    return 0
@@ -5,6 +5,8 @@
 # internally, use a fixed size list to store the elements
 # keep track of the current index to insert the next element
 
+from array import array
+
 class CyclicList:
     def __init__(self, max_length):
         self.max_length = max_length
@@ -52,3 +54,52 @@ class CyclicList:
     
     def __ne__(self, other):
         return self.as_list() != other
+
+
+# Cyclic array
+# same idea as the cyclic list, but backed by an array.array of numbers
+# used for compact time series (e.g. process samples) where a list of
+# python objects would waste a lot of memory
+
+class CyclicArray:
+    def __init__(self, max_length, typecode="d"):
+        self.max_length = max_length
+        self.array = array(typecode, [0] * max_length)
+        self.index = 0 # the index to insert the next element
+        self.count = 0 # number of elements stored
+
+    def append(self, value):
+        self.array[self.index] = value
+        self.index = (self.index + 1) % self.max_length
+        if self.count < self.max_length:
+            self.count += 1
+
+    def as_list(self):
+        if self.count < self.max_length:
+            return self.array[:self.count].tolist()
+        return (self.array[self.index:] + self.array[:self.index]).tolist()
+
+    def last(self, default=None):
+        if self.count == 0:
+            return default
+        return self.array[(self.index - 1) % self.max_length]
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.count
+        if index < 0 or index >= self.count:
+            raise IndexError("Index out of range")
+        start = 0 if self.count < self.max_length else self.index
+        return self.array[(start + index) % self.max_length]
+
+    def __iter__(self):
+        return iter(self.as_list())
+
+    def __repr__(self):
+        return str(self.as_list())
+
+    def __bool__(self):
+        return self.count != 0
@@ -0,0 +1,228 @@
+# Death messages
+# the death messages of a server version are read from the en_us.json
+# language file inside server.jar (without extracting anything) and compiled
+# into one regex, so a line is checked against all of them with one match.
+# The templates share prefixes ("%1$s was slain by %2$s", "%1$s was slain by
+# %2$s using %3$s"), so the regex is built as a trie: common prefixes are
+# matched once, an empty named group at the end of each template tells which
+# one matched. Templates are cached per server version in <data root>/cache.
+
+import io
+import json
+import os
+import re
+import zipfile
+
+LANG_FILE = "assets/minecraft/lang/en_us.json"
+CACHE_DIRECTORY = os.path.join("cache", "death_messages")
+
+_PLACEHOLDER = re.compile(r"%(?:(\d+)\$)?s|%%")
+# players can't have spaces or brackets in their name, this also keeps
+# chat ("<Steve> ...") and say ("[Server] ...") lines from matching
+_PLAYER = r"(?P<player>[^\s<>\[\]]+) "
+_END = None  # trie key for "template ends here"
+
+# used until the templates of the server are loaded
+DEFAULT_DEATH_MESSAGES = {
+    "death.attack.anvil": "%1$s was squashed by a falling anvil",
+    "death.attack.arrow": "%1$s was shot by %2$s",
+    "death.attack.arrow.item": "%1$s was shot by %2$s using %3$s",
+    "death.attack.cactus": "%1$s was pricked to death",
+    "death.attack.cactus.player": "%1$s walked into a cactus while trying to escape %2$s",
+    "death.attack.cramming": "%1$s was squished too much",
+    "death.attack.dragonBreath": "%1$s was roasted in dragon's breath",
+    "death.attack.drown": "%1$s drowned",
+    "death.attack.drown.player": "%1$s drowned while trying to escape %2$s",
+    "death.attack.dryout": "%1$s died from dehydration",
+    "death.attack.even_more_magic": "%1$s was killed by even more magic",
+    "death.attack.explosion": "%1$s blew up",
+    "death.attack.explosion.player": "%1$s was blown up by %2$s",
+    "death.attack.explosion.player.item": "%1$s was blown up by %2$s using %3$s",
+    "death.attack.fall": "%1$s hit the ground too hard",
+    "death.attack.fallingBlock": "%1$s was squashed by a falling block",
+    "death.attack.fallingStalactite": "%1$s was skewered by a falling stalactite",
+    "death.attack.fireball": "%1$s was fireballed by %2$s",
+    "death.attack.fireball.item": "%1$s was fireballed by %2$s using %3$s",
+    "death.attack.fireworks": "%1$s went off with a bang",
+    "death.attack.flyIntoWall": "%1$s experienced kinetic energy",
+    "death.attack.freeze": "%1$s froze to death",
+    "death.attack.generic": "%1$s died",
+    "death.attack.genericKill": "%1$s was killed",
+    "death.attack.hotFloor": "%1$s discovered the floor was lava",
+    "death.attack.inFire": "%1$s went up in flames",
+    "death.attack.inWall": "%1$s suffocated in a wall",
+    "death.attack.indirectMagic": "%1$s was killed by %2$s using magic",
+    "death.attack.indirectMagic.item": "%1$s was killed by %2$s using %3$s",
+    "death.attack.lava": "%1$s tried to swim in lava",
+    "death.attack.lava.player": "%1$s tried to swim in lava to escape %2$s",
+    "death.attack.lightningBolt": "%1$s was struck by lightning",
+    "death.attack.magic": "%1$s was killed by magic",
+    "death.attack.mob": "%1$s was slain by %2$s",
+    "death.attack.mob.item": "%1$s was slain by %2$s using %3$s",
+    "death.attack.onFire": "%1$s burned to death",
+    "death.attack.outOfWorld": "%1$s fell out of the world",
+    "death.attack.player": "%1$s was slain by %2$s",
+    "death.attack.player.item": "%1$s was slain by %2$s using %3$s",
+    "death.attack.sonic_boom": "%1$s was obliterated by a sonically-charged shriek",
+    "death.attack.stalagmite": "%1$s was impaled on a stalagmite",
+    "death.attack.starve": "%1$s starved to death",
+    "death.attack.sting": "%1$s was stung to death",
+    "death.attack.sweetBerryBush": "%1$s was poked to death by a sweet berry bush",
+    "death.attack.thorns": "%1$s was killed while trying to hurt %2$s",
+    "death.attack.thrown": "%1$s was pummeled by %2$s",
+    "death.attack.trident": "%1$s was impaled by %2$s",
+    "death.attack.wither": "%1$s withered away",
+    "death.attack.witherSkull": "%1$s was shot by a skull from %2$s",
+    "death.fell.accident.generic": "%1$s fell from a high place",
+    "death.fell.accident.ladder": "%1$s fell off a ladder",
+    "death.fell.accident.vines": "%1$s fell off some vines",
+    "death.fell.accident.water": "%1$s fell out of the water",
+    "death.fell.assist": "%1$s was doomed to fall by %2$s",
+    "death.fell.assist.item": "%1$s was doomed to fall by %2$s using %3$s",
+    "death.fell.finish": "%1$s fell too far and was finished by %2$s",
+    "death.fell.finish.item": "%1$s fell too far and was finished by %2$s using %3$s",
+    "death.fell.killer": "%1$s was doomed to fall",
+}
+
+
+def _parse_template(template: str) -> list | None:
+    # "%1$s was shot by %2$s" -> ["w", "a", "s", ..., 2], None if it doesn't
+    # start with the player. Placeholder numbers are ints, text is split
+    # into characters so the trie can share prefixes
+    tokens = []
+    position = 0
+    index = 0
+    for match in _PLACEHOLDER.finditer(template):
+        tokens.extend(template[position:match.start()])
+        position = match.end()
+        if match.group(0) == "%%":
+            tokens.append("%")
+            continue
+        index += 1
+        tokens.append(int(match.group(1)) if match.group(1) else index)
+    tokens.extend(template[position:])
+    if len(tokens) < 3 or tokens[:2] != [1, " "] or 1 in tokens[2:]:
+        return None
+    return tokens[2:]
+
+
+class DeathMatcher:
+
+    def __init__(self, templates: dict[str, str]):
+        self.templates = templates
+        trie = {}
+        self._group_count = 0
+
+        for key, template in sorted(templates.items()):
+            if not key.startswith("death.") or ".link" in key:
+                continue
+            tokens = _parse_template(template)
+            if tokens is None:
+                continue
+            node = trie
+            for token in tokens:
+                node = node.setdefault(token, {})
+            # identical templates (mob and player kills) share a leaf
+            node.setdefault(_END, key)
+
+        self._names: dict[str, str] = {}  # leaf group name -> template key
+        self._placeholder_names: dict[str, dict[int, str]] = {}  # template key -> placeholder groups
+        self.pattern = re.compile(_PLAYER + self._build(trie, {}))
+
+    def _build(self, node: dict, placeholders: dict[int, str]) -> str:
+        alternatives = []
+        # text first, then placeholders, "ends here" last so the longest template wins
+        for token in sorted(t for t in node if isinstance(t, str)):
+            alternatives.append(re.escape(token) + self._build(node[token], placeholders))
+        for token in sorted(t for t in node if isinstance(t, int)):
+            self._group_count += 1
+            name = f"p{self._group_count}"
+            alternatives.append(f"(?P<{name}>.+?)" + self._build(node[token], {**placeholders, token: name}))
+        if _END in node:
+            key = node[_END]
+            self._group_count += 1
+            name = f"t{self._group_count}"
+            self._names[name] = key
+            self._placeholder_names[key] = placeholders
+            alternatives.append(f"(?P<{name}>)$")
+
+        if len(alternatives) == 1:
+            return alternatives[0]
+        return "(?:" + "|".join(alternatives) + ")"
+
+    def match(self, message: str) -> tuple[str, str, str | None] | None:
+        # returns (player, cause, killer) or None, cause is the message without
+        # the player, with the killer replaced by <killer> and the item by <item>
+        match = self.pattern.match(message)
+        if match is None:
+            return None
+        key = self._names[match.lastgroup]
+        groups = self._placeholder_names[key]
+        killer = match.group(groups[2]) if 2 in groups else None
+
+        cause = self.templates[key]
+        cause = cause[cause.find(" ") + 1:]
+        cause = _PLACEHOLDER.sub(lambda m: {"2": "<killer>", "3": "<item>"}.get(m.group(1), m.group(0)), cause)
+        return match.group("player"), cause, killer
+
+
+def _read_jar(jar: zipfile.ZipFile) -> tuple[str | None, dict | None]:
+    # returns (version, templates), looks into the jars of bundler server
+    # jars (1.18+, META-INF/versions/...) in memory
+    names = set(jar.namelist())
+    version = None
+    if "version.json" in names:
+        version = json.loads(jar.read("version.json")).get("id")
+    if LANG_FILE in names:
+        return version, json.loads(jar.read(LANG_FILE))
+
+    for name in names:
+        if name.startswith("META-INF/versions/") and name.endswith(".jar"):
+            with zipfile.ZipFile(io.BytesIO(jar.read(name))) as inner:
+                inner_version, templates = _read_jar(inner)
+            if templates is not None:
+                return version or inner_version, templates
+    return version, None
+
+
+def _jar_version(jar: zipfile.ZipFile, jar_path: str) -> str:
+    if "version.json" in jar.namelist():
+        version = json.loads(jar.read("version.json")).get("id")
+        if version:
+            return version
+    st = os.stat(jar_path)
+    return f"unknown-{st.st_size}-{st.st_mtime_ns}"
+
+
+def load_death_messages(jar_path: str, data_root: str) -> dict[str, str] | None:
+    # death.* templates of the server, None if they can't be read
+    try:
+        with zipfile.ZipFile(jar_path) as jar:
+            # reading version.json only needs the zip directory, the
+            # language file is only read once per version
+            version = _jar_version(jar, jar_path)
+            cache_path = os.path.join(data_root, CACHE_DIRECTORY, f"{version}.json")
+            try:
+                with open(cache_path, encoding="utf-8") as f:
+                    return json.load(f)
+            except (OSError, ValueError):
+                pass
+
+            _, lang = _read_jar(jar)
+    except (OSError, zipfile.BadZipFile, ValueError) as e:
+        print(f"Failed to read death messages from {jar_path}: {e}")
+        return None
+    if lang is None:
+        return None
+
+    templates = {key: value for key, value in lang.items() if key.startswith("death.")}
+    # without the cache the language file is only read again on the next start
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = cache_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(templates, f, indent=1)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        print(f"Failed to cache death messages in {cache_path}: {e}")
+    return templates
@@ -0,0 +1,634 @@
+# Fleet: servers spread over several hosts
+# every host runs an agent ("mcsw agent") that starts and stops wrappers in
+# its data root and reports the capacity of the host (memory, load, running
+# servers). The controller ("mcsw controller") polls all agents, starts the
+# servers listed in controller.cfg on the host with the most room, restarts
+# them when they exit and moves a server away from a host that is overloaded.
+# Agents are plain http with json bodies. Requests are signed with a shared
+# token (hmac over method, path, time, a random nonce and body), so the token
+# itself is never sent. Agents only accept requests signed within the last
+# MAX_CLOCK_SKEW seconds (and at most FUTURE_SKEW ahead) and remember the
+# nonces of that window, so a captured request can't be sent again.
+# Only servers whose directory exists on a host are moved there, moving the
+# world between hosts is left to shared storage (e.g. the data root on NFS).
+
+import hashlib
+import hmac
+import json
+import os
+import re
+import secrets
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from .config import KVConfig, get_data_root
+from .process_sampler import read_meminfo, read_stat, read_tree, _CLK_TCK
+from .restart_policy import RestartPolicy
+
+AGENT_CONFIG = "agent.cfg"
+CONTROLLER_CONFIG = "controller.cfg"
+FLEET_STATE = "fleet.json"
+OUTPUT_FILE = "agent_output.log"
+
+# requests older than this are rejected
+MAX_CLOCK_SKEW = 30.0
+# clocks of controller and agents may differ a bit, but not more
+FUTURE_SKEW = 5.0
+_MAX_BODY = 64 * 1024
+_SERVER_NAME = re.compile(r"[A-Za-z0-9_][A-Za-z0-9_.-]*")
+
+
+def sign(token: str, method: str, path: str, timestamp: str, nonce: str, body: bytes) -> str:
+    message = f"{method}\n{path}\n{timestamp}\n{nonce}\n".encode("utf-8") + body
+    return hmac.new(token.encode("utf-8"), message, hashlib.sha256).hexdigest()
+
+
+def request(address: str, token: str, method: str, path: str, data: dict | None = None, timeout: float = 5.0) -> dict:
+    # signed request to an agent, raises OSError if it can't be reached
+    body = json.dumps(data).encode("utf-8") if data is not None else b""
+    timestamp = str(time.time())
+    nonce = secrets.token_hex(16)
+    req = urllib.request.Request(f"http://{address}{path}", data=body if data is not None else None, method=method)
+    req.add_header("Content-Type", "application/json")
+    req.add_header("X-MCSW-Time", timestamp)
+    req.add_header("X-MCSW-Nonce", nonce)
+    req.add_header("X-MCSW-Signature", sign(token, method, path, timestamp, nonce, body))
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            return json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        # refused, e.g. the host already runs max_servers
+        if e.code == 409:
+            return json.loads(e.read())
+        raise
+    except ValueError as e:
+        raise OSError(f"Invalid reply from {address}: {e}")
+
+
+# agent
+
+@dataclass
+class AgentConfig(KVConfig):
+    comment1: str = "# name of this host in the controller, the host name if empty"
+    name: str = ""
+    comment2: str = "# host: 0.0.0.0 to accept the controller from other hosts"
+    host: str = "127.0.0.1"
+    port: int = 25590
+    comment3: str = "# token: shared secret, controller.cfg needs the same token"
+    token: str = ""
+    comment4: str = "# max_servers: servers this host runs at most, 0 for no limit"
+    max_servers: int = 0
+    comment5: str = "# stop_timeout: seconds a server gets to stop before it is killed"
+    stop_timeout: float = 60.0
+
+
+class _ServerProcess:
+
+    def __init__(self, name: str, process: subprocess.Popen, output):
+        self.name = name
+        self.process = process
+        self.output = output
+        self.started = time.time()
+        self.stopping = False
+        self._last_ticks = None
+        self._last_time = None
+
+    def usage(self) -> dict:
+        # rss and cpu of the wrapper and everything it started
+        rss = 0
+        ticks = 0
+        for pid in read_tree(self.process.pid):
+            stat = read_stat(pid)
+            if stat is not None:
+                rss += stat["rss"]
+                ticks += stat["cpu_ticks"]
+        now = time.monotonic()
+        cpu = 0.0
+        if self._last_ticks is not None and now > self._last_time:
+            cpu = max(0.0, (ticks - self._last_ticks) / _CLK_TCK / (now - self._last_time) * 100)
+        self._last_ticks = ticks
+        self._last_time = now
+        return {"pid": self.process.pid, "uptime": int(time.time() - self.started),
+                "rss": rss, "cpu_percent": round(cpu, 1), "stopping": self.stopping}
+
+
+class Agent:
+
+    def __init__(self, data_root: str | None = None):
+        self.data_root = data_root or get_data_root()
+        os.makedirs(self.data_root, exist_ok=True)
+        self.config = AgentConfig()
+        self.config.set_path(os.path.join(self.data_root, AGENT_CONFIG))
+        self.config.load_config()
+        if not self.config.token:
+            self.config.token = secrets.token_urlsafe(24)
+            print(f"Generated agent token, copy it to controller.cfg: {self.config.token}")
+        self.config.save_config()
+        self.name = self.config.name or socket.gethostname()
+
+        self._lock = threading.Lock()
+        self.servers: dict[str, _ServerProcess] = {}
+        self._http = None
+        self._nonce_lock = threading.Lock()
+        self._nonces: dict[str, float] = {}  # nonce -> time it was used, only for signed requests
+
+    def use_nonce(self, nonce: str) -> bool:
+        # False if the nonce was already used, i.e. the request is replayed
+        now = time.time()
+        with self._nonce_lock:
+            # a nonce only has to be remembered as long as its request is accepted
+            for old, used in list(self._nonces.items()):
+                if now - used <= MAX_CLOCK_SKEW + FUTURE_SKEW:
+                    break
+                del self._nonces[old]
+            if nonce in self._nonces:
+                return False
+            self._nonces[nonce] = now
+            return True
+
+    def directories(self) -> list[str]:
+        # server directories on this host
+        names = []
+        for entry in os.scandir(self.data_root):
+            if entry.is_dir() and _SERVER_NAME.fullmatch(entry.name):
+                if os.path.exists(os.path.join(entry.path, "wrapper.cfg")) or os.path.exists(os.path.join(entry.path, "server.jar")):
+                    names.append(entry.name)
+        return sorted(names)
+
+    def _reap(self):
+        # forget wrappers that exited
+        for name, server in list(self.servers.items()):
+            code = server.process.poll()
+            if code is not None:
+                server.output.close()
+                del self.servers[name]
+                print(f"{name} exited with code {code}")
+
+    def status(self) -> dict:
+        with self._lock:
+            self._reap()
+            servers = {name: server.usage() for name, server in self.servers.items()}
+        meminfo = read_meminfo() or {}
+        load = os.getloadavg()[0] if hasattr(os, "getloadavg") else 0.0
+        return {
+            "name": self.name,
+            "cpu_count": os.cpu_count() or 1,
+            "load": load,
+            "memory_total": meminfo.get("MemTotal", 0),
+            "memory_available": meminfo.get("MemAvailable", 0),
+            "max_servers": self.config.max_servers,
+            "servers": servers,
+            "directories": self.directories(),
+        }
+
+    def start_server(self, name: str) -> tuple[bool, str]:
+        if not _SERVER_NAME.fullmatch(name):
+            return False, f"Invalid server name {name}"
+        with self._lock:
+            self._reap()
+            if name in self.servers:
+                return True, f"{name} is already running"
+            if 0 < self.config.max_servers <= len(self.servers):
+                return False, f"{self.name} already runs {len(self.servers)} servers"
+
+            directory = os.path.join(self.data_root, name)
+            os.makedirs(directory, exist_ok=True)
+            env = dict(os.environ, MCSW_DATA_ROOT=self.data_root, PYTHONUNBUFFERED="1")
+            output = open(os.path.join(directory, OUTPUT_FILE), "ab")
+            try:
+                # own session, so a kill also reaches the java process
+                process = subprocess.Popen(
+                    [sys.executable, "-m", "mcs_wrapper.wrapper", "run", "--directory", name],
+                    stdin=subprocess.PIPE, stdout=output, stderr=subprocess.STDOUT,
+                    cwd=self.data_root, env=env, start_new_session=True)
+            except OSError as e:
+                output.close()
+                return False, f"Failed to start {name}: {e}"
+            self.servers[name] = _ServerProcess(name, process, output)
+        print(f"Started {name} (pid {process.pid})")
+        return True, f"Started {name}"
+
+    def stop_server(self, name: str) -> tuple[bool, str]:
+        with self._lock:
+            server = self.servers.get(name)
+            if server is None:
+                return True, f"{name} is not running"
+            if server.stopping:
+                return True, f"{name} is already stopping"
+            server.stopping = True
+        print(f"Stopping {name}")
+        try:
+            # same as typing stop into the wrapper terminal
+            server.process.stdin.write(b"stop\n")
+            server.process.stdin.flush()
+        except OSError:
+            pass
+        threading.Thread(target=self._kill_after, args=(server,), daemon=True, name=f"stop_{name}").start()
+        return True, f"Stopping {name}"
+
+    def _kill_after(self, server: _ServerProcess):
+        try:
+            server.process.wait(self.config.stop_timeout)
+        except subprocess.TimeoutExpired:
+            print(f"{server.name} did not stop within {self.config.stop_timeout}s, killing it")
+            try:
+                os.killpg(server.process.pid, signal.SIGKILL)
+            except OSError:
+                server.process.kill()
+            server.process.wait()
+
+    def serve(self):
+        handler = type("AgentHandler", (_AgentHandler,), {"agent": self})
+        self._http = ThreadingHTTPServer((self.config.host, self.config.port), handler)
+        self._http.daemon_threads = True
+        print(f"Agent {self.name} listening on {self.config.host}:{self.config.port}, data root {self.data_root}")
+        try:
+            self._http.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        # a second ctrl+c would leave the servers running without the agent
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        print("Stopping servers...")
+        self.close()
+
+    def close(self):
+        if self._http is not None:
+            self._http.server_close()
+            self._http = None
+        # the servers would lose their terminal, stop them
+        with self._lock:
+            servers = list(self.servers)
+        for name in servers:
+            self.stop_server(name)
+        for name in servers:
+            server = self.servers.get(name)
+            if server is not None:
+                server.process.wait()
+        with self._lock:
+            self._reap()
+
+
+class _AgentHandler(BaseHTTPRequestHandler):
+    agent: Agent = None
+    timeout = 10.0  # a client that stops sending can't block a handler thread
+
+    def _reply(self, code: int, data: dict):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_request(self) -> bytes | None:
+        # the body if the signature is valid, None after replying with an error
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self._reply(400, {"error": "Invalid Content-Length"})
+            return None
+        if length > _MAX_BODY:
+            self._reply(413, {"error": "Request too large"})
+            return None
+        try:
+            body = self.rfile.read(length) if length else b""
+        except OSError:
+            return None
+
+        timestamp = self.headers.get("X-MCSW-Time", "")
+        nonce = self.headers.get("X-MCSW-Nonce", "")
+        signature = self.headers.get("X-MCSW-Signature", "")
+        try:
+            age = time.time() - float(timestamp)
+        except ValueError:
+            age = float("inf")
+        expected = sign(self.agent.config.token, self.command, self.path, timestamp, nonce, body)
+        if not -FUTURE_SKEW <= age <= MAX_CLOCK_SKEW or not nonce or not hmac.compare_digest(expected, signature):
+            self._reply(403, {"error": "Invalid signature"})
+            return None
+        # only checked after the signature, so nobody else can fill the nonce list
+        if not self.agent.use_nonce(nonce):
+            self._reply(403, {"error": "Request was already used"})
+            return None
+        return body
+
+    def do_GET(self):
+        if self._read_request() is None:
+            return
+        if self.path == "/status":
+            self._reply(200, self.agent.status())
+        else:
+            self._reply(404, {"error": "Not found"})
+
+    def do_POST(self):
+        body = self._read_request()
+        if body is None:
+            return
+        try:
+            server = json.loads(body)["server"]
+        except (ValueError, KeyError, TypeError):
+            self._reply(400, {"error": "Expected {\"server\": <name>}"})
+            return
+        if self.path == "/start":
+            ok, message = self.agent.start_server(str(server))
+        elif self.path == "/stop":
+            ok, message = self.agent.stop_server(str(server))
+        else:
+            self._reply(404, {"error": "Not found"})
+            return
+        self._reply(200 if ok else 409, {"ok": ok, "message": message})
+
+    def log_message(self, format, *args):
+        pass
+
+
+# controller
+
+@dataclass
+class ControllerConfig(KVConfig):
+    comment1: str = "# agents: comma separated host:port of the agents"
+    agents: str = "127.0.0.1:25590"
+    token: str = ""
+    comment2: str = "# servers: comma separated server directories that should be running"
+    servers: str = ""
+    poll_interval: float = 5.0
+    comment3: str = "# a host is overloaded above max_load (load average per cpu) or below min_free_memory_mb"
+    max_load: float = 0.9
+    min_free_memory_mb: int = 1024
+    comment4: str = "# rebalance: move one server away from an overloaded host, at most once per rebalance_cooldown seconds"
+    rebalance: bool = True
+    rebalance_cooldown: float = 300.0
+    comment5: str = "# failover_after: start the servers of an unreachable agent elsewhere after that many seconds, 0 for never"
+    comment6: str = "# (only safe if the host is really down, otherwise the server runs twice)"
+    failover_after: float = 0.0
+    comment7: str = "# a server that exits on its own is started again, unless it exited restart_attempts times in 10 minutes"
+    restart_attempts: int = 5
+
+
+class _AgentState:
+
+    def __init__(self, address: str):
+        self.address = address
+        self.status: dict | None = None
+        self.unreachable_since: float | None = None
+
+    @property
+    def name(self) -> str:
+        return self.status["name"] if self.status else self.address
+
+
+def _split(value: str) -> list[str]:
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+class Controller:
+
+    def __init__(self, data_root: str | None = None):
+        self.data_root = data_root or get_data_root()
+        os.makedirs(self.data_root, exist_ok=True)
+        self.config = ControllerConfig()
+        self.config.set_path(os.path.join(self.data_root, CONTROLLER_CONFIG))
+        self.config.load_config()
+        self.config.save_config()
+        self.state_path = os.path.join(self.data_root, FLEET_STATE)
+
+        self.agents: dict[str, _AgentState] = {}
+        self.placement: dict[str, str] = {}  # server -> address of the agent it last ran on
+        self.expected: dict[str, str] = {}  # server -> agent it was started on and should still run on
+        self.moving: dict[str, str] = {}  # server -> agent it moves to once it stopped
+        self.policies: dict[str, RestartPolicy] = {}
+        self.not_before: dict[str, float] = {}
+        self.given_up: set[str] = set()
+        self._next_rebalance = 0.0
+        self._stop_event = threading.Event()
+        self._load_state()
+
+    def _load_state(self):
+        try:
+            with open(self.state_path) as f:
+                self.placement = json.load(f).get("placement", {})
+        except (OSError, ValueError):
+            pass
+
+    def _save_state(self):
+        agents = {}
+        for address, agent in self.agents.items():
+            status = agent.status or {}
+            agents[address] = {"name": agent.name, "reachable": agent.unreachable_since is None,
+                               "load": status.get("load"), "memory_available": status.get("memory_available"),
+                               "servers": sorted(status.get("servers", {}))}
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"placement": self.placement, "agents": agents}, f, indent=1)
+        os.replace(tmp_path, self.state_path)
+
+    def _request(self, agent: _AgentState, method: str, path: str, data: dict | None = None) -> dict | None:
+        try:
+            return request(agent.address, self.config.token, method, path, data)
+        except OSError as e:
+            print(f"{method} {path} on {agent.name} failed: {e}")
+            return None
+
+    # polling
+
+    def poll(self):
+        # status of all agents at the same time, one slow host doesn't delay the others
+        addresses = _split(self.config.agents)
+        self.agents = {address: self.agents.get(address) or _AgentState(address) for address in addresses}
+
+        def fetch(agent: _AgentState):
+            try:
+                agent.status = request(agent.address, self.config.token, "GET", "/status")
+                if agent.unreachable_since is not None:
+                    print(f"Agent {agent.name} is reachable again")
+                agent.unreachable_since = None
+            except OSError as e:
+                if agent.unreachable_since is None:
+                    print(f"Agent {agent.address} is unreachable: {e}")
+                    agent.unreachable_since = time.monotonic()
+                agent.status = None
+
+        threads = [threading.Thread(target=fetch, args=(agent,), daemon=True) for agent in self.agents.values()]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def overloaded(self, agent: _AgentState) -> str | None:
+        # reason why the host is overloaded, None if it isn't
+        status = agent.status
+        if status is None:
+            return None
+        load = status["load"] / status["cpu_count"]
+        if load > self.config.max_load:
+            return f"load {load:.2f} per cpu"
+        free = status["memory_available"] / (1024 * 1024)
+        if status["memory_total"] and free < self.config.min_free_memory_mb:
+            return f"{free:.0f} MB free"
+        return None
+
+    def _fits(self, agent: _AgentState, rss: int = 0, cpu_percent: float = 0.0) -> bool:
+        # whether the host can take a server of that size without being overloaded
+        status = agent.status
+        if status is None or self.overloaded(agent):
+            return False
+        if 0 < status["max_servers"] <= len(status["servers"]):
+            return False
+        if (status["load"] + cpu_percent / 100) / status["cpu_count"] > self.config.max_load:
+            return False
+        free = (status["memory_available"] - rss) / (1024 * 1024)
+        return not status["memory_total"] or free >= self.config.min_free_memory_mb
+
+    def place(self, server: str, exclude: str | None = None, rss: int = 0, cpu_percent: float = 0.0) -> _AgentState | None:
+        # the agent a server should run on. Servers that exist somewhere only
+        # go to hosts with their directory, so worlds aren't started empty
+        reachable = [a for a in self.agents.values() if a.status is not None]
+        candidates = [a for a in reachable if a.address != exclude]
+        if server in self.placement or any(server in a.status["directories"] for a in reachable):
+            candidates = [a for a in candidates if server in a.status["directories"]]
+        candidates = [a for a in candidates if self._fits(a, rss, cpu_percent)]
+        if not candidates:
+            return None
+
+        def score(agent: _AgentState):
+            status = agent.status
+            return (agent.address == self.placement.get(server),
+                    status["memory_available"] - rss,
+                    -len(status["servers"]),
+                    -status["load"] / status["cpu_count"])
+        return max(candidates, key=score)
+
+    # actions
+
+    def start(self, server: str, agent: _AgentState) -> bool:
+        reply = self._request(agent, "POST", "/start", {"server": server})
+        if reply is None or not reply.get("ok"):
+            if reply is not None:
+                print(f"{agent.name} refused to start {server}: {reply.get('message')}")
+            return False
+        print(f"Started {server} on {agent.name}")
+        self.placement[server] = agent.address
+        self.expected[server] = agent.address
+        # count it right away, the next status is only fetched in the next round
+        agent.status["servers"][server] = {"rss": 0, "cpu_percent": 0.0, "stopping": False}
+        return True
+
+    def stop(self, server: str, agent: _AgentState):
+        if self.expected.get(server) == agent.address:
+            del self.expected[server]
+        if self._request(agent, "POST", "/stop", {"server": server}) is not None:
+            print(f"Stopping {server} on {agent.name}")
+
+    def reconcile(self):
+        now = time.monotonic()
+        desired = _split(self.config.servers)
+        running: dict[str, list[_AgentState]] = {}
+        for agent in self.agents.values():
+            if agent.status is not None:
+                for server in agent.status["servers"]:
+                    running.setdefault(server, []).append(agent)
+
+        # servers that exited without being stopped by the controller
+        for server, address in list(self.expected.items()):
+            agent = self.agents.get(address)
+            if agent is None or agent.status is None or server in running:
+                continue
+            del self.expected[server]
+            policy = self.policies.setdefault(server, RestartPolicy(delay=self.config.poll_interval, window=600.0))
+            policy.attempts = self.config.restart_attempts
+            delay = policy.next_delay(crashed=True)
+            if delay is None:
+                print(f"{server} exited {policy.recent_crashes()} times in {policy.window:.0f}s, not starting it again")
+                self.given_up.add(server)
+            else:
+                print(f"{server} exited on {agent.name}, starting it again in {delay:.0f}s")
+                self.not_before[server] = now + delay
+
+        # servers that were removed from the config, or run twice
+        for server, agents in running.items():
+            keep = None
+            if server in desired and server not in self.moving:
+                keep = next((a for a in agents if a.address == self.expected.get(server)), agents[0])
+                self.expected[server] = keep.address
+            for agent in agents:
+                if agent is not keep and not agent.status["servers"][server].get("stopping"):
+                    self.stop(server, agent)
+
+        # a server that is removed and added again gets a new chance
+        for server in list(self.given_up):
+            if server not in desired:
+                self.given_up.discard(server)
+                self.policies.pop(server, None)
+        for server in list(self.moving):
+            if server not in desired:
+                del self.moving[server]
+
+        for server in desired:
+            if server in running or server in self.given_up or now < self.not_before.get(server, 0.0):
+                continue
+            # it may still run on a host we can't reach
+            address = self.placement.get(server)
+            agent = self.agents.get(address) if address else None
+            if agent is not None and agent.status is None and server not in self.moving:
+                down = now - agent.unreachable_since
+                if self.config.failover_after <= 0 or down < self.config.failover_after:
+                    continue
+                print(f"Agent {agent.address} is down for {down:.0f}s, starting {server} elsewhere")
+
+            target = self.agents.get(self.moving.pop(server, None) or "")
+            if target is None or not self._fits(target):
+                target = self.place(server)
+            if target is None:
+                print(f"No host can take {server} right now")
+                continue
+            self.start(server, target)
+
+        if self.config.rebalance and now >= self._next_rebalance:
+            self._rebalance(now)
+
+    def _rebalance(self, now: float):
+        # move one server off the most overloaded host
+        for agent in self.agents.values():
+            reason = self.overloaded(agent)
+            if reason is None:
+                continue
+            servers = sorted(((info, name) for name, info in agent.status["servers"].items()
+                              if not info.get("stopping") and name not in self.moving),
+                             key=lambda item: item[0]["rss"], reverse=True)
+            for info, server in servers:
+                target = self.place(server, exclude=agent.address, rss=info["rss"], cpu_percent=info["cpu_percent"])
+                if target is None:
+                    continue
+                print(f"{agent.name} is overloaded ({reason}), moving {server} to {target.name}")
+                self.moving[server] = target.address
+                self.stop(server, agent)
+                self._next_rebalance = now + self.config.rebalance_cooldown
+                return
+
+    def run(self):
+        if not self.config.token:
+            print(f"Set token in {self.config.get_path()} to the token of the agents")
+            return
+        print(f"Controller managing {len(_split(self.config.servers))} servers on {len(_split(self.config.agents))} agents")
+        try:
+            while not self._stop_event.is_set():
+                # changes to controller.cfg apply in the next round
+                self.config.load_config()
+                self.poll()
+                self.reconcile()
+                self._save_state()
+                self._stop_event.wait(self.config.poll_interval)
+        except KeyboardInterrupt:
+            pass
+
+    def stop_controller(self):
+        self._stop_event.set()
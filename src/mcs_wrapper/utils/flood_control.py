@@ -0,0 +1,152 @@
+# Log flood protection
+# modded servers sometimes print the same warning thousands of times per second.
+# Lines are grouped by template (the line with all numbers replaced), once a
+# template is seen more than `threshold` times per window the rest is dropped,
+# except every `sample_rate`th line. Dropped lines are summarized in a
+# "repeated N times" line when the flood stops and every `summary_interval` seconds.
+
+import re
+import time
+
+_NUMBERS = re.compile(r"\d+")
+# forget templates that were not seen for this many seconds
+_TEMPLATE_TTL = 60.0
+_MAX_TEMPLATES = 10000
+
+
+def get_template(line: str) -> str:
+    return _NUMBERS.sub("#", line)
+
+
+def summary_line(count: int, example: str) -> str:
+    # formatted like a server line, so it can be handled like one
+    return f"[{time.strftime('%H:%M:%S')}] [mcs_wrapper/WARN]: Previous message repeated {count} times: {example}"
+
+
+class _Template:
+    __slots__ = ("window_start", "count", "suppressed", "last_seen", "last_summary", "example")
+
+    def __init__(self, now: float):
+        self.window_start = now
+        self.count = 0
+        self.suppressed = 0
+        self.last_seen = now
+        self.last_summary = now
+        self.example = ""
+
+
+class FloodControl:
+
+    def __init__(self, threshold: int = 20, sample_rate: int = 100, window: float = 1.0, summary_interval: float = 10.0):
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+        self.window = window
+        self.summary_interval = summary_interval
+        self.suppressed_total = 0
+        self._templates: dict[str, _Template] = {}
+        self._flooding: set[str] = set()
+        self._last_sweep = time.monotonic()
+        self._last_prune = self._last_sweep
+
+    def filter(self, lines: list[str]) -> list[str]:
+        # returns the lines that should be handled, including summaries
+        now = time.monotonic()
+        result = []
+        templates = self._templates
+        threshold = self.threshold
+
+        for line in lines:
+            key = get_template(line)
+            template = templates.get(key)
+            if template is None:
+                template = templates[key] = _Template(now)
+            elif now - template.window_start >= self.window:
+                template.window_start = now
+                template.count = 0
+            template.count += 1
+            template.last_seen = now
+
+            if template.count <= threshold:
+                result.append(line)
+                continue
+
+            # flooding, only keep samples
+            self._flooding.add(key)
+            template.suppressed += 1
+            template.example = line
+            self.suppressed_total += 1
+            if self.sample_rate > 0 and template.suppressed % self.sample_rate == 0:
+                result.append(line)
+
+        if now - self._last_sweep >= self.window:
+            self._last_sweep = now
+            result.extend(self._sweep(now))
+        return result
+
+    def sweep(self) -> list[str]:
+        # summaries of floods that stopped, for when no lines arrive to call filter()
+        now = time.monotonic()
+        if now - self._last_sweep < self.window:
+            return []
+        self._last_sweep = now
+        return self._sweep(now)
+
+    def _sweep(self, now: float) -> list[str]:
+        summaries = []
+        for key in list(self._flooding):
+            template = self._templates[key]
+            ended = now - template.last_seen >= self.window
+            if ended or now - template.last_summary >= self.summary_interval:
+                if template.suppressed > 0:
+                    summaries.append(summary_line(template.suppressed, template.example))
+                template.suppressed = 0
+                template.last_summary = now
+            if ended:
+                self._flooding.discard(key)
+
+        if len(self._templates) > _MAX_TEMPLATES or now - self._last_prune >= _TEMPLATE_TTL:
+            self._prune(now)
+        return summaries
+
+    def _prune(self, now: float):
+        self._last_prune = now
+        self._templates = {key: t for key, t in self._templates.items()
+                           if key in self._flooding or now - t.last_seen < _TEMPLATE_TTL}
+        if len(self._templates) > _MAX_TEMPLATES:
+            # too many different lines, start over instead of growing forever
+            self._templates = {key: self._templates[key] for key in self._flooding}
+
+    def flush(self) -> list[str]:
+        # summaries of all running floods, e.g. when the server stopped
+        summaries = []
+        for key in self._flooding:
+            template = self._templates[key]
+            if template.suppressed > 0:
+                summaries.append(summary_line(template.suppressed, template.example))
+            template.suppressed = 0
+        self._flooding.clear()
+        return summaries
+
+
+class RateLimiter:
+    # limits console output to max_per_second lines
+
+    def __init__(self, max_per_second: int):
+        self.max_per_second = max_per_second
+        self._second = 0
+        self._count = 0
+        self.dropped = 0
+
+    def allow(self) -> bool:
+        second = int(time.monotonic())
+        if second != self._second:
+            self._second = second
+            self._count = 0
+            if self.dropped:
+                print(f"[mcs_wrapper] {self.dropped} lines not shown")
+                self.dropped = 0
+        self._count += 1
+        if self._count <= self.max_per_second:
+            return True
+        self.dropped += 1
+        return False
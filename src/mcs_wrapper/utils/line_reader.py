@@ -0,0 +1,71 @@
+# Reads lines from a raw pipe in large chunks
+# instead of one readline() and decode per line, up to 64 KiB are read at
+# once, split at the last newline and decoded in one go. The rest of the
+# chunk is kept until the next read.
+
+import os
+
+CHUNK_SIZE = 64 * 1024
+# a line longer than this is passed on in pieces instead of buffering forever
+MAX_LINE_LENGTH = 1024 * 1024
+
+
+class LineSplitter:
+
+    def __init__(self, encoding: str = "utf-8"):
+        self.encoding = encoding
+        self._pending = b""
+
+    def feed(self, chunk: bytes) -> list[str]:
+        # returns the complete lines of chunk (and earlier chunks), stripped
+        end = chunk.rfind(b"\n")
+        if end == -1:
+            self._pending += chunk
+            if len(self._pending) > MAX_LINE_LENGTH:
+                return self.flush()
+            return []
+
+        view = memoryview(chunk)
+        first = chunk.find(b"\n")
+        if self._pending:
+            # the first line started in an earlier chunk, decode it together
+            # so characters split between two reads are decoded correctly
+            lines = [(self._pending + view[:first]).decode(self.encoding, "replace")]
+            if first != end:
+                lines.extend(str(view[first + 1:end], self.encoding, "replace").split("\n"))
+        else:
+            lines = str(view[:end], self.encoding, "replace").split("\n")
+        self._pending = bytes(view[end + 1:])
+
+        return [line.strip() for line in lines if line and not line.isspace()]
+
+    def pending_bytes(self) -> int:
+        # bytes of the incomplete last line
+        return len(self._pending)
+
+    def flush(self) -> list[str]:
+        # returns the incomplete last line, if any
+        if not self._pending:
+            return []
+        line = self._pending.decode(self.encoding, "replace").strip()
+        self._pending = b""
+        return [line] if line else []
+
+
+def read_lines(fd: int, callback, chunk_size: int = CHUNK_SIZE):
+    # read fd until EOF and call callback(lines) for every chunk
+    splitter = LineSplitter()
+    while True:
+        try:
+            chunk = os.read(fd, chunk_size)
+        except OSError:
+            # pipe was closed
+            break
+        if not chunk:
+            break
+        lines = splitter.feed(chunk)
+        if lines:
+            callback(lines)
+    lines = splitter.flush()
+    if lines:
+        callback(lines)
@@ -0,0 +1,208 @@
+# Wrapper log files
+# writes the server output and the commands sent to the server to
+# <server directory>/wrapper_logs/latest.log. Lines are queued and written
+# by a background thread with large buffered writes, so the reader thread
+# never waits for the disk. If the disk can't keep up, at most max_pending
+# lines are queued and the rest is dropped (and counted in the log).
+# The log is rotated when it gets too big or the day changes, rotated files
+# are compressed in the background (gzip, or zstd if the zstandard package
+# is installed) and deleted after some days.
+
+import datetime
+import gzip
+import os
+import queue
+import shutil
+import threading
+import time
+
+LOG_DIRECTORY = "wrapper_logs"
+LATEST_LOG = "latest.log"
+_BUFFER_SIZE = 1024 * 1024
+# seconds between two error messages of the writer thread
+_ERROR_INTERVAL = 60.0
+
+
+def _compress_file(path: str, compression: str):
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            compression = "gzip"
+
+    try:
+        if compression == "zstd":
+            with open(path, "rb") as src, open(path + ".zst", "wb") as dst:
+                zstandard.ZstdCompressor(level=10).copy_stream(src, dst)
+        elif compression == "gzip":
+            with open(path, "rb") as src, gzip.open(path + ".gz", "wb", compresslevel=6) as dst:
+                shutil.copyfileobj(src, dst, _BUFFER_SIZE)
+        else:
+            return
+        os.remove(path)
+    except OSError as e:
+        print(f"Failed to compress {path}: {e}")
+
+
+class LogSink:
+
+    def __init__(self, directory: str, max_bytes: int = 50 * 1024 * 1024, rotate_daily: bool = True,
+                 compression: str = "gzip", retention_days: int = 30, flush_interval: float = 1.0,
+                 max_pending: int = 100000):
+        self.directory = os.path.join(directory, LOG_DIRECTORY)
+        self.max_bytes = max_bytes
+        self.rotate_daily = rotate_daily
+        self.compression = compression
+        self.retention_days = retention_days
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+
+        self._queue = queue.SimpleQueue()
+        self._pending_lock = threading.Lock()
+        self._pending = 0  # lines in the queue
+        self._dropped = 0  # lines not queued since the last write
+        self._file = None
+        self._size = 0
+        self._day = None
+        self._thread = None
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, LATEST_LOG)
+        # like the server, start every run with a new latest.log
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            self._rotate_file(path, datetime.date.fromtimestamp(os.path.getmtime(path)))
+        self._open()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="log_writer")
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def write_lines(self, lines: list[str]):
+        # called from the reader threads, only puts the lines in the queue
+        with self._pending_lock:
+            if self._pending + len(lines) > self.max_pending > 0:
+                self._dropped += len(lines)
+                return
+            self._pending += len(lines)
+        self._queue.put(lines)
+
+    def write(self, line: str):
+        self.write_lines([line])
+
+    def pending(self) -> int:
+        return self._pending
+
+    def _open(self):
+        # binary, the size has to be counted in bytes for max_bytes
+        path = os.path.join(self.directory, LATEST_LOG)
+        self._file = open(path, "ab", buffering=_BUFFER_SIZE)
+        self._size = self._file.tell()
+        self._day = datetime.date.today()
+
+    def _run(self):
+        last_flush = time.monotonic()
+        last_error = 0.0
+        running = True
+        while running:
+            try:
+                batch = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                batch = []
+
+            # take everything that is queued and write it at once
+            batches = [batch]
+            try:
+                while True:
+                    batches.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            if None in batches:
+                running = False
+                batches = [b for b in batches if b is not None]
+
+            lines = [line for batch in batches for line in batch]
+            with self._pending_lock:
+                self._pending -= len(lines)
+                dropped = self._dropped
+                self._dropped = 0
+            if dropped:
+                lines.append(f"[wrapper] {dropped} lines were not logged, the disk was too slow")
+
+            # a full disk or a failed rotation must not stop the thread,
+            # the queue would only grow
+            try:
+                if self._file is None:
+                    self._open()
+                if lines:
+                    data = ("\n".join(lines) + "\n").encode("utf-8", "replace")
+                    self._file.write(data)
+                    self._size += len(data)
+
+                now = time.monotonic()
+                if not running or now - last_flush >= self.flush_interval:
+                    self._file.flush()
+                    last_flush = now
+                if running:
+                    self._check_rotation()
+            except (OSError, ValueError) as e:
+                now = time.monotonic()
+                if now - last_error >= _ERROR_INTERVAL:
+                    print(f"Failed to write the wrapper log: {e}")
+                    last_error = now
+
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError as e:
+                print(f"Failed to write the wrapper log: {e}")
+            self._file = None
+
+    def _check_rotation(self):
+        new_day = self.rotate_daily and datetime.date.today() != self._day
+        if not new_day and (self.max_bytes <= 0 or self._size < self.max_bytes):
+            return
+
+        file = self._file
+        self._file = None
+        file.close()
+        try:
+            self._rotate_file(os.path.join(self.directory, LATEST_LOG), self._day)
+        finally:
+            # keep writing to latest.log even if it couldn't be renamed
+            self._open()
+
+    def _rotate_file(self, path: str, day: datetime.date):
+        # rename to <date>-<n>.log and compress it in the background
+        n = 1
+        while True:
+            rotated = os.path.join(self.directory, f"{day.isoformat()}-{n}.log")
+            if not any(os.path.exists(rotated + ext) for ext in ("", ".gz", ".zst")):
+                break
+            n += 1
+        os.replace(path, rotated)
+
+        def compress():
+            _compress_file(rotated, self.compression)
+            self._delete_old_logs()
+
+        threading.Thread(target=compress, daemon=True, name="log_compressor").start()
+
+    def _delete_old_logs(self):
+        if self.retention_days <= 0:
+            return
+        cutoff = time.time() - self.retention_days * 24 * 3600
+        for name in os.listdir(self.directory):
+            if name == LATEST_LOG:
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
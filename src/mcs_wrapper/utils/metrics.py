@@ -0,0 +1,361 @@
+# Prometheus/OpenMetrics style metrics
+# small dependency free implementation of counters, gauges and histograms
+# and an http endpoint that exports them in the prometheus text format
+# all wrappers in one process share the same registry, every metric
+# has a "server" label so many servers can be scraped from one endpoint
+
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from .server_parser import player_joined, player_left, server_tps, server_lag
+
+# latency buckets in seconds, listeners should usually take well below 1ms
+DEFAULT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace("\"", "\\\"")
+
+
+def _format_labels(names, values, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    if not parts:
+        return ""
+    return "{" + ",".join(parts) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _CounterChild:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+    def get(self) -> float:
+        return self.value
+
+
+class _GaugeChild:
+    def __init__(self):
+        self.value = 0.0
+        self._function = None
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+    def set_function(self, function):
+        # value is computed when the metrics are scraped
+        self._function = function
+
+    def get(self) -> float:
+        if self._function is not None:
+            try:
+                return float(self._function())
+            except Exception:
+                return float("nan")
+        return self.value
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self.sum += value
+            self.count += 1
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+
+    def time(self):
+        return _Timer(self)
+
+
+class _Timer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class Metric:
+    type = "untyped"
+    suffix = ""  # appended to the name in the output, HELP and TYPE have to use the same name
+
+    def __init__(self, name: str, documentation: str, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if registry is None:
+            registry = REGISTRY
+        registry.register(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values, **kwargs):
+        if kwargs:
+            values = tuple(kwargs[name] for name in self.labelnames)
+        values = tuple(str(v) for v in values)
+        if len(values) != len(self.labelnames):
+            raise Exception(f"Metric {self.name} expects labels {self.labelnames}")
+
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def remove(self, *values):
+        with self._lock:
+            self._children.pop(tuple(str(v) for v in values), None)
+
+    def render(self) -> list[str]:
+        name = self.name + self.suffix
+        lines = [f"# HELP {name} {self.documentation}", f"# TYPE {name} {self.type}"]
+        for values, child in list(self._children.items()):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+    def _render_child(self, values, child) -> list[str]:
+        return [f"{self.name}{self.suffix}{_format_labels(self.labelnames, values)} {_format_value(child.get())}"]
+
+
+class Counter(Metric):
+    type = "counter"
+    suffix = "_total"
+
+    def _new_child(self):
+        return _CounterChild()
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def _render_child(self, values, child) -> list[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(child.buckets, child.counts):
+            cumulative += count
+            labels = _format_labels(self.labelnames, values, f'le="{_format_value(bound)}"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+        lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric):
+        if metric.name in self._metrics:
+            raise Exception(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+
+    def get(self, name: str) -> Metric | None:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        lines.append("")
+        return "\n".join(lines)
+
+
+REGISTRY = MetricsRegistry()
+
+
+# http endpoint
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry: MetricsRegistry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # don't spam the server console with scrape requests
+        pass
+
+
+_servers: dict[tuple[str, int], ThreadingHTTPServer] = {}
+_servers_lock = threading.Lock()
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1", registry: MetricsRegistry = REGISTRY) -> ThreadingHTTPServer:
+    # start the http endpoint, only one server per host and port is started
+    # even if many wrappers in the same process ask for it
+    with _servers_lock:
+        server = _servers.get((host, port))
+        if server is not None:
+            return server
+
+        handler = type("MetricsHandler", (_MetricsHandler,), {"registry": registry})
+        server = ThreadingHTTPServer((host, port), handler)
+        server.daemon_threads = True
+        thread = threading.Thread(target=server.serve_forever, daemon=True, name=f"metrics_{port}")
+        thread.start()
+        _servers[(host, port)] = server
+        print(f"Metrics available at http://{host}:{port}/metrics")
+        return server
+
+
+def stop_metrics_server(port: int, host: str = "127.0.0.1"):
+    with _servers_lock:
+        server = _servers.pop((host, port), None)
+    if server is not None:
+        server.shutdown()
+        server.server_close()
+
+
+# wrapper metrics
+
+LINES = Counter("mcsw_lines", "Lines read from the server output", ["server"])
+COMMANDS = Counter("mcsw_commands", "Commands sent to the server", ["server"])
+RESTARTS = Counter("mcsw_restarts", "Server (re)starts", ["server"])
+LISTENER_LATENCY = Histogram("mcsw_listener_dispatch_seconds", "Time spent in Listener.handle_message", ["server", "listener"])
+LAG_TICKS = Counter("mcsw_lag_ticks", "Ticks the server reported to be behind (\"Can't keep up!\")", ["server"])
+QUEUE_DEPTH = Gauge("mcsw_queue_depth", "Number of items waiting in wrapper queues", ["server", "queue"])
+PLAYERS_ONLINE = Gauge("mcsw_players_online", "Players currently online", ["server"])
+SERVER_RUNNING = Gauge("mcsw_server_running", "1 if the server process is running", ["server"])
+TPS = Gauge("mcsw_tps", "Ticks per second reported by the server (last minute)", ["server"])
+PROCESS_CPU = Gauge("mcsw_process_cpu_percent", "CPU usage of the server process", ["server"])
+PROCESS_RSS = Gauge("mcsw_process_resident_memory_bytes", "Resident memory of the server process", ["server"])
+PROCESS_THREADS = Gauge("mcsw_process_threads", "Threads of the server process", ["server"])
+PROCESS_READ = Gauge("mcsw_process_read_bytes", "Bytes read from disk by the server process", ["server"])
+PROCESS_WRITE = Gauge("mcsw_process_write_bytes", "Bytes written to disk by the server process", ["server"])
+
+
+class WrapperMetrics:
+    # metric children of one wrapper, labeled with the server directory
+
+    def __init__(self, wrapper):
+        self.wrapper = wrapper
+        self.server = wrapper.directory
+        self.lines = LINES.labels(self.server)
+        self.commands = COMMANDS.labels(self.server)
+        self.restarts = RESTARTS.labels(self.server)
+        self.lag_ticks = LAG_TICKS.labels(self.server)
+        self.players_online = PLAYERS_ONLINE.labels(self.server)
+        self.tps = TPS.labels(self.server)
+        self._players = set()
+        self._listener_latency = {}
+
+        SERVER_RUNNING.labels(self.server).set_function(lambda: 1 if wrapper._server_running else 0)
+        PROCESS_CPU.labels(self.server).set_function(lambda: self._process_stat("cpu_percent"))
+        PROCESS_RSS.labels(self.server).set_function(lambda: self._process_stat("rss"))
+        PROCESS_THREADS.labels(self.server).set_function(lambda: self._process_stat("threads"))
+        PROCESS_READ.labels(self.server).set_function(lambda: self._process_stat("read_bytes"))
+        PROCESS_WRITE.labels(self.server).set_function(lambda: self._process_stat("write_bytes"))
+
+    def _process_stat(self, key):
+        sampler = self.wrapper.sampler
+        if sampler is None or not self.wrapper._server_running:
+            return float("nan")
+        return sampler.latest()[key]
+
+    def listener_latency(self, listener):
+        child = self._listener_latency.get(listener)
+        if child is None:
+            if listener not in self.wrapper._listeners:
+                # removed while the message was dispatched, don't export it again
+                return LISTENER_LATENCY._new_child()
+            child = LISTENER_LATENCY.labels(self.server, type(listener).__name__)
+            self._listener_latency[listener] = child
+        return child
+
+    def remove_listener(self, listener):
+        if self._listener_latency.pop(listener, None) is None:
+            return
+        # listeners of the same class share a child
+        name = type(listener).__name__
+        if all(type(other).__name__ != name for other in list(self._listener_latency)):
+            LISTENER_LATENCY.remove(self.server, name)
+
+    def register_queue(self, name: str, function):
+        # function returns the current depth of the queue
+        QUEUE_DEPTH.labels(self.server, name).set_function(function)
+
+    def observe_message(self, content: str | None):
+        self.lines.inc()
+        if content is None:
+            return
+
+        player = player_joined(content)
+        if player is not None:
+            self._players.add(player)
+            self.players_online.set(len(self._players))
+            return
+        player = player_left(content)
+        if player is not None:
+            self._players.discard(player)
+            self.players_online.set(len(self._players))
+            return
+        lag = server_lag(content)
+        if lag is not None:
+            self.lag_ticks.inc(lag)
+            return
+        tps = server_tps(content)
+        if tps is not None:
+            self.tps.set(tps)
+
+    def server_started(self):
+        self.restarts.inc()
+        self._players.clear()
+        self.players_online.set(0)
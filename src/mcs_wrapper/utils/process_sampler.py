@@ -0,0 +1,219 @@
+# Samples resource usage of the server process
+# reads /proc/<pid>/stat, /proc/<pid>/status and /proc/<pid>/io directly,
+# so no psutil is needed. Only works on Linux, on other systems the
+# sampler disables itself.
+
+import os
+import threading
+import time
+from .cyclic_list import CyclicArray
+
+_CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def is_supported() -> bool:
+    return os.path.exists("/proc/self/stat")
+
+
+def _read_file(path: str) -> str | None:
+    try:
+        with open(path, "r") as f:
+            return f.read()
+    except OSError:
+        # process is gone or we are not allowed to read it (e.g. io)
+        return None
+
+
+def read_stat(pid: int) -> dict | None:
+    # returns cpu ticks (utime + stime), number of threads and rss in bytes
+    content = _read_file(f"/proc/{pid}/stat")
+    if content is None:
+        return None
+
+    # the process name is in parentheses and may contain spaces,
+    # so split after the last ")"
+    fields = content[content.rfind(")") + 2:].split()
+    # fields[0] is field 3 (state) in proc(5), so field n is fields[n - 3]
+    return {
+        "state": fields[0],
+        "cpu_ticks": int(fields[11]) + int(fields[12]),
+        "threads": int(fields[17]),
+        "rss": int(fields[21]) * _PAGE_SIZE,
+    }
+
+
+def read_status(pid: int) -> dict | None:
+    # returns the memory values of /proc/<pid>/status in bytes
+    content = _read_file(f"/proc/{pid}/status")
+    if content is None:
+        return None
+
+    status = {}
+    for line in content.splitlines():
+        key, _, value = line.partition(":")
+        if key in ("VmRSS", "VmHWM", "VmSize", "Threads"):
+            value = value.split()
+            if not value:
+                continue
+            status[key] = int(value[0]) * 1024 if key != "Threads" else int(value[0])
+    return status
+
+
+def read_io(pid: int) -> dict | None:
+    # returns read_bytes and write_bytes, None if not readable
+    content = _read_file(f"/proc/{pid}/io")
+    if content is None:
+        return None
+
+    io = {}
+    for line in content.splitlines():
+        key, _, value = line.partition(":")
+        if key in ("read_bytes", "write_bytes"):
+            io[key] = int(value)
+    return io
+
+
+def read_meminfo() -> dict | None:
+    # MemTotal and MemAvailable of the host in bytes
+    content = _read_file("/proc/meminfo")
+    if content is None:
+        return None
+
+    meminfo = {}
+    for line in content.splitlines():
+        key, _, value = line.partition(":")
+        if key in ("MemTotal", "MemAvailable"):
+            meminfo[key] = int(value.split()[0]) * 1024
+    return meminfo
+
+
+def read_tree(pid: int) -> list[int]:
+    # pid and all its descendants, e.g. the wrapper and the java process it started
+    pids = [pid]
+    i = 0
+    while i < len(pids):
+        tasks = f"/proc/{pids[i]}/task"
+        try:
+            names = os.listdir(tasks)
+        except OSError:
+            names = []
+        for task in names:
+            children = _read_file(f"{tasks}/{task}/children")
+            if children:
+                pids.extend(int(child) for child in children.split())
+        i += 1
+    return pids
+
+
+class ProcessSampler:
+    # samples a process at a fixed interval and keeps the last max_samples
+    # values of each metric in array backed ring buffers
+    # on_limit(reason) is called when rss or cpu limits are exceeded
+
+    def __init__(self, pid: int, interval: float = 5.0, max_samples: int = 720,
+                 max_rss_mb: int = 0, max_cpu_percent: float = 0.0, max_cpu_seconds: float = 60.0,
+                 on_limit=None):
+        self.pid = pid
+        self.interval = interval
+        self.max_rss_mb = max_rss_mb
+        self.max_cpu_percent = max_cpu_percent
+        self.max_cpu_seconds = max_cpu_seconds
+        self.on_limit = on_limit
+
+        self.timestamps = CyclicArray(max_samples)
+        self.cpu_percent = CyclicArray(max_samples)
+        self.rss = CyclicArray(max_samples, "q")
+        self.peak_rss = 0
+        self.threads = CyclicArray(max_samples, "l")
+        self.read_bytes = CyclicArray(max_samples, "q")
+        self.write_bytes = CyclicArray(max_samples, "q")
+
+        self._last_ticks = None
+        self._last_time = None
+        self._cpu_high_since = None
+        self._limit_triggered = False
+
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if not is_supported():
+            print("Process sampler is disabled. /proc is not available on this system.")
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="process_sampler")
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            if not self.sample():
+                # process is gone
+                return
+            self._stop_event.wait(self.interval)
+
+    def sample(self) -> bool:
+        # take one sample, returns False if the process does not exist anymore
+        now = time.monotonic()
+        stat = read_stat(self.pid)
+        if stat is None:
+            return False
+        status = read_status(self.pid) or {}
+        io = read_io(self.pid) or {}
+
+        cpu = 0.0
+        if self._last_ticks is not None and now > self._last_time:
+            cpu = (stat["cpu_ticks"] - self._last_ticks) / _CLK_TCK / (now - self._last_time) * 100
+        self._last_ticks = stat["cpu_ticks"]
+        self._last_time = now
+
+        rss = status.get("VmRSS", stat["rss"])
+        self.peak_rss = max(self.peak_rss, status.get("VmHWM", rss))
+
+        self.timestamps.append(time.time())
+        self.cpu_percent.append(cpu)
+        self.rss.append(rss)
+        self.threads.append(status.get("Threads", stat["threads"]))
+        self.read_bytes.append(io.get("read_bytes", 0))
+        self.write_bytes.append(io.get("write_bytes", 0))
+
+        self._check_limits(now, cpu, rss)
+        return True
+
+    def _check_limits(self, now: float, cpu: float, rss: int):
+        if self._limit_triggered or self.on_limit is None:
+            return
+
+        if self.max_rss_mb > 0 and rss > self.max_rss_mb * 1024 * 1024:
+            self._trigger(f"RSS {rss // (1024 * 1024)} MB exceeds limit of {self.max_rss_mb} MB")
+            return
+
+        if self.max_cpu_percent > 0 and cpu >= self.max_cpu_percent:
+            if self._cpu_high_since is None:
+                self._cpu_high_since = now
+            elif now - self._cpu_high_since >= self.max_cpu_seconds:
+                self._trigger(f"CPU above {self.max_cpu_percent}% for {int(now - self._cpu_high_since)}s")
+        else:
+            self._cpu_high_since = None
+
+    def _trigger(self, reason: str):
+        # only trigger once per process
+        self._limit_triggered = True
+        self.on_limit(reason)
+
+    def latest(self) -> dict:
+        # latest values of all metrics
+        return {
+            "cpu_percent": self.cpu_percent.last(0.0),
+            "rss": int(self.rss.last(0)),
+            "peak_rss": self.peak_rss,
+            "threads": int(self.threads.last(0)),
+            "read_bytes": int(self.read_bytes.last(0)),
+            "write_bytes": int(self.write_bytes.last(0)),
+        }
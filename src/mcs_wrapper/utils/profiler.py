@@ -0,0 +1,118 @@
+# Cost accounting for the wrapper hot path
+# records call count, cumulative time and the slowest calls per listener
+# and can write a cProfile snapshot of the output handling for a time window
+
+import heapq
+import io
+import os
+import threading
+import time
+
+
+class CallStats:
+    __slots__ = ("count", "total", "slowest")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.slowest = []  # min heap of (duration, message id, line)
+
+
+class Profiler:
+
+    def __init__(self, keep_slowest: int = 5):
+        self.keep_slowest = keep_slowest
+        self.stats: dict[str, CallStats] = {}
+        self.started = time.time()
+
+        self._profile = None  # cProfile.Profile while a snapshot is running
+        self._profile_requested: tuple[float, str] | None = None
+        self._profile_end = 0.0
+        self._profile_path = None
+        self._lock = threading.Lock()
+
+    def record(self, name: str, duration: float, message=None):
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = CallStats()
+        stats.count += 1
+        stats.total += duration
+
+        slowest = stats.slowest
+        if len(slowest) < self.keep_slowest or duration > slowest[0][0]:
+            entry = (duration, message.id if message else -1, message.raw_content if message else "")
+            if len(slowest) < self.keep_slowest:
+                heapq.heappush(slowest, entry)
+            else:
+                heapq.heapreplace(slowest, entry)
+
+    def reset(self):
+        self.stats = {}
+        self.started = time.time()
+
+    def report(self) -> str:
+        elapsed = time.time() - self.started
+        lines = [f"Wrapper stats for the last {elapsed:.0f}s:"]
+        lines.append(f"{'name':<24} {'calls':>10} {'total ms':>10} {'avg us':>10} {'max ms':>10} {'% time':>7}")
+        for name, stats in sorted(self.stats.items(), key=lambda item: item[1].total, reverse=True):
+            average = stats.total / stats.count * 1e6 if stats.count else 0.0
+            slowest = max(stats.slowest)[0] if stats.slowest else 0.0
+            share = stats.total / elapsed * 100 if elapsed > 0 else 0.0
+            lines.append(f"{name:<24} {stats.count:>10} {stats.total * 1000:>10.1f} {average:>10.1f} {slowest * 1000:>10.2f} {share:>6.1f}%")
+
+        for name, stats in self.stats.items():
+            if not stats.slowest or name.startswith("_"):
+                continue
+            lines.append(f"Slowest calls of {name}:")
+            for duration, message_id, line in sorted(stats.slowest, reverse=True):
+                lines.append(f"  {duration * 1000:8.2f} ms  #{message_id} {line[:80]}")
+        return "\n".join(lines)
+
+    # cProfile only sees the thread it was enabled in and the output is
+    # handled by the stdout and stderr threads, so the profile is enabled
+    # around every batch of lines. The window is started and ended by tick(),
+    # which the wrapper calls every second, also when the server is quiet.
+    # All of them are called with the wrapper's dispatch lock held
+
+    def request_profile(self, seconds: float, path: str):
+        with self._lock:
+            self._profile_requested = (seconds, path)
+
+    def enable(self):
+        if self._profile is not None:
+            self._profile.enable()
+
+    def disable(self):
+        if self._profile is not None:
+            self._profile.disable()
+
+    def tick(self):
+        if self._profile is None:
+            if self._profile_requested is None:
+                return
+            with self._lock:
+                seconds, path = self._profile_requested
+                self._profile_requested = None
+            self._profile_end = time.monotonic() + seconds
+            self._profile_path = path
+            import cProfile
+            self._profile = cProfile.Profile()
+            return
+
+        if time.monotonic() >= self._profile_end:
+            self._dump_profile()
+            self._profile = None
+
+    def _dump_profile(self):
+        import pstats
+        self._profile.create_stats()
+        if not self._profile.stats:
+            print("No server output was handled while profiling")
+            return
+        os.makedirs(os.path.dirname(self._profile_path), exist_ok=True)
+        self._profile.dump_stats(self._profile_path)
+
+        out = io.StringIO()
+        pstats.Stats(self._profile, stream=out).sort_stats("cumulative").print_stats(15)
+        print(out.getvalue())
+        print(f"Profile written to {self._profile_path}")
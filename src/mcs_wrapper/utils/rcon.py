@@ -0,0 +1,287 @@
+# RCON client
+# a command channel that, unlike stdin, returns the reply of the server.
+# Packets are <int32 length><int32 id><int32 type><body>\0\0 (little endian).
+# The vanilla server reads a connection with one read() per packet and drops
+# it if a read doesn't contain exactly one packet, so a connection only ever
+# has one packet on the way: the next one is sent after the server answered
+# the previous one. The server splits long replies into packets of 4096
+# characters and doesn't say which one is the last, so after the first part
+# of a reply an empty packet of an unknown type is sent. The server answers
+# it ("Unknown request") after the whole reply, its answer ends the reply of
+# the command. Every connection has a reader thread that sends the next
+# packet, commands of several threads are queued and sent one by one.
+# ConnectionError means the command was not run (not sent, or the connection
+# closed before the server answered), TimeoutError means it was sent but the
+# reply didn't arrive (it may still have been run).
+# RconClient keeps a small pool of connections and reconnects when one breaks.
+
+import collections
+import itertools
+import os
+import socket
+import struct
+import threading
+import time
+
+_LOGIN = 3
+_COMMAND = 2
+_RESPONSE = 0
+_SENTINEL = 100  # unknown to the server, answered after the reply of the previous command
+_MAX_PACKET = 4096 + 14
+_MAX_COMMAND = 1460 - 14  # the server reads at most 1460 bytes per packet
+_QUICKACK = hasattr(socket, "TCP_QUICKACK")  # linux only
+
+
+def read_server_properties(directory: str) -> dict[str, str]:
+    properties = {}
+    try:
+        with open(os.path.join(directory, "server.properties"), encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#") and "=" in line:
+                    key, value = line.split("=", 1)
+                    properties[key.strip()] = value.strip()
+    except OSError:
+        pass
+    return properties
+
+
+def encode_packet(id: int, type: int, body: str) -> bytes:
+    data = struct.pack("<ii", id, type) + body.encode("utf-8") + b"\0\0"
+    return struct.pack("<i", len(data)) + data
+
+
+class _Request:
+    __slots__ = ("command", "event", "parts", "error")
+
+    def __init__(self, command: str):
+        self.command = command
+        self.event = threading.Event()
+        self.parts = []
+        self.error = None
+
+
+class RconConnection:
+
+    def __init__(self, host: str, port: int, password: str, timeout: float = 5.0):
+        self.host = host
+        self.port = port
+        self.password = password
+        self.timeout = timeout
+        self.closed = False
+
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._queue: collections.deque[_Request] = collections.deque()  # not sent yet
+        self._current: _Request | None = None  # sent, waiting for the reply
+        self._current_id = 0
+        self._sentinel_id = 0  # 0 until the sentinel of the current command was sent
+
+        try:
+            self._socket = socket.create_connection((host, port), timeout=timeout)
+            self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._login()
+        except OSError as e:
+            if hasattr(self, "_socket"):
+                self._socket.close()
+            raise ConnectionError(f"RCON connection to {host}:{port} failed: {e}") from e
+        # replies are waited for in wait(), the reader itself blocks
+        self._socket.settimeout(None)
+        self._reader = threading.Thread(target=self._read, daemon=True, name="rcon_reader")
+        self._reader.start()
+
+    def _login(self):
+        id = next(self._ids)
+        self._socket.sendall(encode_packet(id, _LOGIN, self.password))
+        reply_id, _, _ = self._read_packet()
+        if reply_id == -1:
+            raise ConnectionError("RCON login failed, wrong password")
+
+    def _recv_exactly(self, n: int) -> bytes:
+        data = bytearray()
+        while len(data) < n:
+            chunk = self._socket.recv(n - len(data))
+            if not chunk:
+                raise OSError("RCON connection closed")
+            if _QUICKACK:
+                # the next packet is only sent after this one arrived,
+                # a delayed ack would hold the server's next packet back ~40ms
+                self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+            data += chunk
+        return bytes(data)
+
+    def _read_packet(self) -> tuple[int, int, str]:
+        length, = struct.unpack("<i", self._recv_exactly(4))
+        if length < 10 or length > _MAX_PACKET * 4:
+            raise OSError(f"Invalid RCON packet length {length}")
+        data = self._recv_exactly(length)
+        id, type = struct.unpack("<ii", data[:8])
+        return id, type, data[8:-2].decode("utf-8", "replace")
+
+    def _read(self):
+        error = None
+        try:
+            while True:
+                id, _, body = self._read_packet()
+                self._received(id, body)
+        except OSError as e:
+            error = e
+        self._fail(error or OSError("RCON connection closed"))
+
+    def _fail(self, error: OSError):
+        # fail everything that is still waiting
+        with self._lock:
+            self.closed = True
+            current = self._current
+            queued = list(self._queue)
+            self._current = None
+            self._queue.clear()
+        if current is not None:
+            if current.parts:
+                current.error = TimeoutError(f"No complete RCON reply: {error}")
+            else:
+                # the server drops the connection instead of answering a packet it can't read
+                current.error = ConnectionError(f"RCON connection closed before the reply: {error}")
+            current.event.set()
+        for request in queued:
+            request.error = ConnectionError(f"RCON connection closed: {error}")
+            request.event.set()
+
+    def _write(self, id: int, type: int, body: str):
+        # called with the lock held, a failed write ends in _read
+        try:
+            self._socket.sendall(encode_packet(id, type, body))
+        except OSError:
+            self._shutdown()
+
+    def _send_next(self):
+        # called with the lock held
+        if self._current is not None or not self._queue or self.closed:
+            return
+        self._current = self._queue.popleft()
+        self._current_id = next(self._ids)
+        self._sentinel_id = 0
+        self._write(self._current_id, _COMMAND, self._current.command)
+
+    def _received(self, id: int, body: str):
+        with self._lock:
+            request = self._current
+            if request is None:
+                return
+            if id == self._current_id:
+                request.parts.append(body)
+                if not self._sentinel_id:
+                    # the server has read the command, it reads the
+                    # sentinel after the last part of the reply
+                    self._sentinel_id = next(self._ids)
+                    self._write(self._sentinel_id, _SENTINEL, "")
+                return
+            if id != self._sentinel_id or not self._sentinel_id:
+                return
+            # the whole reply of the command has arrived
+            self._current = None
+            self._send_next()
+        request.event.set()
+
+    def send(self, commands: list[str]) -> list[_Request]:
+        # queue the commands, use wait() to get the replies
+        for command in commands:
+            if len(command.encode("utf-8")) > _MAX_COMMAND:
+                raise ConnectionError(f"Command too long for RCON ({len(command)} characters)")
+        requests = [_Request(command) for command in commands]
+        with self._lock:
+            if self.closed:
+                raise ConnectionError("RCON connection closed")
+            self._queue.extend(requests)
+            self._send_next()
+        return requests
+
+    def wait(self, request: _Request, timeout: float | None = None) -> str:
+        if not request.event.wait(self.timeout if timeout is None else timeout):
+            with self._lock:
+                if request in self._queue:
+                    self._queue.remove(request)
+                    raise ConnectionError("RCON command was not sent, the connection is busy")
+            # the server didn't answer, nothing else can be sent on this connection
+            self._shutdown()
+            raise TimeoutError("No RCON reply")
+        if request.error is not None:
+            raise request.error
+        return "".join(request.parts)
+
+    def pending(self) -> int:
+        return len(self._queue) + (self._current is not None)
+
+    def _shutdown(self):
+        # the reader thread sees the closed socket and fails the requests
+        self.closed = True
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def close(self):
+        self._shutdown()
+        self._socket.close()
+
+
+class RconClient:
+
+    def __init__(self, host: str, port: int, password: str, connections: int = 2,
+                 timeout: float = 5.0, reconnect_delay: float = 1.0):
+        self.host = host
+        self.port = port
+        self.password = password
+        self.size = max(1, connections)
+        self.timeout = timeout
+        self.reconnect_delay = reconnect_delay
+        self._lock = threading.Lock()
+        self._connections: list[RconConnection | None] = [None] * self.size
+        self._last_attempt = 0.0
+
+    def _connection(self) -> RconConnection:
+        # a connection that is open, connects or reconnects if needed
+        with self._lock:
+            open_connections = [c for c in self._connections if c is not None and not c.closed]
+            if len(open_connections) == self.size:
+                # the one with the fewest replies outstanding
+                return min(open_connections, key=RconConnection.pending)
+
+            now = time.monotonic()
+            if now - self._last_attempt < self.reconnect_delay:
+                if open_connections:
+                    return min(open_connections, key=RconConnection.pending)
+                raise ConnectionError("RCON is not connected")
+            self._last_attempt = now
+
+            slot = next(i for i, c in enumerate(self._connections) if c is None or c.closed)
+            try:
+                connection = RconConnection(self.host, self.port, self.password, self.timeout)
+            except ConnectionError:
+                if open_connections:
+                    return min(open_connections, key=RconConnection.pending)
+                raise
+            self._connections[slot] = connection
+            return connection
+
+    def command(self, command: str, timeout: float | None = None) -> str:
+        return self.commands([command], timeout)[0]
+
+    def commands(self, commands: list[str], timeout: float | None = None) -> list[str]:
+        # queued on one connection, each is sent as soon as the previous one is answered
+        connection = self._connection()
+        try:
+            requests = connection.send(commands)
+        except ConnectionError:
+            # the connection broke, nothing was sent, try once on a new connection
+            self._last_attempt = 0.0
+            connection = self._connection()
+            requests = connection.send(commands)
+        return [connection.wait(request, timeout) for request in requests]
+
+    def close(self):
+        with self._lock:
+            for connection in self._connections:
+                if connection is not None:
+                    connection.close()
+            self._connections = [None] * self.size
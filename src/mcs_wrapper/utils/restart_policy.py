@@ -0,0 +1,108 @@
+# Restart policy and hang detection
+# RestartPolicy decides how long to wait before the server is started again.
+# Crashes (exits nobody asked for) are delayed with exponential backoff and
+# jitter, and when the server crashed more than `attempts` times within
+# `window` seconds, the wrapper gives up instead of restarting it forever.
+# HangDetector kills servers that stopped producing output and don't answer
+# a probe command either.
+
+import collections
+import random
+import threading
+import time
+
+
+class RestartPolicy:
+
+    def __init__(self, delay: float = 5.0, attempts: int = 5, window: float = 600.0,
+                 max_delay: float = 300.0, jitter: float = 0.2):
+        self.delay = delay
+        self.attempts = attempts  # 0 to never give up
+        self.window = window
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self._crashes = collections.deque()  # monotonic times of recent crashes
+
+    def recent_crashes(self, now: float | None = None) -> int:
+        if now is None:
+            now = time.monotonic()
+        while self._crashes and now - self._crashes[0] > self.window:
+            self._crashes.popleft()
+        return len(self._crashes)
+
+    def next_delay(self, crashed: bool) -> float | None:
+        # seconds to wait before restarting, None to give up
+        if not crashed:
+            # restart was requested, e.g. scheduled or by the sampler
+            return 0.0
+
+        now = time.monotonic()
+        self._crashes.append(now)
+        crashes = self.recent_crashes(now)
+        if self.attempts > 0 and crashes > self.attempts:
+            return None
+
+        delay = min(self.delay * 2 ** (crashes - 1), self.max_delay)
+        # spread out restarts of servers that crashed for the same reason
+        delay *= 1 + random.uniform(-self.jitter, self.jitter)
+        return max(0.0, delay)
+
+    def reset(self):
+        self._crashes.clear()
+
+
+class HangDetector:
+    # when there was no output for timeout / 2 seconds, `probe` is called,
+    # which should make the server print something. If there is still no
+    # output after `timeout` seconds, `on_hang` is called.
+
+    def __init__(self, timeout: float, probe, on_hang, interval: float = 1.0):
+        self.timeout = timeout
+        self.probe = probe
+        self.on_hang = on_hang
+        self.interval = interval
+        self.last_activity = time.monotonic()
+        self._probed = False
+        self._paused = True
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def activity(self):
+        # called for every batch of output lines, has to be cheap
+        self.last_activity = time.monotonic()
+
+    def resume(self):
+        # start checking, e.g. once the server is ready
+        self.last_activity = time.monotonic()
+        self._probed = False
+        self._paused = False
+
+    def start(self):
+        if self.timeout <= 0:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="hang_detector")
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            if self._paused:
+                continue
+            silent = time.monotonic() - self.last_activity
+            if silent < self.timeout / 2:
+                self._probed = False
+            elif silent >= self.timeout:
+                self._paused = True
+                self.on_hang(silent)
+            elif not self._probed:
+                self._probed = True
+                try:
+                    self.probe()
+                except Exception as e:
+                    print(f"Failed to probe server: {e}")
@@ -0,0 +1,376 @@
+# Full-text search over chat and event history
+# messages are appended to messages.log, the byte offset of a message is its id.
+# An inverted index maps every token to the sorted ids of the messages that
+# contain it. New messages go to an in-memory tail, which is handed to a
+# background thread every `segment_size` messages and written as a segment
+# file. Segment files are mapped, only their token table is kept in memory.
+# When the last _MERGE_FACTOR segments are of the same size they are merged
+# into one, so a message is rewritten only log(messages / segment_size) times.
+# Messages that were logged but not yet written to a segment are indexed
+# again on startup.
+
+import array
+import json
+import mmap
+import os
+import queue
+import re
+import struct
+import sys
+import threading
+import time
+
+_TOKEN = re.compile(r"[a-z0-9_]+")
+_LOG_NAME = "messages.log"
+_SEGMENT_SUFFIX = ".seg"
+# pickled segments of older versions, they are removed and rebuilt from the log
+_OLD_SEGMENT_SUFFIX = ".idx"
+_MAGIC = b"MCSWSEG1"
+_HEADER = struct.Struct("<8sQ")  # magic, length of the json token table
+_MERGE_FACTOR = 4
+
+
+def tokenize(text: str) -> set[str]:
+    return set(_TOKEN.findall(text.lower()))
+
+
+def _write_segment(path: str, start: int, until: int, count: int, sizes: dict[str, int], chunks):
+    # sizes is the number of ids of every token, chunks are the arrays of ids
+    # of the tokens in the same order (a token may span several chunks)
+    tokens = {}
+    offset = 0
+    for token, size in sizes.items():
+        tokens[token] = [offset, size]
+        offset += size
+    table = json.dumps({"start": start, "until": until, "count": count,
+                        "byteorder": sys.byteorder, "tokens": tokens}).encode("utf-8")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(_MAGIC, len(table)))
+        f.write(table)
+        for ids in chunks:
+            ids.tofile(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class Hit:
+    def __init__(self, id: int, timestamp: float, author: str, content: str):
+        self.id = id
+        self.timestamp = timestamp
+        self.author = author
+        self.content = content
+
+    def __str__(self) -> str:
+        when = time.strftime("%Y-%m-%d %H:%M", time.localtime(self.timestamp))
+        if self.author == "server":
+            return f"[{when}] {self.content}"
+        return f"[{when}] <{self.author}> {self.content}"
+
+
+class _Segment:
+    # a segment file: header, json token table (token -> [offset, number of
+    # ids]) and the ids as 8 byte integers. The ids stay on disk and are only
+    # read when a token is searched
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            magic, length = _HEADER.unpack(self._file.read(_HEADER.size))
+            if magic != _MAGIC:
+                raise ValueError("not a segment file")
+            table = json.loads(self._file.read(length))
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError, struct.error):
+            self._file.close()
+            raise
+        self.start = table["start"]  # first message id in this segment
+        self.until = table["until"]  # message ids of this segment are < until
+        self.count = table["count"]  # number of messages
+        self.tokens = table["tokens"]
+        self._swap = table["byteorder"] != sys.byteorder
+        self._data = _HEADER.size + length
+
+    def get(self, token: str) -> array.array | None:
+        entry = self.tokens.get(token)
+        if entry is None:
+            return None
+        offset = self._data + entry[0] * 8
+        ids = array.array("Q")
+        ids.frombytes(self._map[offset:offset + entry[1] * 8])
+        if self._swap:
+            ids.byteswap()
+        return ids
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+class _PendingSegment:
+    # a full tail, searchable from memory until the writer thread saved it
+    path = None
+
+    def __init__(self, start: int, until: int, count: int, postings: dict[str, array.array]):
+        self.start = start
+        self.until = until
+        self.count = count
+        self.postings = postings
+
+    def get(self, token: str) -> array.array | None:
+        return self.postings.get(token)
+
+    def close(self):
+        pass
+
+
+class SearchIndex:
+
+    def __init__(self, directory: str, segment_size: int = 5000):
+        self.directory = directory
+        self.segment_size = segment_size
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._segments: list[_Segment | _PendingSegment] = []
+        self._tail: dict[str, array.array] = {}
+        self._tail_start = 0
+        self._tail_count = 0
+        self._next_segment = 0
+        self._log = None
+
+        self._log_path = os.path.join(directory, _LOG_NAME)
+        self._load_segments()
+        # segments are written and merged by one thread, in the order they were filled
+        self._writes = queue.SimpleQueue()
+        self._writer = threading.Thread(target=self._run, daemon=True, name="search_index")
+        self._writer.start()
+        self._recover()
+        self._log = open(self._log_path, "ab")
+        self._reader = open(self._log_path, "rb")
+        self._reader_lock = threading.Lock()
+
+    def _load_segments(self):
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith(_SEGMENT_SUFFIX):
+                try:
+                    self._segments.append(_Segment(path))
+                except (OSError, ValueError, KeyError, struct.error) as e:
+                    print(f"Ignoring search index segment {name}: {e}")
+                    continue
+                self._next_segment = max(self._next_segment, int(name[4:-len(_SEGMENT_SUFFIX)]) + 1)
+            elif name.endswith(".tmp") or name.endswith(_OLD_SEGMENT_SUFFIX):
+                os.remove(path)
+        # if the wrapper stopped during a merge, the merged segment and
+        # the segments it replaces both exist, keep only the merged one
+        self._segments.sort(key=lambda segment: (segment.start, -segment.until))
+        segments = []
+        for segment in self._segments:
+            if segments and segment.until <= segments[-1].until:
+                segment.close()
+                os.remove(segment.path)
+                continue
+            segments.append(segment)
+        self._segments = segments
+
+    def _recover(self):
+        # index messages that were logged but not written to a segment
+        indexed_until = self._segments[-1].until if self._segments else 0
+        self._tail_start = indexed_until
+        if not os.path.exists(self._log_path):
+            return
+
+        with open(self._log_path, "rb+") as f:
+            f.seek(indexed_until)
+            offset = indexed_until
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # incomplete last line after a crash
+                    f.truncate(offset)
+                    break
+                _, author, content = self._parse_record(line)
+                self._add_to_tail(offset, author, content)
+                offset += len(line)
+                if self._tail_count >= self.segment_size:
+                    with self._lock:
+                        self._freeze(offset)
+
+    @staticmethod
+    def _parse_record(line: bytes) -> tuple[float, str, str]:
+        timestamp, author, content = line.decode("utf-8", "replace").rstrip("\n").split("\t", 2)
+        return float(timestamp), author, content
+
+    def _add_to_tail(self, id: int, author: str, content: str):
+        tokens = tokenize(content)
+        tokens.add(f"from:{author.lower()}")
+        for token in tokens:
+            ids = self._tail.get(token)
+            if ids is None:
+                ids = self._tail[token] = array.array("Q")
+            ids.append(id)
+        self._tail_count += 1
+
+    def _freeze(self, until: int):
+        # hand the tail to the writer thread, it stays searchable meanwhile.
+        # Called with the lock held
+        segment = _PendingSegment(self._tail_start, until, self._tail_count, self._tail)
+        self._segments.append(segment)
+        self._tail = {}
+        self._tail_start = until
+        self._tail_count = 0
+        self._writes.put(segment)
+
+    def add(self, author: str, content: str, timestamp: float | None = None) -> int:
+        if timestamp is None:
+            timestamp = time.time()
+        content = content.replace("\t", " ").replace("\n", " ")
+        record = f"{timestamp:.0f}\t{author}\t{content}\n".encode("utf-8")
+        with self._lock:
+            id = self._log.tell()
+            self._log.write(record)
+            self._add_to_tail(id, author, content)
+            if self._tail_count >= self.segment_size:
+                self._log.flush()
+                self._freeze(self._log.tell())
+        return id
+
+    def flush(self):
+        # write the tail as a new segment (in the background)
+        with self._lock:
+            if self._tail_count == 0:
+                return
+            self._log.flush()
+            self._freeze(self._log.tell())
+
+    def _segment_path(self) -> str:
+        # only used by the writer thread (and before it is started)
+        path = os.path.join(self.directory, f"seg-{self._next_segment:06d}{_SEGMENT_SUFFIX}")
+        self._next_segment += 1
+        return path
+
+    def _run(self):
+        while True:
+            pending = self._writes.get()
+            if pending is None:
+                return
+            try:
+                self._save(pending)
+                self._merge_tiers()
+            except (OSError, ValueError) as e:
+                print(f"Failed to write search index segment: {e}")
+
+    def _save(self, pending: _PendingSegment):
+        # make sure the log is on disk before the segment that points into it,
+        # messages recovered at startup are read from the file already
+        if self._log is not None:
+            os.fsync(self._log.fileno())
+        path = self._segment_path()
+        sizes = {token: len(ids) for token, ids in pending.postings.items()}
+        _write_segment(path, pending.start, pending.until, pending.count, sizes, pending.postings.values())
+        segment = _Segment(path)
+        with self._lock:
+            self._segments[self._segments.index(pending)] = segment
+
+    def _tier(self, count: int) -> int:
+        tier = 0
+        size = self.segment_size * _MERGE_FACTOR
+        while count >= size:
+            tier += 1
+            size *= _MERGE_FACTOR
+        return tier
+
+    def _merge_tiers(self):
+        # merge the last _MERGE_FACTOR saved segments while they are of the
+        # same tier, segments get bigger towards the start of the list
+        while True:
+            with self._lock:
+                saved = [segment for segment in self._segments if segment.path is not None]
+            segments = saved[-_MERGE_FACTOR:]
+            if len(segments) < _MERGE_FACTOR or len({self._tier(segment.count) for segment in segments}) > 1:
+                return
+            self._merge(segments)
+
+    def _merge(self, segments: list[_Segment]):
+        sizes: dict[str, int] = {}
+        for segment in segments:
+            for token, (_, size) in segment.tokens.items():
+                sizes[token] = sizes.get(token, 0) + size
+        # segments are sorted by id, so appending keeps the ids sorted
+        chunks = (ids for token in sizes for segment in segments if (ids := segment.get(token)) is not None)
+        path = self._segment_path()
+        _write_segment(path, segments[0].start, segments[-1].until, sum(segment.count for segment in segments), sizes, chunks)
+        merged = _Segment(path)
+
+        with self._lock:
+            index = self._segments.index(segments[0])
+            self._segments[index:index + len(segments)] = [merged]
+            # searches copy the ids with the lock held, nobody reads the old maps anymore
+            for old in segments:
+                old.close()
+        for old in segments:
+            os.remove(old.path)
+
+    def _ids(self, token: str) -> array.array:
+        # all ids of a token, sorted
+        ids = array.array("Q")
+        for segment in self._segments:
+            segment_ids = segment.get(token)
+            if segment_ids is not None:
+                ids.extend(segment_ids)
+        tail_ids = self._tail.get(token)
+        if tail_ids is not None:
+            ids.extend(tail_ids)
+        return ids
+
+    def search(self, query: str, limit: int = 20, since: float | None = None) -> list[Hit]:
+        # all words must match, "from:<player>" only returns messages of that player
+        # results are sorted newest first
+        terms = query.lower().split()
+        tokens = set()
+        for term in terms:
+            if term.startswith("from:"):
+                tokens.add(term)
+            else:
+                tokens |= tokenize(term)
+        if not tokens:
+            return []
+
+        with self._lock:
+            postings = sorted((self._ids(token) for token in tokens), key=len)
+            self._log.flush()
+
+        if len(postings) == 1:
+            # ids are already sorted
+            candidates = reversed(postings[0])
+        else:
+            # intersect, starting with the rarest token
+            result = set(postings[0])
+            for ids in postings[1:]:
+                if not result:
+                    break
+                result.intersection_update(ids)
+            candidates = sorted(result, reverse=True)
+
+        hits = []
+        with self._reader_lock:
+            for id in candidates:
+                self._reader.seek(id)
+                timestamp, author, content = self._parse_record(self._reader.readline())
+                if since is not None and timestamp < since:
+                    break
+                hits.append(Hit(id, timestamp, author, content))
+                if len(hits) >= limit:
+                    break
+        return hits
+
+    def close(self):
+        self.flush()
+        self._writes.put(None)
+        self._writer.join()
+        self._log.close()
+        self._reader.close()
+        with self._lock:
+            for segment in self._segments:
+                segment.close()
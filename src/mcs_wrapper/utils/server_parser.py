@@ -1,4 +1,5 @@
 import re
+from .death_messages import DeathMatcher, DEFAULT_DEATH_MESSAGES
 
 # Parse and extract data from the server output
 # regex patterns and functions that can be imported by other modules
@@ -31,6 +32,36 @@ def player_left(message: str) -> str | None:
         return match.group(1)
     return None
 
+# Check if the server is lagging behind
+# eg. Can't keep up! Is the server overloaded? Running 2003ms or 40 ticks behind
+# returns the number of ticks the server is behind
+_SERVER_LAG = re.compile(r"Can't keep up! Is the server overloaded\? Running (\d+)ms or (\d+) ticks behind")
+def server_lag(message: str) -> int | None:
+    match = _SERVER_LAG.match(message)
+    if match is not None:
+        return int(match.group(2))
+    return None
+
+# TPS as reported by the tps command of paper/spigot servers
+# eg. TPS from last 1m, 5m, 15m: 20.0, 20.0, 20.0 (may contain color codes)
+# returns the tps of the last minute
+_SERVER_TPS = re.compile(r"TPS from last 1m, 5m, 15m: (?:§.)?\*?([\d.]+)")
+def server_tps(message: str) -> float | None:
+    match = _SERVER_TPS.search(message)
+    if match is not None:
+        return float(match.group(1))
+    return None
+
+# Output of the list command
+# eg. There are 2 of a max of 20 players online: Steve, Alex
+# returns the names of the online players
+_PLAYER_LIST = re.compile(r"There are (\d+) of a max(?: of)? \d+ players online:(.*)")
+def player_list(message: str) -> list[str] | None:
+    match = _PLAYER_LIST.search(message)
+    if match is not None:
+        return [name.strip() for name in match.group(2).split(",") if name.strip()]
+    return None
+
 # Player message
 # returns (player, message) or None if message is not from a player
 def player_message(message: str) -> tuple[str, str] | None:
@@ -42,47 +73,38 @@ def player_message(message: str) -> tuple[str, str] | None:
     return None
 
 # Player death message
-# there are many different variations of death messages
-# so we will have to do multiple checks
-# TODO: add more death messages
-_DEATH_MESSAGES = [
-    re.compile(r"(\w+) died"),
-    re.compile(r"(\w+) tried to swim in lava"),
-    re.compile(r"(\w+) was pricked to death"),
-    re.compile(r"(\w+) walked into a cactus whilst trying to escape (\w+)"),
-    re.compile(r"(\w+) drowned"),
-    re.compile(r"(\w+) drowned whilst trying to escape (\w+)"),
-    re.compile(r"(\w+) was shot by arrow"),
-    re.compile(r"(\w+) was shot by (\w+)"),
-    re.compile(r"(\w+) was shot off a ladder by (\w+)"),
-    re.compile(r"(\w+) was shot off some vines by (\w+)"),
-    re.compile(r"(\w+) was shot off some twisting vines by (\w+)"),
-    re.compile(r"(\w+) was blown up by (\w+)"),
-    re.compile(r"(\w+) was blown up by (\w+) using (\w+)"),
-    re.compile(r"(\w+) was blown up by (\w+) using magic"),
-    re.compile(r"(\w+) was blown up by (\w+) using (\w+)"),
-    re.compile(r"(\w+) was blown up by (\w+)"),
-    re.compile(r"(\w+) was blown up by (\w+) using (\w+)"),
-    re.compile(r"(\w+) was blown up by (\w+) using magic"),
-    re.compile(r"(\w+) was killed by magic"),
-    re.compile(r"(\w+) was killed by (\w+) using magic"),
-    re.compile(r"(\w+) was killed by (\w+)"),
-    re.compile(r"(\w+) was killed by (\w+) using (\w+)"),
-    re.compile(r"(\w+) was killed by (\w+) using magic"),
-    re.compile(r"(\w+) was killed by (\w+)"),
-    re.compile(r"(\w+) was killed by (\w+) using (\w+)"),
-    re.compile(r"(\w+) was killed by (\w+) using magic"),
-    re.compile(r"(\w+) hit the ground too hard"),
-    re.compile(r"(\w+) fell from a high place")
-]
+# all death messages are matched with one regex, see death_messages.py
+# the built-in templates are replaced by the ones of the server version
+# when the wrapper starts
+# the regex is only compiled when the first death message is checked
+_death_templates = DEFAULT_DEATH_MESSAGES
+_death_matcher: DeathMatcher | None = None
+
+def set_death_messages(templates: dict[str, str]):
+    global _death_templates, _death_matcher
+    _death_templates = templates
+    _death_matcher = None
+
+def _get_death_matcher() -> DeathMatcher:
+    global _death_matcher
+    matcher = _death_matcher
+    if matcher is None:
+        matcher = _death_matcher = DeathMatcher(_death_templates)
+    return matcher
 
 def player_death(message: str) -> str | None:
-    for pattern in _DEATH_MESSAGES:
-        match = pattern.match(message)
-        if match is not None:
-            return match.group(1)
+    death = _get_death_matcher().match(message)
+    if death is not None:
+        return death[0]
     return None
 
+# Player death with details
+# returns (player, cause, killer) or None, cause is the death message
+# without the player and with the killer replaced by <killer>
+# eg. "Steve was shot by Skeleton" -> ("Steve", "was shot by <killer>", "Skeleton")
+def player_death_details(message: str) -> tuple[str, str, str | None] | None:
+    return _get_death_matcher().match(message)
+
 
 
 
@@ -0,0 +1,51 @@
+# Startup time report for "mcsw --profile-startup"
+# shows where the time until the server can be started is spent:
+# python imports (like -X importtime), config loading and extensions
+
+import subprocess
+import sys
+import time
+
+
+def import_times(module: str) -> list[tuple[str, int, int, int]]:
+    # import module in a fresh interpreter with -X importtime
+    # returns (name, self us, cumulative us, depth) for every imported module
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True)
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        times.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return times
+
+
+def profile_startup(directory: str, top: int = 15):
+    from ..wrapper import Wrapper
+
+    # imports, measured in a new interpreter so already loaded modules don't hide anything
+    times = import_times("mcs_wrapper.wrapper")
+    total = sum(t[1] for t in times)
+    print(f"Imports: {total / 1000:.1f} ms for {len(times)} modules")
+    print(f"{'cumulative ms':>14} {'self ms':>8}  module")
+    for name, self_us, cumulative_us, depth in sorted(times, key=lambda t: t[2], reverse=True)[:top]:
+        print(f"{cumulative_us / 1000:>14.1f} {self_us / 1000:>8.1f}  {'  ' * depth}{name}")
+
+    start = time.perf_counter()
+    wrapper = Wrapper(directory)
+    config_time = time.perf_counter() - start
+
+    modules_before = set(sys.modules)
+    start = time.perf_counter()
+    wrapper._load_builtin_extensions()
+    extensions_time = time.perf_counter() - start
+    new_modules = set(sys.modules) - modules_before
+    # only list third party packages, the standard library ones are too many to be useful
+    packages = {name.split(".")[0] for name in new_modules if not name.startswith("_")}
+    packages = sorted(packages - set(sys.stdlib_module_names) - {"mcs_wrapper", "cython_runtime"})
+
+    print(f"Config loading: {config_time * 1000:.1f} ms")
+    print(f"Extensions: {extensions_time * 1000:.1f} ms for {len(wrapper._listeners)} extensions, "
+          f"{len(new_modules)} modules imported (third party: {', '.join(packages) or 'none'})")
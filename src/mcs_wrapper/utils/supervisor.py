@@ -0,0 +1,353 @@
+# Supervisor for detachable servers
+# the server is started by a small separate process instead of the wrapper,
+# so the wrapper can be stopped, upgraded and started again while the server
+# keeps running. The supervisor keeps the last few MB of server output and
+# listens on <server directory>/supervisor.sock. A wrapper connects, sends
+# "ATTACH <offset>\n" and gets "OK <pid> <start>\n", followed by the output
+# since <start> and then the live output. An offset past the end of the
+# output attaches at the live end. Everything the wrapper sends after
+# the hello is written to the stdin of the server. Only one wrapper can be
+# attached, a new one replaces the old one. When the server exits, its exit
+# code is written to supervisor.exit and the supervisor stops.
+#
+# usage: python -m mcs_wrapper.utils.supervisor <server directory> <command...>
+# only stdlib imports, the wrapper package can be upgraded while this runs
+
+import argparse
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+SOCKET_NAME = "supervisor.sock"
+EXIT_NAME = "supervisor.exit"
+OFFSET_NAME = "supervisor.offset"
+LOG_NAME = "supervisor.log"
+BUFFER_SIZE = 4 * 1024 * 1024
+_CHUNK_SIZE = 64 * 1024
+# attach offset for "only new output", also understood by older supervisors
+LIVE_OFFSET = 2 ** 62
+# how often the wrapper saves how far it has read, a wrapper that crashed
+# sees at most the output of the last interval again
+OFFSET_SAVE_INTERVAL = 1.0
+# a client that doesn't read for this long is dropped, so the server isn't
+# blocked by a stuck wrapper, the output stays in the buffer for the next attach
+SEND_TIMEOUT = 30.0
+
+
+class Supervisor:
+
+    def __init__(self, directory: str, command: list[str], buffer_size: int = BUFFER_SIZE):
+        self.directory = directory
+        self.command = command
+        self.buffer_size = buffer_size
+        self.socket_path = os.path.join(directory, SOCKET_NAME)
+
+        self._lock = threading.Lock()
+        self._buffer = bytearray()
+        self._base = 0  # offset of _buffer[0] in the output
+        self._client: socket.socket | None = None
+        self._process = None
+        self._server = None
+
+    def run(self) -> int:
+        for name in (EXIT_NAME, OFFSET_NAME):
+            _remove(os.path.join(self.directory, name))
+
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        _remove(self.socket_path)
+        self._server.bind(self.socket_path)
+        os.chmod(self.socket_path, 0o600)
+        self._server.listen()
+
+        # stderr goes into the same stream, there is only one connection
+        self._process = subprocess.Popen(
+            self.command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            bufsize=0,
+            cwd=self.directory
+        )
+        # the wrapper kills the server, not the supervisor
+        signal.signal(signal.SIGTERM, lambda *_: self._process.terminate())
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+        threading.Thread(target=self._accept, daemon=True, name="accept").start()
+        self._read_output()
+        code = self._process.wait()
+
+        with open(os.path.join(self.directory, EXIT_NAME), "w") as f:
+            f.write(str(code))
+        with self._lock:
+            self._server.close()
+            _remove(self.socket_path)
+            if self._client:
+                self._client.close()
+                self._client = None
+        return code
+
+    def _read_output(self):
+        fd = self._process.stdout.fileno()
+        while True:
+            chunk = os.read(fd, _CHUNK_SIZE)
+            if not chunk:
+                return
+            with self._lock:
+                self._buffer += chunk
+                if len(self._buffer) > 2 * self.buffer_size:
+                    drop = len(self._buffer) - self.buffer_size
+                    del self._buffer[:drop]
+                    self._base += drop
+                if self._client:
+                    # blocks like a pipe would, if the wrapper doesn't read,
+                    # until SEND_TIMEOUT or a new client shuts this one down
+                    try:
+                        self._client.sendall(chunk)
+                    except OSError:
+                        self._client.close()
+                        self._client = None
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self._server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._attach, args=(client,), daemon=True, name="client").start()
+
+    def _attach(self, client: socket.socket):
+        client.settimeout(SEND_TIMEOUT)
+        try:
+            hello = _read_line(client)
+            command, _, offset = hello.partition(" ")
+            if command != "ATTACH":
+                client.close()
+                return
+            offset = int(offset or 0)
+
+            # the old client may hold the lock in sendall if it stopped reading,
+            # shutting it down wakes it up
+            old = self._client
+            if old:
+                try:
+                    old.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+            with self._lock:
+                if self._client:
+                    self._client.close()
+                # set before the replay, so the next client can shut this one down too
+                self._client = client
+                total = self._base + len(self._buffer)
+                start = min(max(offset, self._base), total)
+                client.sendall(f"OK {self._process.pid} {start}\n".encode())
+                client.sendall(self._buffer[start - self._base:])
+        except (OSError, ValueError):
+            with self._lock:
+                if self._client is client:
+                    self._client = None
+            client.close()
+            return
+
+        # forward everything the wrapper sends to the server
+        stdin = self._process.stdin
+        while True:
+            try:
+                data = client.recv(_CHUNK_SIZE)
+            except TimeoutError:
+                # the timeout is for sending, the wrapper may be quiet for long
+                continue
+            except OSError:
+                data = b""
+            if not data:
+                # detached, the server keeps running
+                with self._lock:
+                    if self._client is client:
+                        self._client = None
+                client.close()
+                return
+            try:
+                stdin.write(data)
+            except OSError:
+                return
+
+
+class SupervisedProcess:
+    # connection to a supervisor, used by the wrapper like a subprocess.Popen
+
+    def __init__(self, directory: str, sock: socket.socket, attached: bool):
+        self.directory = directory
+        self.attached = attached  # True if the server was already running
+        self.stdout = sock
+        self.stdin = sock.makefile("wb")
+        self.stderr = None
+        self.returncode = None
+        self._socket = sock
+        self._closed = threading.Event()
+        self._detaching = False
+
+        hello = _read_line(sock)
+        ok, pid, start = hello.split(" ")
+        if ok != "OK":
+            raise Exception(f"Unexpected answer from supervisor: {hello}")
+        self.pid = int(pid)
+        self.offset = int(start)  # output up to here was handled
+
+    @classmethod
+    def attach(cls, directory: str) -> "SupervisedProcess | None":
+        # connect to a running supervisor, None if there is none
+        sock = _connect(os.path.join(directory, SOCKET_NAME))
+        if sock is None:
+            return None
+        try:
+            with open(os.path.join(directory, OFFSET_NAME)) as f:
+                offset = int(f.read().strip())
+        except (OSError, ValueError):
+            # we don't know what was handled, replaying old output would
+            # send webhooks, kicks etc. again, so only read new output
+            print("No saved output offset, attaching at the live output")
+            offset = LIVE_OFFSET
+        sock.sendall(f"ATTACH {offset}\n".encode())
+        return cls(directory, sock, attached=True)
+
+    @classmethod
+    def start(cls, directory: str, command: list[str], timeout: float = 10.0) -> "SupervisedProcess":
+        for name in (EXIT_NAME, OFFSET_NAME):
+            _remove(os.path.join(directory, name))
+        with open(os.path.join(directory, LOG_NAME), "ab") as log:
+            # own session, so Ctrl+C in the wrapper terminal doesn't reach the server
+            subprocess.Popen(
+                [sys.executable, "-m", __spec__.name, directory, *command],
+                stdin=subprocess.DEVNULL,
+                stdout=log,
+                stderr=log,
+                cwd=directory,
+                start_new_session=True
+            )
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            sock = _connect(os.path.join(directory, SOCKET_NAME))
+            if sock is not None:
+                sock.sendall(b"ATTACH 0\n")
+                return cls(directory, sock, attached=False)
+            time.sleep(0.05)
+        raise Exception(f"Supervisor did not start, see {os.path.join(directory, LOG_NAME)}")
+
+    def read_lines(self, callback):
+        # like utils.line_reader.read_lines, but keeps track of the offset
+        # of the last complete line, so a reattached wrapper continues there
+        from .line_reader import LineSplitter, CHUNK_SIZE
+        splitter = LineSplitter()
+        fd = self._socket.fileno()
+        received = self.offset
+        saved = self.offset
+        last_save = time.monotonic()
+        while True:
+            try:
+                chunk = os.read(fd, CHUNK_SIZE)
+            except OSError:
+                break
+            if not chunk:
+                break
+            received += len(chunk)
+            lines = splitter.feed(chunk)
+            if lines:
+                callback(lines)
+            self.offset = received - splitter.pending_bytes()
+            now = time.monotonic()
+            if self.offset != saved and now - last_save >= OFFSET_SAVE_INTERVAL:
+                self._save_offset()
+                saved = self.offset
+                last_save = now
+        if not self._detaching:
+            lines = splitter.flush()
+            if lines:
+                callback(lines)
+        self._closed.set()
+
+    def detach(self):
+        # disconnect and leave the server running
+        self._detaching = True
+        self._socket.shutdown(socket.SHUT_RDWR)
+
+    def wait(self) -> int | None:
+        # returns the exit code of the server, None if it is still running
+        self._closed.wait()
+        exit_path = os.path.join(self.directory, EXIT_NAME)
+        try:
+            with open(exit_path) as f:
+                self.returncode = int(f.read().strip())
+            os.remove(exit_path)
+            _remove(os.path.join(self.directory, OFFSET_NAME))
+        except (OSError, ValueError):
+            # detached or lost the connection, remember where we stopped
+            self._save_offset()
+        self._socket.close()
+        return self.returncode
+
+    def _save_offset(self):
+        path = os.path.join(self.directory, OFFSET_NAME)
+        try:
+            with open(path + ".tmp", "w") as f:
+                f.write(str(self.offset))
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            print(f"Failed to save the supervisor offset: {e}")
+
+    def poll(self) -> int | None:
+        return self.returncode
+
+    def kill(self):
+        os.kill(self.pid, signal.SIGKILL)
+
+    def terminate(self):
+        os.kill(self.pid, signal.SIGTERM)
+
+
+def _connect(path: str) -> socket.socket | None:
+    if not os.path.exists(path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        # left over from a supervisor that was killed
+        sock.close()
+        return None
+    return sock
+
+
+def _read_line(sock: socket.socket) -> str:
+    # byte by byte, the output that follows must stay in the socket
+    data = bytearray()
+    while not data.endswith(b"\n"):
+        byte = sock.recv(1)
+        if not byte:
+            raise OSError("Connection closed")
+        data += byte
+    return data.decode().strip()
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs a server so the wrapper can attach to it")
+    parser.add_argument("directory", help="Server directory")
+    parser.add_argument("command", nargs=argparse.REMAINDER, help="Command to start the server")
+    args = parser.parse_args()
+    return Supervisor(os.path.abspath(args.directory), args.command).run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
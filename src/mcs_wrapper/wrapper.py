@@ -1,6 +1,7 @@
 # main class for the wrapper
 # handles server stdin/stdout and manages other modules
 
+import io
 import os
 import subprocess
 import threading
@@ -8,16 +9,32 @@ import time
 import re
 import datetime
 import argparse
+import shlex
+import sys
 from .utils.config import KVConfig, get_data_root
-from .extensions.updater import get_last_version, download_server_jar, find_version
 from .extensions.listener import Listener, AbstractWrapper, Message
 from dataclasses import dataclass
-from .utils.server_parser import player_message, is_server_ready
+from .utils.server_parser import player_message, is_server_ready, set_death_messages
+from .utils.death_messages import load_death_messages
 from .utils.cyclic_list import CyclicList
-from .extensions.discord_hook import DiscordHook
-from .extensions.herobrine import Herobrine
+from .utils.process_sampler import ProcessSampler
+from .utils.profiler import Profiler
+from .utils.line_reader import read_lines
+from .utils.flood_control import FloodControl, RateLimiter
+from .utils.restart_policy import RestartPolicy, HangDetector
+
+# extensions, the updater, the metrics endpoint and the optional services
+# (log file, console socket, RCON, detachable server, config watcher) are
+# imported when they are first used, so the wrapper starts without loading
+# requests, openai, http.server, socket, gzip or ctypes
 
 CONFIG_FILE = "wrapper.cfg"
+# config flags of the built-in extensions
+BUILTIN_EXTENSIONS = ["use_webhook", "use_herobrine", "use_search", "use_player_stats", "use_moderation", "use_pregen"]
+# console input starting with this prefix is handled by the wrapper instead of the server
+WRAPPER_COMMAND_PREFIX = "!wrapper"
+# seconds between checks for ended log floods and profile windows
+HOUSEKEEPING_INTERVAL = 1.0
 
 
 @dataclass
@@ -33,21 +50,86 @@ class WrapperConfig(KVConfig):
     server_version: str = "0.0"
     comment77: str = "# preferred_version: preferred server version"
     preferred_version: str = "latest"
+    comment78: str = "# start_command: command used to start the server (None to use the default java command)"
+    start_command: str = "None"
+    comment79: str = "# detachable: run the server under a supervisor process, so the wrapper can be stopped with \"!wrapper detach\" and attached again without stopping the server (Linux/macOS)"
+    detachable: bool = False
     comment8: str = "# auto_update: automatically update server"
     auto_update: bool = False
     comment9: str = "# use_snapshot: True to use snapshot server"
     use_snapshot: bool = False
     comment10: str = "# auto_restart: automatically restart server when it closes without \"stop\" command"
     auto_restart: bool = True
-    comment101: str = "# restart_delay: delay in seconds before restarting server"
+    comment101: str = "# restart_delay: delay in seconds before restarting server, doubled for every crash within restart_window"
     restart_delay: int = 5
-    comment102: str = "# restart_attempts: number of restart attempts before giving up"
+    comment102: str = "# restart_attempts: give up when the server crashed more often than this within restart_window (0 to never give up)"
     restart_attempts: int = 5
+    comment1021: str = "# restart_window: time in seconds crashes are counted for restart_attempts and the backoff"
+    restart_window: int = 600
+    comment1022: str = "# restart_max_delay: maximum delay in seconds before restarting a crashed server"
+    restart_max_delay: int = 300
+    comment1023: str = "# hang_timeout: kill and restart the server when it printed nothing and didn't answer hang_probe_command for this many seconds (0 to disable)"
+    hang_timeout: int = 0
+    hang_probe_command: str = "list"
     comment103: str = "# scheduled_restart: interval in hours to restart server"
     scheduled_restart: float = 0.0
+    comment104: str = "# sample_interval: interval in seconds to sample cpu/memory of the server process (0 to disable)"
+    sample_interval: float = 0.0
+    comment105: str = "# max_rss_mb: restart server when its memory usage exceeds this value in MB (0 to disable)"
+    max_rss_mb: int = 0
+    comment106: str = "# max_cpu_percent: restart server when its cpu usage stays above this value (0 to disable)"
+    max_cpu_percent: float = 0.0
+    comment107: str = "# max_cpu_seconds: how long the cpu usage has to stay above max_cpu_percent"
+    max_cpu_seconds: float = 120.0
+    comment108: str = "# metrics_port: port of the prometheus metrics endpoint (0 to disable)"
+    metrics_port: int = 0
+    comment109: str = "# metrics_host: address the metrics endpoint listens on"
+    metrics_host: str = "127.0.0.1"
+    comment110: str = "# profile_listeners: record time spent per listener (see \"!wrapper stats\")"
+    profile_listeners: bool = False
+    comment111: str = "# watch_config: apply changes of the config files without restarting"
+    watch_config: bool = True
+    comment112: str = "# flood_threshold: identical lines per second before they are collapsed (0 to disable)"
+    flood_threshold: int = 20
+    comment113: str = "# flood_sample_rate: while collapsing, still show every n-th line (0 to show none)"
+    flood_sample_rate: int = 100
+    comment114: str = "# console_max_lines: maximum lines per second printed to the console (0 for no limit)"
+    console_max_lines: int = 0
+    comment1144: str = "# use_rcon: send commands over RCON instead of stdin once the server is ready, extensions get the reply of the server (rcon_port 0 and rcon_password None are read from server.properties)"
+    use_rcon: bool = False
+    rcon_host: str = "127.0.0.1"
+    rcon_port: int = 0
+    rcon_password: str = "None"
+    rcon_connections: int = 2
+    rcon_timeout: float = 5.0
+    comment1145: str = "# console_socket: accept console clients on console.sock in the server directory (\"mcsw attach\"), console_history lines are shown when they connect"
+    console_socket: bool = False
+    console_history: int = 100
+    comment115: str = "# log_to_file: write server output and commands to wrapper_logs/latest.log"
+    log_to_file: bool = False
+    comment116: str = "# log_max_mb: rotate the log file when it is larger than this (0 for no limit)"
+    log_max_mb: int = 50
+    comment117: str = "# log_rotate_daily: start a new log file every day"
+    log_rotate_daily: bool = True
+    comment118: str = "# log_compression: compression of rotated logs (gzip, zstd or none)"
+    log_compression: str = "gzip"
+    comment119: str = "# log_retention_days: delete rotated logs after this many days (0 to keep them)"
+    log_retention_days: int = 30
     comment11: str = "# use_webhook: True to use discord webhook"
     use_webhook: bool = False
     use_herobrine: bool = False
+    comment14: str = "# use_search: index chat history, search it with \"!wrapper search\""
+    use_search: bool = False
+    comment15: str = "# use_player_stats: keep track of playtime, deaths and chat per player (\"!wrapper players\")"
+    use_player_stats: bool = False
+    comment16: str = "# use_moderation: warn, mute or kick players for banned words (banned_words.txt) and spam"
+    use_moderation: bool = False
+    comment17: str = "# use_pregen: generate the world around spawn while nobody is online (pregen.cfg, \"!wrapper pregen\")"
+    use_pregen: bool = False
+    comment12: str = "# use_plugins: load plugins installed through the mcs_wrapper.plugins entry points"
+    use_plugins: bool = True
+    comment13: str = "# disabled_plugins: comma separated names of plugins that should not be loaded"
+    disabled_plugins: str = ""
 
 
 class Wrapper(AbstractWrapper):
@@ -59,10 +141,19 @@ class Wrapper(AbstractWrapper):
         self.running = False
         self._server_running = False
         self._process = None
+        self._supervised = False  # the server was started by utils/supervisor.py, see detachable
         self._stdout = None
         self._stdin = None
+        self._stderr = None
         self._stdout_thread = None
+        self._stderr_thread = None
         self._stdin_thread = None
+        self._housekeeping_thread = None
+        self._dispatch_lock = threading.RLock()
+        self._create_flood_control()
+        self.log_sink = None  # LogSink, see utils/log_sink.py
+        self.console = None  # ConsoleServer, see utils/console.py
+        self.rcon = None  # RconClient, see utils/rcon.py
 
         self._listeners: list[Listener] = []
         self._next_message_id = 0
@@ -73,16 +164,51 @@ class Wrapper(AbstractWrapper):
         self.player_messages = []
 
         self._restart_scheduler = None
+        self._restart_scheduler_cancel = None
+        self._restart_requested = False
+        self._restart_wait_cancel = threading.Event()  # set to stop waiting for a restart
+        self.restart_policy = RestartPolicy()
+        self.hang_detector: HangDetector | None = None
+        self._hung = False
+        self.sampler: ProcessSampler | None = None
+        self.metrics = None  # WrapperMetrics, see utils/metrics.py
+        self.profiler: Profiler | None = Profiler() if self.config.profile_listeners else None
+        self.plugins = None  # PluginManager, see extensions/plugins.py
+        self._builtin_extensions: dict[str, Listener] = {}  # config flag -> extension
+        self._config_watcher = None  # ConfigWatcher, see utils/config_watcher.py
         self._running_lock = threading.Lock()
         self._server_ready_lock = threading.Lock()
         self._server_ready_lock_acquired = False
 
-
+        # name -> (function(args), help)
+        self._wrapper_commands = {}
+        self.add_wrapper_command("help", self._command_help, "- show this help")
+        self.add_wrapper_command("stats", self._command_stats, "[on|off|reset] - time spent per listener")
+        self.add_wrapper_command("profile", self._command_profile, "<seconds> - write a cProfile snapshot of the stdout thread")
+        self.add_wrapper_command("plugins", self._command_plugins, "- list installed plugins")
+        self.add_wrapper_command("rcon", self._command_rcon, "<command> - send a command over RCON and show the reply (use_rcon = True)")
+        self.add_wrapper_command("detach", self._command_detach, "- stop the wrapper, but keep the server running (detachable = True)")
+
+    # the list is replaced instead of modified, so listeners can be
+    # added or removed from other threads while messages are dispatched
     def add_listener(self, listener: Listener):
-        self._listeners.append(listener)
+        self._listeners = self._listeners + [listener]
+        self._watch_listener_config(listener)
 
     def remove_listener(self, listener: Listener):
-        self._listeners.remove(listener)
+        listeners = list(self._listeners)
+        listeners.remove(listener)
+        self._listeners = listeners
+        if self.metrics:
+            self.metrics.remove_listener(listener)
+        self._unwatch_listener_config(listener)
+
+    def add_wrapper_command(self, name: str, function, help: str = ""):
+        # register a console command, typed as "!wrapper <name> <args>"
+        self._wrapper_commands[name] = (function, help)
+
+    def remove_wrapper_command(self, name: str):
+        self._wrapper_commands.pop(name, None)
 
     def sleep(self, seconds: float):
         if not self._server_running:
@@ -105,6 +231,10 @@ class Wrapper(AbstractWrapper):
     def get_current_directory(self):
         return self.full_directory
 
+    def is_server_ready(self) -> bool:
+        # also True after attaching to a server that was already running
+        return self._server_running and not self._server_ready_lock_acquired
+
     def _load_config(self):
         directory = self.directory  # directory of server
         data_root = get_data_root()  # data root directory
@@ -141,14 +271,39 @@ class Wrapper(AbstractWrapper):
 
         self.config.save_config()
 
+    def _create_flood_control(self):
+        self.flood_control = None
+        if self.config.flood_threshold > 0:
+            self.flood_control = FloodControl(self.config.flood_threshold, self.config.flood_sample_rate)
+        self._console_limiter = None
+        if self.config.console_max_lines > 0:
+            self._console_limiter = RateLimiter(self.config.console_max_lines)
+
+    def _print_line(self, line):
+        if self._console_limiter is None or self._console_limiter.allow():
+            print(line)
+
+    def _print_lines(self, lines: list[str]):
+        # one write for the whole batch instead of one print per line
+        limiter = self._console_limiter
+        if limiter is not None:
+            lines = [line for line in lines if limiter.allow()]
+        if lines:
+            print("\n".join(lines))
+
     def _get_start_command(self):
+        if self.config.start_command != "None":
+            return shlex.split(self.config.start_command)
         return ["java", "-Xmx4096M", "-Xms1024M", "-jar", "server.jar", "nogui"]
     
     def _handle_line(self, line):
         # remove [Not Secure]
         line = line.replace("[Not Secure]", "")
-        print(line)
+        self._print_line(line)
+        self._dispatch_line(line)
 
+    def _dispatch_line(self, line):
+        # a printed line to messages and listeners
         line_raw = line
 
         # remove time and server thread info prefix: eg. [22:58:59] [Server thread/INFO]:
@@ -160,6 +315,8 @@ class Wrapper(AbstractWrapper):
             if self._server_ready_lock_acquired and is_server_ready(line):
                 self._server_ready_lock.release()
                 self._server_ready_lock_acquired = False
+                if self.hang_detector:
+                    self.hang_detector.resume()
         else:
             line = None
 
@@ -177,23 +334,146 @@ class Wrapper(AbstractWrapper):
 
         self._next_message_id += 1
 
+        # read once, "!wrapper stats off" or a config reload can set them
+        # to None from another thread while the listeners run
+        metrics = self.metrics
+        profiler = self.profiler
+        if metrics is None and profiler is None:
+            for listener in self._listeners:
+                listener.handle_message(message)
+            return
+
+        # same as above, but measure how long each listener takes
+        if metrics:
+            metrics.observe_message(line)
         for listener in self._listeners:
+            start = time.perf_counter()
             listener.handle_message(message)
+            duration = time.perf_counter() - start
+            if metrics:
+                metrics.listener_latency(listener).observe(duration)
+            if profiler and listener is not self.plugins:
+                # the plugin manager records every plugin by name
+                profiler.record(type(listener).__name__, duration, message)
+
+
+    def _handle_lines(self, lines: list[str], stream: str = "stdout"):
+        # stdout and stderr are read by different threads, but lines are handled one at a time
+        # each service is read once, other threads may replace or remove them
+        hang_detector = self.hang_detector
+        if hang_detector is not None:
+            hang_detector.activity()
+        with self._dispatch_lock:
+            profiler = self.profiler
+            if profiler is None:
+                self._process_lines(lines, stream)
+                return
+            # a running cProfile window only sees the threads it is enabled in
+            profiler.enable()
+            try:
+                self._process_lines(lines, stream)
+            finally:
+                profiler.disable()
+
+    def _process_lines(self, lines: list[str], stream: str):
+        # _handle_lines with the dispatch lock held
+        flood_control = self.flood_control
+        if flood_control is not None:
+            lines = flood_control.filter(lines)
+
+        log_sink = self.log_sink
+        console = self.console
+        if log_sink is not None or console is not None:
+            prefixed = lines if stream == "stdout" else [f"[{stream}] {line}" for line in lines]
+            if log_sink is not None:
+                log_sink.write_lines(prefixed)
+            if console is not None:
+                console.broadcast(prefixed)
+
+        lines = [line.replace("[Not Secure]", "") for line in lines]
+        self._print_lines(lines)
+
+        dispatch_line = self._dispatch_line
+        profiler = self.profiler
+        if profiler is None:
+            for line in lines:
+                dispatch_line(line)
+            return
 
+        for line in lines:
+            start = time.perf_counter()
+            dispatch_line(line)
+            profiler.record("_handle_line", time.perf_counter() - start)
 
-    def _read_stdout(self):
-        while self._server_running:
-            line = self._stdout.readline()
-            if line:
-                line = line.strip()
-                self._handle_line(line)
+    def _housekeeping(self):
+        # things that must also happen when the server prints nothing,
+        # _handle_lines only runs when there is output
+        while self.running:
+            time.sleep(HOUSEKEEPING_INTERVAL)
+            with self._dispatch_lock:
+                flood_control = self.flood_control
+                if flood_control is not None:
+                    summaries = flood_control.sweep()
+                    if summaries:
+                        self._handle_lines(summaries)
+                profiler = self.profiler
+                if profiler is not None:
+                    profiler.tick()
 
+    def _read_stdout(self):
+        # reads until the server closes its stdout
+        if self._supervised:
+            self._process.read_lines(self._handle_lines)
+        else:
+            read_lines(self._stdout.fileno(), self._handle_lines)
         print("stdout thread stopped")
 
-    def send_command(self, command: str):
+    def _read_stderr(self):
+        # stderr has to be drained too, a full pipe would block the server
+        read_lines(self._stderr.fileno(), lambda lines: self._handle_lines(lines, "stderr"))
+
+    def send_command(self, command: str) -> str | None:
+        # over RCON once the server is ready, so the reply can be returned
+        # "stop" always goes to stdin, the server closes the connection before replying
+        if command == "stop":
+            self._server_stopping()
+        rcon = self.rcon
+        if rcon is not None and command != "stop" and self.is_server_ready():
+            try:
+                reply = rcon.command(command)
+                self._command_sent(command)
+                return reply
+            except TimeoutError as e:
+                # it was sent, sending it again could run it twice
+                self._command_sent(command)
+                print(f"RCON command \"{command}\" failed: {e}")
+                return None
+            except Exception as e:
+                print(f"RCON is not available, using stdin: {e}")
+
         if self._stdin and self._stdin.writable():
             self._stdin.write(command + "\n")
             self._stdin.flush()
+            self._command_sent(command)
+
+    def _server_stopping(self):
+        # listeners get a last chance to send commands
+        for listener in self._listeners:
+            try:
+                listener.server_stopping()
+            except Exception as e:
+                print(f"{type(listener).__name__} failed before stop: {e}")
+
+    def _command_sent(self, command: str):
+        # read once, a config reload can replace them from another thread
+        log_sink = self.log_sink
+        if log_sink:
+            log_sink.write("> " + command)
+        console = self.console
+        if console:
+            console.broadcast(["> " + command])
+        if self.metrics:
+            self.metrics.commands.inc()
 
     def get_chat_history(self, n=10) -> list[Message]:
         n = min(n, len(self.player_messages))
@@ -207,6 +487,15 @@ class Wrapper(AbstractWrapper):
 
     def stop(self):
         self.running = False
+        self._restart_wait_cancel.set()
+        self.send_command("stop")
+
+    def restart(self, reason: str = None):
+        # stop the server and start it again, even if auto_restart is False
+        if reason:
+            print(f"Restarting server: {reason}")
+            self.send_command(f"say Server is restarting: {reason}")
+        self._restart_requested = True
         self.send_command("stop")
 
     def _read_stdin(self):
@@ -214,18 +503,103 @@ class Wrapper(AbstractWrapper):
         while self.running:
             try:
                 input_str = input()
-                if input_str and self._server_running and self._stdin and self._stdin.writable():
-                    self._stdin.write(input_str + "\n")
-                    self._stdin.flush()
-
-                    # special case:
-                    # if input_str is "stop", stop server even if auto_restart is True
-                    if input_str.lower() == "stop":
-                        self.running = False
+                if input_str.startswith(WRAPPER_COMMAND_PREFIX):
+                    self._handle_wrapper_command(input_str[len(WRAPPER_COMMAND_PREFIX):].strip())
+                    continue
+                self._handle_console_input(input_str)
 
             except EOFError:
                 return
 
+    def _handle_console_input(self, input_str: str):
+        # a command typed into the wrapper terminal or sent by a console client
+        if input_str and self._server_running and self._stdin and self._stdin.writable():
+            if input_str.lower() == "stop":
+                self._server_stopping()
+            self._stdin.write(input_str + "\n")
+            self._stdin.flush()
+            self._command_sent(input_str)
+
+            # special case:
+            # if input_str is "stop", stop server even if auto_restart is True
+            if input_str.lower() == "stop":
+                self.running = False
+        elif input_str.lower() == "stop" and not self._server_running:
+            # waiting to restart a crashed server
+            self.running = False
+            self._restart_wait_cancel.set()
+
+    def _handle_console_client_input(self, input_str: str) -> str | None:
+        # wrapper commands print to the wrapper terminal, so they are not
+        # available to console clients
+        if input_str.startswith(WRAPPER_COMMAND_PREFIX):
+            return "Wrapper commands can only be used in the wrapper terminal"
+        if not self._server_running and input_str.lower() != "stop":
+            return "The server is not running"
+        self._handle_console_input(input_str)
+        return None
+
+    def _handle_wrapper_command(self, command: str):
+        name, _, args = command.partition(" ")
+        if name not in self._wrapper_commands:
+            name = "help"
+        function, _ = self._wrapper_commands[name]
+        try:
+            function(args.strip())
+        except Exception as e:
+            print(f"Wrapper command {name} failed: {e}")
+
+    def _command_help(self, args: str):
+        print("Wrapper commands:")
+        for name, (_, help) in self._wrapper_commands.items():
+            print(f"  {WRAPPER_COMMAND_PREFIX} {name} {help}")
+
+    def _command_stats(self, args: str):
+        if args == "on":
+            self.profiler = self.profiler or Profiler()
+            print("Listener stats enabled")
+        elif args == "off":
+            self.profiler = None
+            print("Listener stats disabled")
+        elif self.profiler is None:
+            print(f"Listener stats are disabled, enable them with \"{WRAPPER_COMMAND_PREFIX} stats on\"")
+        elif args == "reset":
+            self.profiler.reset()
+            print("Listener stats reset")
+        else:
+            print(self.profiler.report())
+
+    def _command_profile(self, args: str):
+        seconds = float(args) if args else 10.0
+        if self.profiler is None:
+            self.profiler = Profiler()
+        name = datetime.datetime.now().strftime("profile-%Y%m%d-%H%M%S.pstats")
+        path = os.path.join(self.full_directory, "profiles", name)
+        self.profiler.request_profile(seconds, path)
+        print(f"Profiling the server output handling for {seconds:.0f}s")
+
+    def _command_rcon(self, args: str):
+        rcon = self.rcon
+        if rcon is None:
+            print("RCON is not enabled, set use_rcon = True")
+            return
+        print(rcon.command(args))
+
+    def _command_detach(self, args: str):
+        if not self._supervised or not self._server_running:
+            print("The server can only be detached when it was started with detachable = True")
+            return
+        print("Detaching, the server keeps running")
+        self.running = False
+        self._restart_wait_cancel.set()
+        self._process.detach()
+
+    def _command_plugins(self, args: str):
+        if self.plugins is None:
+            print("Plugins are disabled")
+            return
+        print(self.plugins.describe())
+
     def _accept_eula(self):
         eula_file = os.path.join(self.full_directory, "eula.txt")
         with open(eula_file, "w") as f:
@@ -233,13 +607,50 @@ class Wrapper(AbstractWrapper):
             f.write("#Thu Jan 01 00:00:00 UTC 1970" + "\n")
             f.write("eula=true\n")
 
+    def _create_builtin_extension(self, flag: str) -> Listener:
+        # imports are done here so disabled extensions cost nothing
+        if flag == "use_webhook":
+            from .extensions.discord_hook import DiscordHook
+            return DiscordHook(self)
+        if flag == "use_herobrine":
+            from .extensions.herobrine import Herobrine
+            return Herobrine(self)
+        if flag == "use_search":
+            from .extensions.chat_search import ChatSearch
+            return ChatSearch(self)
+        if flag == "use_player_stats":
+            from .extensions.player_stats import PlayerStats
+            return PlayerStats(self)
+        if flag == "use_moderation":
+            from .extensions.chat_moderation import ChatModeration
+            return ChatModeration(self)
+        if flag == "use_pregen":
+            from .extensions.pregen import WorldPregen
+            return WorldPregen(self)
+        raise Exception(f"Unknown extension {flag}")
+
+    def _set_builtin_extension(self, flag: str, enabled: bool):
+        extension = self._builtin_extensions.pop(flag, None)
+        if extension is not None:
+            self.remove_listener(extension)
+            extension.close()
+        if enabled:
+            extension = self._create_builtin_extension(flag)
+            self._builtin_extensions[flag] = extension
+            self.add_listener(extension)
+
     def _load_builtin_extensions(self):
         # load built-in extensions
-        if self.config.use_webhook:
-            self.add_listener(DiscordHook(self))
+        for flag in BUILTIN_EXTENSIONS:
+            if getattr(self.config, flag):
+                self._set_builtin_extension(flag, True)
 
-        if self.config.use_herobrine:
-            self.add_listener(Herobrine(self))
+        if self.config.use_plugins:
+            from .extensions.plugins import PluginManager
+            disabled = {name.strip() for name in self.config.disabled_plugins.split(",") if name.strip()}
+            self.plugins = PluginManager(self, disabled)
+            if self.plugins.plugins:
+                self.add_listener(self.plugins)
 
 
     def _update_server(self) -> bool:
@@ -259,6 +670,8 @@ class Wrapper(AbstractWrapper):
 
         if not auto_update:
             return True
+
+        from .extensions.updater import get_last_version, download_server_jar, find_version
         
         # check if preferred version same as version
         if jar_exists:
@@ -295,13 +708,78 @@ class Wrapper(AbstractWrapper):
         return False
 
 
-    def _server_stopped(self):
+    def _server_stopped(self, code: int | None = None):
         # when the server stops, decide whether to restart it
-        # if not, set running to False
-        if self.config.auto_restart and self.running:
-            print("Restarting server...")
-        else:
+        # if not, set running to False. Exit code 0 (e.g. "stop" from a
+        # plugin or the console of the server) is a clean exit, not a crash
+        requested = self._restart_requested
+        hung = self._hung
+        self._restart_requested = False
+        self._hung = False
+        if not self.running or not (self.config.auto_restart or requested):
+            self.running = False
+            return
+
+        # config values are read here, so changes apply to the next restart
+        policy = self.restart_policy
+        policy.delay = self.config.restart_delay
+        policy.attempts = self.config.restart_attempts
+        policy.window = self.config.restart_window
+        policy.max_delay = self.config.restart_max_delay
+
+        crashed = hung or (not requested and code not in (0, None))
+        delay = policy.next_delay(crashed=crashed)
+        if delay is None:
+            print(f"Server crashed {policy.recent_crashes()} times in {policy.window}s, not restarting it again")
             self.running = False
+            return
+        if delay > 0:
+            print(f"Restarting server in {delay:.0f}s...")
+            self._restart_wait_cancel.clear()
+            if self._restart_wait_cancel.wait(delay) or not self.running:
+                self.running = False
+                return
+        print("Restarting server...")
+
+    def _start_hang_detector(self):
+        if self.config.hang_timeout <= 0:
+            return
+        self.hang_detector = HangDetector(
+            self.config.hang_timeout,
+            probe=self._probe_server,
+            on_hang=self._server_hung
+        )
+        self.hang_detector.start()
+        if not self._server_ready_lock_acquired:
+            # attached to a server that was already running
+            self.hang_detector.resume()
+
+    def _probe_server(self):
+        reply = self.send_command(self.config.hang_probe_command)
+        # replies over RCON are not printed, but they show the server is alive
+        if reply is not None and self.hang_detector:
+            self.hang_detector.activity()
+
+    def _server_hung(self, silent: float):
+        print(f"Server printed nothing for {silent:.0f}s and didn't answer \"{self.config.hang_probe_command}\", killing it")
+        self._hung = True
+        self._restart_requested = True
+        if self._process:
+            self._process.kill()
+
+    def _start_sampler(self):
+        if self.config.sample_interval <= 0:
+            return
+
+        self.sampler = ProcessSampler(
+            self._process.pid,
+            interval=self.config.sample_interval,
+            max_rss_mb=self.config.max_rss_mb,
+            max_cpu_percent=self.config.max_cpu_percent,
+            max_cpu_seconds=self.config.max_cpu_seconds,
+            on_limit=self.restart
+        )
+        self.sampler.start()
 
     def _start_restart_scheduler(self):
         interval = self.config.scheduled_restart
@@ -309,6 +787,9 @@ class Wrapper(AbstractWrapper):
         if interval <= 0:
             return
         
+        # set to stop this scheduler, e.g. when the interval changed
+        cancel = threading.Event()
+        self._restart_scheduler_cancel = cancel
 
         warnings = [10, 20, 30, 60, 5*60]
 
@@ -332,8 +813,10 @@ class Wrapper(AbstractWrapper):
         def scheduler_task():
             seconds_until_restart = interval * 3600
             self.wait_for_server_ready()
+            if cancel.is_set():
+                return
             self.send_command(f"say Server will restart in {sec_to_hms_str(seconds_until_restart)}")
-            while self._server_running and seconds_until_restart > 0:
+            while self._server_running and not cancel.is_set() and seconds_until_restart > 0:
                 next_warning = 0
                 warning_index = 0
                 while warning_index < len(warnings):
@@ -347,15 +830,16 @@ class Wrapper(AbstractWrapper):
 
                 sleep_time = seconds_until_restart - next_warning
                 if sleep_time > 0:
-                    sleep_completed = self.sleep(sleep_time)
-                    if sleep_completed:
-                        seconds_until_restart -= sleep_time
-                    else:
+                    # cancel is also set when the server stops
+                    cancelled = cancel.wait(sleep_time)
+                    if cancelled:
                         return
+                    seconds_until_restart -= sleep_time
                     
                 if seconds_until_restart <= 1:
                     self.send_command("say Server is restarting...")
-                    self.send_command("stop")
+                    # requested, so it is not counted as a crash
+                    self.restart()
                     return
                     
                 if warning_index > -1 and warning_index < len(warnings):
@@ -377,56 +861,261 @@ class Wrapper(AbstractWrapper):
         lock_aquired = self._running_lock.acquire()
         self._server_ready_lock_acquired = self._server_ready_lock.acquire()
 
-        # Here, subprocess.Popen creates new pipes for stdin, stdout, stderr
-        self._process = subprocess.Popen(
-            command, 
-            stdout=subprocess.PIPE, 
-            stderr=subprocess.PIPE, 
-            stdin=subprocess.PIPE, 
-            text=True,
-            bufsize=1, 
-            cwd=self.full_directory
-        )
-
-        self._stdin = self._process.stdin
+        self._supervised = self.config.detachable
+        if self._supervised:
+            self._process = self._start_supervised(command)
+        else:
+            # Here, subprocess.Popen creates new pipes for stdin, stdout, stderr
+            # stdout and stderr are raw binary pipes, see utils/line_reader.py
+            self._process = subprocess.Popen(
+                command, 
+                stdout=subprocess.PIPE, 
+                stderr=subprocess.PIPE, 
+                stdin=subprocess.PIPE, 
+                bufsize=0, 
+                cwd=self.full_directory
+            )
+
+        self._stdin = io.TextIOWrapper(self._process.stdin, encoding="utf-8", write_through=True)
         self._stdout = self._process.stdout
         self._stderr = self._process.stderr
 
         self._server_running = True
+        if self.metrics:
+            self.metrics.server_started()
 
-        self._stdout_thread = threading.Thread(target=self._read_stdout, daemon=True)
+        self._stdout_thread = threading.Thread(target=self._read_stdout, daemon=True, name="stdout_thread")
         self._stdout_thread.start()
+        self._stderr_thread = None
+        if self._stderr is not None:
+            self._stderr_thread = threading.Thread(target=self._read_stderr, daemon=True, name="stderr_thread")
+            self._stderr_thread.start()
 
         if self.config.scheduled_restart > 0:
             self._start_restart_scheduler()
 
-        self._process.wait()
+        self._start_sampler()
+        self._start_hang_detector()
+        self._create_rcon()
+
+        code = self._process.wait()
         self._server_running = False
         if lock_aquired:
             self._running_lock.release()
         self._clean_server_services()
-        print("Server closed")
+        if code is None:
+            print("Detached from server")
+        else:
+            print("Server closed")
+
 
+        self._server_stopped(code)
+
+    def _create_rcon(self):
+        # connects when the first command is sent
+        if not self.config.use_rcon:
+            return
+        from .utils.rcon import RconClient, read_server_properties
+        properties = read_server_properties(self.full_directory)
+        port = self.config.rcon_port or int(properties.get("rcon.port", "25575"))
+        password = self.config.rcon_password
+        if password == "None":
+            password = properties.get("rcon.password", "")
+            if properties.get("enable-rcon") != "true" or not password:
+                print("RCON is not enabled in server.properties (enable-rcon, rcon.password), using stdin")
+                return
+        self.rcon = RconClient(self.config.rcon_host, port, password, self.config.rcon_connections, self.config.rcon_timeout)
 
-        self._server_stopped()
+    def _start_log_sink(self):
+        if not self.config.log_to_file:
+            return
+        from .utils.log_sink import LogSink
+        log_sink = LogSink(
+            self.full_directory,
+            max_bytes=self.config.log_max_mb * 1024 * 1024,
+            rotate_daily=self.config.log_rotate_daily,
+            compression=self.config.log_compression,
+            retention_days=self.config.log_retention_days
+        )
+        log_sink.start()
+        if self.metrics:
+            self.metrics.register_queue("log_writer", log_sink.pending)
+        self.log_sink = log_sink
+
+    def _stop_log_sink(self):
+        # removed under the lock, so no batch is written to a stopped sink
+        with self._dispatch_lock:
+            log_sink = self.log_sink
+            self.log_sink = None
+        if log_sink:
+            log_sink.stop()
+
+    def _start_console(self):
+        if not self.config.console_socket:
+            return
+        from .utils.console import ConsoleServer
+        console = ConsoleServer(self.full_directory, self._handle_console_client_input, self.config.console_history)
+        if console.start():
+            self.console = console
+
+    def _stop_console(self):
+        with self._dispatch_lock:
+            console = self.console
+            self.console = None
+        if console:
+            console.stop()
+
+    def _start_supervised(self, command: list[str]):
+        from .utils.supervisor import SupervisedProcess
+        # attach to the server if it is still running from an earlier wrapper
+        process = SupervisedProcess.attach(self.full_directory)
+        if process is None:
+            return SupervisedProcess.start(self.full_directory, command)
+
+        print(f"Attached to running server (pid {process.pid})")
+        # it was ready long ago, the "Done" line may not be in the replayed output
+        if self._server_ready_lock_acquired:
+            self._server_ready_lock_acquired = False
+            self._server_ready_lock.release()
+        return process
 
     def _clean_server_services(self):
         self._server_running = False
-        # close pipes
-        if self._stdin:
-            self._stdin.close()
-        if self._stdout:
-            self._stdout.close()
 
+        # the readers stop at EOF, which happens when the server exits
         self._stdout_thread.join()
+        if self._stderr_thread:
+            self._stderr_thread.join()
+
+        # summarize floods that were still going on
+        if self.flood_control is not None:
+            self._handle_lines(self.flood_control.flush())
+
+        # close pipes
+        for pipe in (self._stdin, self._stdout, self._stderr):
+            if pipe:
+                try:
+                    pipe.close()
+                except OSError:
+                    # stdin may fail to flush when the server is gone
+                    pass
         self._stdin = None
         self._stdout = None
+        self._stderr = None
+
+        # stop sampling the old process
+        if self.sampler:
+            self.sampler.stop()
+        if self.hang_detector:
+            self.hang_detector.stop()
+            self.hang_detector = None
+        if self.rcon:
+            self.rcon.close()
+            self.rcon = None
+
+        # the server stopped before it was ready, the next start acquires the lock again
+        if self._server_ready_lock_acquired:
+            self._server_ready_lock_acquired = False
+            self._server_ready_lock.release()
 
         # wait for restart scheduler
         if self._restart_scheduler:
+            self._restart_scheduler_cancel.set()
             self._restart_scheduler.join()
             self._restart_scheduler = None
 
+    def _restart_restart_scheduler(self):
+        # start the scheduler again with the new interval
+        # the old one is not joined, it may still be waiting for the server to be ready
+        if self._restart_scheduler:
+            self._restart_scheduler_cancel.set()
+            self._restart_scheduler = None
+        if self._server_running:
+            self._start_restart_scheduler()
+
+    def _watch_listener_config(self, listener: Listener):
+        config = getattr(listener, "config", None)
+        if self._config_watcher is None or not isinstance(config, KVConfig):
+            return
+
+        def reload():
+            changed = config.reload()
+            if changed:
+                print(f"Reloaded {os.path.basename(config.get_path())}: {', '.join(sorted(changed))}")
+                listener.config_changed(changed)
+
+        self._config_watcher.watch(config.get_path(), reload)
+
+    def _unwatch_listener_config(self, listener: Listener):
+        config = getattr(listener, "config", None)
+        if self._config_watcher and isinstance(config, KVConfig):
+            self._config_watcher.unwatch(config.get_path())
+
+    def _start_config_watcher(self):
+        from .utils.config_watcher import ConfigWatcher
+        self._config_watcher = ConfigWatcher()
+        self._config_watcher.watch(self.config.get_path(), self._reload_config)
+        for listener in self._listeners:
+            self._watch_listener_config(listener)
+        self._config_watcher.start()
+
+    def _reload_config(self):
+        changed = self.config.reload()
+        if not changed:
+            return
+        print(f"Reloaded {CONFIG_FILE}: {', '.join(sorted(changed))}")
+
+        if "scheduled_restart" in changed:
+            self._restart_restart_scheduler()
+
+        if changed & {"sample_interval", "max_rss_mb", "max_cpu_percent", "max_cpu_seconds"}:
+            if self.sampler:
+                self.sampler.stop()
+                self.sampler = None
+            if self._server_running:
+                self._start_sampler()
+
+        if "hang_timeout" in changed:
+            if self.hang_detector:
+                self.hang_detector.stop()
+                self.hang_detector = None
+            if self._server_running:
+                self._start_hang_detector()
+
+        if changed & {"flood_threshold", "flood_sample_rate", "console_max_lines"}:
+            with self._dispatch_lock:
+                self._create_flood_control()
+
+        if "profile_listeners" in changed:
+            self.profiler = Profiler() if self.config.profile_listeners else None
+
+        if changed & {"log_to_file", "log_max_mb", "log_rotate_daily", "log_compression", "log_retention_days"}:
+            self._stop_log_sink()
+            self._start_log_sink()
+
+        if changed & {"console_socket", "console_history"}:
+            # attached clients are disconnected and can attach again
+            self._stop_console()
+            self._start_console()
+
+        if changed & {"use_rcon", "rcon_host", "rcon_port", "rcon_password", "rcon_connections", "rcon_timeout"}:
+            rcon = self.rcon
+            self.rcon = None
+            if rcon:
+                rcon.close()
+            if self._server_running:
+                self._create_rcon()
+
+        for flag in BUILTIN_EXTENSIONS:
+            if flag in changed:
+                self._set_builtin_extension(flag, getattr(self.config, flag))
+
+        needs_restart = changed & {"metrics_port", "metrics_host", "use_plugins", "disabled_plugins", "watch_config"}
+        if needs_restart:
+            print(f"Changes of {', '.join(sorted(needs_restart))} are applied when the wrapper restarts")
+        if "detachable" in changed and self._server_running:
+            print("The change of detachable is applied when the server restarts")
+
 
     def run(self):
         if self.running:
@@ -440,18 +1129,46 @@ class Wrapper(AbstractWrapper):
             print("Failed to acquire server.jar")
             self.running = False
             return
+
+        # death messages of this server version
+        templates = load_death_messages(os.path.join(self.full_directory, "server.jar"), get_data_root())
+        if templates:
+            set_death_messages(templates)
         
         # load built-in extensions
         self._load_builtin_extensions()
 
+        if self.config.metrics_port > 0:
+            from .utils.metrics import WrapperMetrics, start_metrics_server
+            self.metrics = WrapperMetrics(self)
+            start_metrics_server(self.config.metrics_port, self.config.metrics_host)
+
+        if self.config.watch_config:
+            self._start_config_watcher()
+
+        self._start_log_sink()
+        self._start_console()
+
         self._stdin_thread = threading.Thread(target=self._read_stdin, daemon=True, name="stdin_thread")
         self._stdin_thread.start()
+        self._housekeeping_thread = threading.Thread(target=self._housekeeping, daemon=True, name="housekeeping")
+        self._housekeeping_thread.start()
 
         self._accept_eula() # TODO: actually ask user to accept eula
         while self.running:
             self._run_server()
 
 
+        if self._config_watcher:
+            self._config_watcher.stop()
+            self._config_watcher = None
+
+        self._stop_log_sink()
+        self._stop_console()
+
+        for listener in self._listeners:
+            listener.close()
+
         # save config
         self.config.save_config()
         print("Shutting down...")
@@ -467,9 +1184,32 @@ class ListenerTester(Listener):
 
 def main():
     parser = argparse.ArgumentParser(description="Wrapper for Minecraft server")
+    parser.add_argument("action", nargs="?", choices=["run", "attach", "agent", "controller"], default="run",
+                        help="run the wrapper (default), attach to the console of a running wrapper, "
+                             "or run the fleet agent/controller (see utils/fleet.py)")
     parser.add_argument("--directory", "-d", help="Server directory", default="default")
+    parser.add_argument("--profile-startup", action="store_true", help="Show where the wrapper startup time is spent and exit")
     args = parser.parse_args()
 
+    if args.action == "attach":
+        from .utils.console import attach
+        sys.exit(attach(os.path.join(get_data_root(), args.directory)))
+
+    if args.action == "agent":
+        from .utils.fleet import Agent
+        Agent().serve()
+        return
+
+    if args.action == "controller":
+        from .utils.fleet import Controller
+        Controller().run()
+        return
+
+    if args.profile_startup:
+        from .utils.startup_profile import profile_startup
+        profile_startup(args.directory)
+        return
+
     wrapper = Wrapper(args.directory)
     wrapper.run()
 